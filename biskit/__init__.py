@@ -33,6 +33,7 @@ try:
 
 ##     from EDParser import EZDParser
 
+    from biskit.neighborGrid import NeighborGrid, NeighborGridError
     from biskit.pdbModel import PDBModel, PDBProfiles, PDBError
     from biskit.xplorModel import XplorModel
 
@@ -52,6 +53,7 @@ try:
     
 
     from .pdbDope import PDBDope
+    from .torsions import Torsions, TorsionError, dihedral
 ##     from Ramachandran import Ramachandran
     
     from .colorspectrum import ColorSpectrum, ColorError, colorRange
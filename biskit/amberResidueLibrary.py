@@ -20,12 +20,78 @@
 Collect and index AmberResidueType instances from amber topology files.
 """
 
+import os
+import sys
+import copy
+import pickle
+import hashlib
+import tempfile
+from collections.abc import Mapping
+
+import numpy as N
+
 from biskit import PDBModel, AmberPrepParser, StdLog
 import biskit.tools as T
 
 class AmberResidueLibraryError( Exception ):
     pass
 
+
+class ResidueTypeDict( Mapping ):
+    """
+    Read-only dictionary of AmberResidueType instances indexed by
+    three-letter residue code. Residue types are only created from the
+    parsed (or cached) residue records when they are first accessed.
+    """
+
+    def __init__( self, records ):
+        """
+        :param records: residue and atom records indexed by residue code,
+                        see `AmberPrepParser.parseResidue`
+        :type  records: { str : (dict, dict) }
+        """
+        self.records = records
+        self.__types = {}
+
+    def __getitem__( self, code ):
+        if code not in self.__types:
+            r, atoms = self.records[ code ]
+            atoms = dict( [ (k, copy.copy( v )) for k, v in atoms.items() ] )
+            self.__types[ code ] = AmberPrepParser.createResidue( dict(r),
+                                                                  atoms )
+        return self.__types[ code ]
+
+    def __contains__( self, code ):
+        return code in self.records
+
+    def __iter__( self ):
+        return iter( self.records )
+
+    def __len__( self ):
+        return len( self.records )
+
+    def atomNames( self, code ):
+        """
+        :return: atom names of residue type without creating it
+        :rtype: [str]
+        """
+        return self.records[ code ][1]['name']
+
+    def charges( self, code ):
+        """
+        :return: atomic partial charges of residue type without creating it
+        :rtype: array of float
+        """
+        return self.records[ code ][1]['partial_charge']
+
+    def atomkey( self, code ):
+        """
+        :return: uncompressed atom key (see `PDBModel.atomkey`) of residue
+                 type without creating it
+        :rtype: str
+        """
+        return ''.join( sorted( self.atomNames( code ) ) )
+
 class AmberResidueLibrary( object ):
     """
     A collection of reference residue types taken from Amber topology files.
@@ -60,15 +126,36 @@ class AmberResidueLibrary( object ):
     >>> ## or alternatively:
     >>> refres = lib['all_amino03', 'ALA']
     
+    Parsed topologies are kept in a cache folder (one file per topology) and
+    re-used as long as the topology file is unchanged (same modification
+    time and size or, failing that, same content). AmberResidueType 
+    instances are only created for residues that are actually looked up.
     """
     ## list of Amber topology files in decending priority
     F_RESTYPES = ['all_amino03.in',
                   'all_aminoct03.in',
                   'all_aminont03.in',
                   'all_nuc02.in' ]
+
+    #: default folder for pre-parsed topologies
+    CACHE = os.path.expanduser( '~/.biskit/cache' )
+
+    #: file extension of pre-parsed topologies
+    CACHE_EXT = '.reslib'
+
+    #: format version of pre-parsed topologies, increment to invalidate
+    CACHE_VERSION = 1
+
+    #: pickle protocol of cache entries (readable by any Python 3.4+)
+    CACHE_PROTOCOL = 4
+
+    #: Python and numpy version, part of the cache file name
+    CACHE_TAG = 'py%i%i_np%s' % ( sys.version_info[:2] +
+                                  ( ''.join( N.__version__.split('.')[:2] ), ) )
     
 
-    def __init__(self, topofiles=F_RESTYPES, log=None, verbose=False):
+    def __init__(self, topofiles=F_RESTYPES, log=None, verbose=False,
+                 cache=CACHE ):
         """
         :param topofiles: list of topology file names \
                           (default `all_*in` in `Biskit/data/amber/residues`)
@@ -77,15 +164,118 @@ class AmberResidueLibrary( object ):
         :type  log: biskit.LogFile
         :param verbose: add messages to log (default False)
         :type  verbose: bool
+        :param cache: folder for pre-parsed topologies, None disables the
+                      cache (default `~/.biskit/cache`)
+        :type  cache: str
         """       
-        self.aindex = {}  ## residue types indexed by atom key
+        self.aindex = {}  ## (topology, resname) indexed by atom key
         self.topoindex = {} ## residue types indexed by topo and resname
+        self._chargeTable = None ## cached result of chargeTable()
         
         self.log = log or StdLog()
         self.verbose = verbose
+        self.cache = cache
         
         for f in topofiles:
             self.addTopology( f )
+
+
+    def cacheFile( self, topofile ):
+        """
+        :param topofile: absolute path of topology file
+        :type  topofile: str
+        :return: cache file for given topology file (and the current Python
+                 and numpy version)
+        :rtype: str
+        """
+        h = hashlib.sha1( topofile.encode( 'utf-8' ) ).hexdigest()[:12]
+        return os.path.join( self.cache, '%s_%s_%s%s' % \
+                             (T.stripFilename( topofile ), h, self.CACHE_TAG,
+                              self.CACHE_EXT) )
+
+
+    def __fileInfo( self, topofile, content=False ):
+        """
+        :return: modification time, size and (optionally) sha1 of a file
+        :rtype: dict
+        """
+        st = os.stat( topofile )
+        r = { 'mtime': st.st_mtime, 'size': st.st_size }
+        if content:
+            with open( topofile, 'rb' ) as f:
+                r['sha1'] = hashlib.sha1( f.read() ).hexdigest()
+        return r
+
+
+    def __parse( self, topofile ):
+        """
+        :return: residue records indexed by residue code
+        :rtype: { str : (dict, dict) }
+        """
+        return dict( [ (r['code'].upper(), (r, atoms)) for r, atoms in
+                       AmberPrepParser( topofile ).residueRecords() ] )
+
+
+    def __dumpCache( self, topofile, data ):
+        """Write cache entry via temporary file, ignore any file errors."""
+        try:
+            if not os.path.exists( self.cache ):
+                os.makedirs( self.cache )
+            fd, ftemp = tempfile.mkstemp( '.tmp', 'reslib_', self.cache )
+            with os.fdopen( fd, 'wb' ) as f:
+                pickle.dump( data, f, protocol=self.CACHE_PROTOCOL )
+            os.replace( ftemp, self.cacheFile( topofile ) )
+
+        except (IOError, OSError) as why:
+            if self.verbose:
+                self.log.add( 'cannot cache %s: %r' % (topofile, why) )
+
+
+    def loadRecords( self, topofile ):
+        """
+        Parse topology file or load pre-parsed residue records from the cache.
+        Cache entries are used if they have the current CACHE_VERSION and the
+        topology file has the same modification time and size or the same
+        content (sha1 hash) as when the entry was created.
+
+        :param topofile: absolute path of topology file
+        :type  topofile: str
+        :return: residue records indexed by residue code
+        :rtype: { str : (dict, dict) }
+        """
+        if not self.cache:
+            return self.__parse( topofile )
+
+        info = self.__fileInfo( topofile )
+        data = None
+
+        ## a broken or incompatible entry is simply replaced
+        try:
+            with open( self.cacheFile( topofile ), 'rb' ) as f:
+                data = pickle.load( f )
+        except Exception:
+            data = None
+
+        if isinstance( data, dict ) and data.get('version') == self.CACHE_VERSION \
+           and data.get('source') == topofile:
+
+            if (data['mtime'], data['size']) == (info['mtime'], info['size']):
+                return data['records']
+
+            info = self.__fileInfo( topofile, content=True )
+            if data['sha1'] == info['sha1']:
+                data.update( info )
+                self.__dumpCache( topofile, data )
+                return data['records']
+
+        if 'sha1' not in info:
+            info = self.__fileInfo( topofile, content=True )
+
+        data = dict( info, version=self.CACHE_VERSION, source=topofile,
+                     records=self.__parse( topofile ) )
+        self.__dumpCache( topofile, data )
+
+        return data['records']
         
 
     def addTopology(self, topofile, override=False):
@@ -117,22 +307,28 @@ class AmberResidueLibrary( object ):
         if self.verbose:
             self.log.add('parsing %s...' % topofile )
 
-        resdic = AmberPrepParser( topofile ).residueDict()
+        resdic = ResidueTypeDict(
+            self.loadRecords( AmberPrepParser.findFile( topofile ) ) )
         
         if self.verbose:
             self.log.add( 'Read %i residue definitions.\n' % len(resdic) )
         
+        if fbase in self.topoindex:
+            self.aindex = dict( [ (k, v) for k, v in self.aindex.items()
+                                  if v[0] != fbase ] )
+
         self.topoindex[ fbase ] = resdic
         
-        for resname, restype in resdic.items():
-            akey = restype.atomkey(compress=False)
+        for resname in resdic:
+            akey = resdic.atomkey( resname )
             
             if akey in self.aindex and not override:
                 raise AmberResidueLibraryError('duplicate residue entry: %s -> %s' %\
-                      (resname, self.aindex[akey].code))
+                      (resname, self.aindex[akey][1]))
 
-            self.aindex[ akey ] = restype
+            self.aindex[ akey ] = (fbase, resname)
         
+        self._chargeTable = None
         return self.topoindex[ fbase ]
 
 
@@ -148,6 +344,44 @@ class AmberResidueLibrary( object ):
         return residue.atomkey(compress=False)
   
     
+    def chargeTable( self ):
+        """
+        Compile the partial charges of all residue types into a lookup
+        table with one row per atom key and one column per atom name.
+        Charges of a whole structure can then be collected with a single
+        gather ( see `AtomCharger` )::
+
+          >>> keys, names, q = lib.chargeTable()
+          >>> q[ keys[ akey ], names['CA'] ]
+
+        Atom names that do not occur in a residue type have charge nan.
+        The table is created once and re-used until the next call to
+        `addTopology`.
+
+        :return: row index of each atom key, column index of each atom name,
+                 charge table (N_atomkeys x N_atomnames)
+        :rtype: ({str:int}, {str:int}, array of float)
+        """
+        if self._chargeTable is None:
+            keys = dict( ( k, i ) for i, k in enumerate( self.aindex ) )
+            names = {}
+            rows, cols, charges = [], [], []
+
+            for akey, (topo, resname) in self.aindex.items():
+                resdic = self.topoindex[ topo ]
+                anames = resdic.atomNames( resname )
+                rows += [ keys[ akey ] ] * len( anames )
+                cols += [ names.setdefault( a, len(names) ) for a in anames ]
+                charges += list( resdic.charges( resname ) )
+
+            q = N.full( ( len(keys), len(names) ), N.nan )
+            q[ rows, cols ] = charges
+
+            self._chargeTable = keys, names, q
+
+        return self._chargeTable
+
+
     def byAtoms(self, akey, default=None ):
         """
         Identify a matching reference residue by atom content.
@@ -160,7 +394,9 @@ class AmberResidueLibrary( object ):
         """
         if isinstance( akey, PDBModel ):
             akey = akey.atomkey(compress=False)
-        return self.aindex.get(akey, default)
+        if akey not in self.aindex:
+            return default
+        return self[ akey ]
     
     
     def byName(self, rescode, topo=None ):
@@ -204,11 +440,12 @@ class AmberResidueLibrary( object ):
             - `reslib[ PDBModel ]` -> `ResidueType` for matching residue
             - `reslib[ str(atomkey) ]` -> `ResidueType` with same atom key
         """
-        if type(key) is str:
-            return self.aindex[key]
-        
         if isinstance(key, PDBModel):
-            return self.aindex[ key.atomkey(compress=False) ]
+            key = key.atomkey(compress=False)
+
+        if type(key) is str:
+            topo, resname = self.aindex[key]
+            return self.topoindex[ topo ][ resname ]
  
         
     def topokeys( self ):
@@ -218,7 +455,7 @@ class AmberResidueLibrary( object ):
         return list(self.aindex.keys())
     
     def values( self ):
-        return list(self.aindex.values())
+        return [ self[ k ] for k in self.aindex ]
     
 #############
 ##  TESTING        
@@ -230,7 +467,7 @@ class Test(BT.BiskitTest):
 
     def test_amberResidueLibrary( self ):
         """AmberResidueLibrary test"""
-        self.lib = AmberResidueLibrary(verbose=self.local)
+        self.lib = AmberResidueLibrary(verbose=self.local, cache=None)
         ala = self.lib.byName('ALA', 'all_amino03')
         r   = self.lib[ ala ]
         self.assertEqual( r, ala )
@@ -238,6 +475,66 @@ class Test(BT.BiskitTest):
         self.assertEqual( r, ala )
         
         self.assertEqual( len( self.lib ), 114 )
+
+        self.assertEqual( len( self.lib.topoindex['all_nuc02'].records ),
+                          len( AmberPrepParser('all_nuc02.in').residueDict() ))
+
+        keys, names, q = self.lib.chargeTable()
+        row = q[ keys[ ala.atomkey(compress=False) ] ]
+        self.assertTrue( N.allclose( row[ [names[a] for a in ala['name']] ],
+                                     ala['partial_charge'] ) )
+        self.assertEqual( N.sum( N.isfinite( row ) ), len( ala ) )
+
+    def test_cache( self ):
+        """AmberResidueLibrary pre-parsed topology cache test"""
+        import shutil, time
+
+        self.folder = tempfile.mkdtemp( '', 'reslib_' )
+        f = os.path.join( self.folder, 'test_amino.in' )
+        shutil.copy( AmberPrepParser.findFile( 'all_amino03.in' ), f )
+
+        self.lib = AmberResidueLibrary( [f], cache=self.folder )
+        fcache = self.lib.cacheFile( f )
+        self.assertTrue( os.path.exists( fcache ) )
+
+        ## manipulate cache entry to see whether it is used
+        data = T.load( fcache )
+        data['records']['ALA'][1]['partial_charge'][0] = 42.
+        T.dump( data, fcache )
+
+        self.lib = AmberResidueLibrary( [f], cache=self.folder )
+        self.assertEqual( self.lib.byName('ALA')['partial_charge'][0], 42. )
+
+        ## same content but new modification time -> still valid
+        os.utime( f, (time.time() + 10, time.time() + 10) )
+        self.lib = AmberResidueLibrary( [f], cache=self.folder )
+        self.assertEqual( self.lib.byName('ALA')['partial_charge'][0], 42. )
+
+        ## changed content -> parse again
+        with open( f, 'a' ) as fh:
+            fh.write( '\n' )
+        self.lib = AmberResidueLibrary( [f], cache=self.folder )
+        self.assertNotEqual( self.lib.byName('ALA')['partial_charge'][0], 42.)
+
+        ## outdated format version -> parse again
+        data = T.load( fcache )
+        data['records']['ALA'][1]['partial_charge'][0] = 42.
+        data['version'] = 0
+        T.dump( data, fcache )
+
+        self.lib = AmberResidueLibrary( [f], cache=self.folder )
+        self.assertNotEqual( self.lib.byName('ALA')['partial_charge'][0], 42.)
+        self.assertEqual( len( self.lib ), 33 )
+
+        ## unreadable entry (e.g. newer pickle protocol) -> parse again
+        with open( fcache, 'wb' ) as fh:
+            fh.write( b'\x80\x09garbage' )
+        self.lib = AmberResidueLibrary( [f], cache=self.folder )
+        self.assertEqual( len( self.lib ), 33 )
+        self.assertEqual( T.load( fcache )['version'], self.lib.CACHE_VERSION )
+
+    def cleanUp( self ):
+        T.tryRemove( getattr( self, 'folder', '' ), tree=True )
         
 if __name__ == '__main__':
 
@@ -139,16 +139,30 @@ class AmberPrepParser( object ):
                      (default: 'all_amino03.in')
         :type  f_in: str
         """
-        f_in = f_in or self.F_DEFAULT
-        if not osp.exists( T.absfile( f_in ) ):
-            f_in = T.dataRoot() + '/amber/residues/' + f_in
+        f_in = self.findFile( f_in )
         
         self.firstrecord = re.compile( 'db[0-9]+\.dat' )
         
-        self.s = open( T.absfile( f_in ), 'r' ).read()
+        self.s = open( f_in, 'r' ).read()
         self.s = self.firstrecord.split( self.s )[-1] #skip until first residue
   
 
+    @classmethod
+    def findFile( cls, f_in=None ):
+        """
+        :param f_in: file name, looked for in the Biskit data folder
+                     (data/amber/residues) if not existing
+                     (default: 'all_amino03.in')
+        :type  f_in: str
+        :return: absolute path of prep file
+        :rtype: str
+        """
+        f_in = f_in or cls.F_DEFAULT
+        if not osp.exists( T.absfile( f_in ) ):
+            f_in = T.dataRoot() + '/amber/residues/' + f_in
+        return T.absfile( f_in )
+
+
     def residueBlocks( self ):
         i_from = 0
         i_to = self.s.find( 'DONE', i_from )
@@ -241,8 +255,16 @@ class AmberPrepParser( object ):
         return r, atoms
 
     
-    def createResidue( self, res, atoms ):
+    @staticmethod
+    def createResidue( res, atoms ):
         """
+        :param res: residue record as returned by `parseResidue`
+        :type  res: dict
+        :param atoms: atom records as returned by `parseResidue`
+                      (the 'xyz' entry is removed)
+        :type  atoms: dict
+        :return: residue type
+        :rtype: AmberResidueType
         """
         r = AmberResidueType( **res )
         r.letter = M.singleAA( [r.code] )[0]
@@ -266,9 +288,18 @@ class AmberPrepParser( object ):
         return r
 
     
-    def residueTypes( self ):
+    def residueRecords( self ):
+        """
+        Parse residues without creating AmberResidueType instances.
+
+        :return: residue and atom records, see `parseResidue`
+        :rtype: generator of (dict, dict)
+        """
         for resblock in self.residueBlocks():
-            r, atoms = self.parseResidue( resblock )
+            yield self.parseResidue( resblock )
+
+    def residueTypes( self ):
+        for r, atoms in self.residueRecords():
             yield self.createResidue( r, atoms )
         
     def residueDict( self ):
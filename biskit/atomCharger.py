@@ -164,53 +164,110 @@ class AtomCharger( object ):
                                      res['residue_number'][0], res['chain_id'][0])
         return r
 
-    def charge(self, model):
+    def atomkeys( self, model ):
         """
-        Assign atom charges to given model
+        Atom keys of all residues (see L{PDBModel.atomkey}) without
+        creating one PDBModel per residue.
         @param model: input structure
         @type  model: PDBModel
+        @return: one uncompressed atom key for each residue
+        @rtype: [str]
         """
-        q = N.array( [], float )
+        anames = list( model['name'] )
+        ri = list( model.resIndex() ) + [ len(model) ]
 
-        for j,res in enumerate(model.resModels()):
-            refres = self.lookupResidue( res )
+        return [ ''.join( sorted( anames[a:b] ) )
+                 for a, b in zip( ri[:-1], ri[1:] ) ]
 
-            if refres is None:
-                if self.verbose:
-                    self.log.add('Warning: no residue type for '+\
-                                 self.__resinfo(res,j) +\
-                                 '\nWhole residue will be set to charge 0.')
-                refres = res
-                refres['partial_charge'] = N.zeros( len(refres) )
 
-            iref, i = refres.compareAtoms( res )
+    def chargeResidue( self, res, j=0 ):
+        """
+        Assign atom charges to a single residue with a residue type matched
+        by atom content or, failing that, by name. This is the slow path
+        used by L{charge} for residues without exact atom key match.
+        @param res: single residue model
+        @type  res: PDBModel
+        @param j: residue position (only used for log messages)
+        @type  j: int
+        @return: charge of each atom in res
+        @rtype: array of float
+        """
+        refres = self.lookupResidue( res )
 
-            qres = N.take( refres['partial_charge'], iref )
+        if refres is None:
+            if self.verbose:
+                self.log.add('Warning: no residue type for '+\
+                             self.__resinfo(res,j) +\
+                             '\nWhole residue will be set to charge 0.')
+            refres = res
+            refres['partial_charge'] = N.zeros( len(refres) )
 
-            if len(iref) < len(refres):
-                if self.verbose:
-                    self.log.add('Warning: %i atoms missing from residue %s:'%\
-                                 (len(refres)-len(iref), self.__resinfo(res,j)) )
+        iref, i = refres.compareAtoms( res )
 
-                    missing = MA.difference( list(range(len(refres))), iref )
-                    self.log.add('\t'+str(N.take( refres['name'], missing )) )
-                    self.log.add(
-                        '\tIgnored. Residue will have incomplete charge.')
+        qres = N.take( refres['partial_charge'], iref )
 
-            if len(i) < len( res ):
-                if self.verbose:
-                    self.log.add('Warning: %i unknown  atoms in residue %s:' %\
-                                 (len(res)-len(i), self.__resinfo(res,j)) )
+        if len(iref) < len(refres):
+            if self.verbose:
+                self.log.add('Warning: %i atoms missing from residue %s:'%\
+                             (len(refres)-len(iref), self.__resinfo(res,j)) )
 
-                    missing = MA.difference( list(range(len(res))), i )
-                    self.log.add('\t'+str(N.take( res['name'], missing )) )
-                    self.log.add('\tGiving up. Whole residue will be set to charge 0.')
+                missing = MA.difference( list(range(len(refres))), iref )
+                self.log.add('\t'+str(N.take( refres['name'], missing )) )
+                self.log.add(
+                    '\tIgnored. Residue will have incomplete charge.')
 
-                qres = N.zeros( len(res) )
+        if len(i) < len( res ):
+            if self.verbose:
+                self.log.add('Warning: %i unknown  atoms in residue %s:' %\
+                             (len(res)-len(i), self.__resinfo(res,j)) )
 
-##            assert len(qres) == len(res), 'missmatch of atom number'
+                missing = MA.difference( list(range(len(res))), i )
+                self.log.add('\t'+str(N.take( res['name'], missing )) )
+                self.log.add('\tGiving up. Whole residue will be set to charge 0.')
 
-            q = N.concatenate( (q, qres ) )
+            qres = N.zeros( len(res) )
+
+        return qres
+
+
+    def charge(self, model):
+        """
+        Assign atom charges to given model. Residues with exactly the same
+        atom content as a library residue type are charged in one go from
+        the library's charge table (L{AmberResidueLibrary.chargeTable});
+        only the remaining residues are matched one by one.
+        @param model: input structure
+        @type  model: PDBModel
+        """
+        keys, names, table = self.reslib.chargeTable()
+
+        rows = N.array( [ keys.get( k, -1 ) for k in self.atomkeys( model ) ],
+                        int )
+        
+        anames = N.asarray( model['name'] )
+        if len( anames ):
+            vocab, codes = N.unique( anames, return_inverse=True )
+            cols = N.array( [ names.get( a, -1 ) for a in vocab ] )[ codes ]
+        else:
+            cols = N.zeros( 0, int )
+
+        resmap = N.asarray( model.resMap(), int )
+        if table.size:
+            q = table[ rows[ resmap ], cols ]
+        else:
+            q = N.full( len(model), N.nan )
+
+        ## residue without exact match (or, paranoid, with missing charge)
+        unmatched = rows < 0
+        unmatched[ resmap[ N.isnan( q ) ] ] = True
+
+        if N.any( unmatched ):
+            ires = N.flatnonzero( unmatched )
+            ri = model.resIndex()
+            re = model.resEndIndex()
+
+            for j, res in zip( ires, model.resModels( ires ) ):
+                q[ ri[j] : re[j]+1 ] = self.chargeResidue( res, j )
 
         assert len(q) == len(model), 'AtomCharger: missing charge records'
         model['partial_charge'] = q
@@ -235,7 +292,10 @@ class Test(BT.BiskitTest):
         if self.local:
             self.log.add('\nSetup Residue Library\n')
 
-        ac = AtomCharger(log=self.log, verbose=self.local)
+        ## cache=None -- do not write pre-parsed topologies to home folder
+        lib = AmberResidueLibrary( log=self.log, verbose=self.local,
+                                   cache=None )
+        ac = AtomCharger( lib, log=self.log, verbose=self.local )
 
         if self.local:
             self.log.add('match residues to Amber topology')
@@ -257,6 +317,12 @@ class Test(BT.BiskitTest):
 
         self.assertAlmostEqual( N.sum(self.m3['partial_charge']),-8.21, 2)
 
+        ## fast path and per-residue path give identical charges
+        for m in ( self.m1, self.m3 ):
+            q = N.concatenate( [ ac.chargeResidue( r, j ) for j, r in
+                                 enumerate( m.resModels() ) ] )
+            self.assertTrue( N.allclose( q, m['partial_charge'] ) )
+
 
 if __name__ == '__main__':
 
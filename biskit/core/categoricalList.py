@@ -0,0 +1,425 @@
+##
+## Biskit, a toolkit for the manipulation of macromolecular structures
+## Copyright (C) 2004-2018 Raik Gruenberg & Johan Leckner
+##
+## This program is free software; you can redistribute it and/or
+## modify it under the terms of the GNU General Public License as
+## published by the Free Software Foundation; either version 3 of the
+## License, or any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+## General Public License for more details.
+##
+## You find a copy of the GNU General Public License in the file
+## license.txt along with this program; if not, write to the Free
+## Software Foundation, Inc., 675 Mass Ave, Cambridge, MA 02139, USA.
+##
+##
+
+"""
+Compact list of (few distinct) str values, stored as integer codes.
+"""
+
+import numpy as N
+from collections.abc import MutableSequence
+
+
+class CategoricalList( MutableSequence ):
+    """
+    List replacement for profiles with many repetitions of few values
+    (atom names, residue names, chain ids, elements...). Each distinct
+    value is stored only once in `vocabulary`; the list itself is an
+    int32 array of `codes` pointing into the vocabulary. This needs a
+    fraction of the memory of a normal list of str and allows
+    vectorized extraction (take, compress), concatenation and
+    comparison (isin, apply).
+
+    CategoricalList behaves like a normal list -- it can be indexed,
+    modified, iterated over, compared to and concatenated with lists::
+
+      l = CategoricalList( ['CA', 'CB', 'CA'] )
+      l[0]               -> 'CA'
+      l[1] = 'N'         -> vocabulary is extended if needed
+      l + ['O']          -> CategoricalList
+      l == ['CA','N','CA'] -> True
+      l.isin( ['CA','N'] ) -> array([True, True, True])
+
+    Slices are returned as normal lists. Values must be hashable.
+    """
+
+    #: data type of codes
+    CODE_TYPE = N.int32
+
+    def __init__( self, values=() ):
+        """
+        :param values: initial values
+        :type  values: [str] OR array of str OR CategoricalList
+        """
+        self.vocabulary, self.codes = self.encode( values )
+        self.__index = None
+
+
+    @classmethod
+    def fromCodes( cls, codes, vocabulary ):
+        """
+        Create CategoricalList directly from codes and vocabulary.
+
+        :param codes: positions in vocabulary
+        :type  codes: array of int
+        :param vocabulary: distinct values
+        :type  vocabulary: [ any ]
+
+        :return: new list
+        :rtype: CategoricalList
+        """
+        r = cls()
+        r.codes = N.asarray( codes, cls.CODE_TYPE )
+        r.vocabulary = list( vocabulary )
+        return r
+
+
+    def encode( self, values ):
+        """
+        :param values: values to convert
+        :type  values: [str] OR array of str OR CategoricalList
+
+        :return: vocabulary and codes
+        :rtype: ([any], array of int)
+        """
+        if isinstance( values, CategoricalList ):
+            return list( values.vocabulary ), values.codes.copy()
+
+        if isinstance( values, N.ndarray ) and values.dtype.kind in 'US':
+            vocab, codes = N.unique( values, return_inverse=True )
+            return vocab.tolist(), codes.astype( self.CODE_TYPE )
+
+        index = {}
+        codes = N.fromiter( ( index.setdefault( v, len( index ) )
+                              for v in values ), self.CODE_TYPE )
+        return sorted( index, key=index.get ), codes
+
+
+    def __getstate__( self ):
+        return { 'vocabulary': self.vocabulary, 'codes': self.codes }
+
+    def __setstate__( self, state ):
+        self.__dict__.update( state )
+        self.__index = None
+
+
+    @property
+    def index_map( self ):
+        """
+        :return: dictionary mapping each value to its code
+        :rtype: { any : int }
+        """
+        if self.__index is None or len( self.__index ) != len(self.vocabulary):
+            self.__index = dict( ( v, i ) for i, v in
+                                 enumerate( self.vocabulary ) )
+        return self.__index
+
+
+    def code( self, value ):
+        """
+        :param value: any (new or existing) value
+        :type  value: any
+
+        :return: code of value, value is added to the vocabulary if needed
+        :rtype: int
+        """
+        index = self.index_map
+        if value not in index:
+            index[ value ] = len( self.vocabulary )
+            self.vocabulary.append( value )
+        return index[ value ]
+
+
+    def __vocabularyArray( self ):
+        """vocabulary as 1-D numpy array (str or object)"""
+        if all( [ isinstance( v, str ) for v in self.vocabulary ] ):
+            return N.array( self.vocabulary, str )
+
+        r = N.empty( len( self.vocabulary ), object )
+        r[:] = self.vocabulary
+        return r
+
+
+    def __array__( self, dtype=None ):
+        r = self.__vocabularyArray()[ self.codes ]
+        if dtype is not None:
+            r = r.astype( dtype )
+        return r
+
+
+    def __len__( self ):
+        return len( self.codes )
+
+
+    def __getitem__( self, i ):
+        if isinstance( i, slice ):
+            return [ self.vocabulary[c] for c in self.codes[i].tolist() ]
+        return self.vocabulary[ self.codes[i] ]
+
+
+    def __setitem__( self, i, value ):
+        if isinstance( i, slice ):
+            codes = N.array( [ self.code( v ) for v in value ],
+                             self.CODE_TYPE )
+            if len( range( *i.indices( len( self ) ) ) ) == len( codes ):
+                self.codes[i] = codes
+            else:
+                c = self.codes.tolist()
+                c[i] = codes.tolist()
+                self.codes = N.array( c, self.CODE_TYPE )
+            return
+
+        self.codes[i] = self.code( value )
+
+
+    def __delitem__( self, i ):
+        self.codes = N.delete( self.codes, i )
+
+
+    def insert( self, i, value ):
+        n = len( self )
+        i = min( i, n ) if i >= 0 else max( 0, n + i )
+        self.codes = N.insert( self.codes, i, self.code( value ) )
+
+
+    def __iter__( self ):
+        return map( self.vocabulary.__getitem__, self.codes.tolist() )
+
+
+    def __contains__( self, value ):
+        index = self.index_map
+        return value in index and bool( N.any( self.codes == index[value] ) )
+
+
+    def __eq__( self, other ):
+        if isinstance( other, CategoricalList ):
+            if len( self ) != len( other ):
+                return False
+            remap = N.array( [ self.index_map.get( v, -1 )
+                               for v in other.vocabulary ], int )
+            return bool( N.all( remap[ other.codes ] == self.codes ) )
+
+        if isinstance( other, list ):
+            return self.tolist() == other
+
+        return NotImplemented
+
+    __hash__ = None
+
+
+    def __add__( self, other ):
+        if isinstance( other, (list, CategoricalList) ):
+            return self.concat( other )
+        return NotImplemented
+
+    def __radd__( self, other ):
+        if isinstance( other, list ):
+            return CategoricalList( other ).concat( self )
+        return NotImplemented
+
+    def __iadd__( self, other ):
+        self.extend( other )
+        return self
+
+
+    def __repr__( self ):
+        return repr( self.tolist() )
+
+
+    def extend( self, values ):
+        self.codes = self.concat( values ).codes
+
+
+    def append( self, value ):
+        self.codes = N.append( self.codes, self.code( value ) ).astype(
+            self.CODE_TYPE )
+
+
+    def reverse( self ):
+        self.codes = self.codes[::-1].copy()
+
+
+    def count( self, value ):
+        index = self.index_map
+        if value not in index:
+            return 0
+        return int( N.sum( self.codes == index[ value ] ) )
+
+
+    def index( self, value, start=0, stop=None ):
+        i = self.index_map.get( value, -1 )
+        hits = N.flatnonzero( self.codes[ start:stop ] == i )
+        if i < 0 or len( hits ) == 0:
+            raise ValueError( '%r is not in list' % ( value, ) )
+        return int( hits[0] ) + start
+
+
+    def tolist( self ):
+        """
+        :return: normal list of values
+        :rtype: [ any ]
+        """
+        return list( iter( self ) )
+
+
+    def copy( self ):
+        return self.fromCodes( self.codes.copy(), self.vocabulary )
+
+
+    def take( self, indices ):
+        """
+        :param indices: positions to extract
+        :type  indices: [int]
+
+        :return: new list with values at given positions
+        :rtype: CategoricalList
+        """
+        return self.fromCodes( N.take( self.codes, indices ),
+                               self.vocabulary )
+
+
+    def compress( self, mask ):
+        """
+        :param mask: 1 for all positions to keep
+        :type  mask: [1|0]
+
+        :return: new list with values at masked positions
+        :rtype: CategoricalList
+        """
+        return self.take( N.flatnonzero( mask ) )
+
+
+    def concat( self, *lists ):
+        """
+        :param lists: lists to append to a copy of this one
+        :type  lists: CategoricalList OR [ any ]
+
+        :return: new list
+        :rtype: CategoricalList
+        """
+        r = self.copy()
+        codes = [ r.codes ]
+
+        for l in lists:
+            if not isinstance( l, CategoricalList ):
+                l = CategoricalList( l )
+            remap = N.array( [ r.code( v ) for v in l.vocabulary ],
+                             self.CODE_TYPE )
+            codes.append( remap[ l.codes ] if len( remap ) else l.codes )
+
+        r.codes = N.concatenate( codes ).astype( self.CODE_TYPE )
+        return r
+
+
+    def isin( self, values ):
+        """
+        Vectorized version of [ x in values for x in self ].
+
+        :param values: allowed values
+        :type  values: [ any ]
+
+        :return: mask
+        :rtype: array of bool
+        """
+        index = self.index_map
+        codes = [ index[v] for v in values if v in index ]
+        return N.isin( self.codes, codes )
+
+
+    def apply( self, f ):
+        """
+        Vectorized version of N.array( [ f(x) for x in self ] ). f is only
+        evaluated once for each distinct value.
+
+        :param f: function of a single value
+        :type  f: function
+
+        :return: result of f for each position
+        :rtype: array
+        """
+        if not self.vocabulary:
+            return N.array( [] )
+        return N.array( [ f( v ) for v in self.vocabulary ] )[ self.codes ]
+
+
+    def compact( self ):
+        """
+        Remove unused values from the vocabulary (e.g. after take or
+        after values have been overridden).
+        """
+        used, codes = N.unique( self.codes, return_inverse=True )
+        self.vocabulary = [ self.vocabulary[i] for i in used ]
+        self.codes = codes.astype( self.CODE_TYPE )
+        self.__index = None
+
+
+#############
+##  TESTING
+#############
+import biskit.test as BT
+
+class Test(BT.BiskitTest):
+    """Test CategoricalList"""
+
+    def test_listBehaviour(self):
+        """CategoricalList list compatibility test"""
+        ref = [ 'CA', 'CB', 'N', 'CA', 'O', 'CB' ]
+        self.l = CategoricalList( ref )
+
+        self.assertEqual( self.l, ref )
+        self.assertEqual( len( self.l.vocabulary ), 4 )
+        self.assertEqual( self.l[-1], 'CB' )
+        self.assertEqual( self.l[1:3], ['CB', 'N'] )
+        self.assertEqual( self.l.count( 'CA' ), 2 )
+        self.assertEqual( self.l.index( 'O' ), 4 )
+        self.assertTrue( 'N' in self.l and not 'X' in self.l )
+
+        self.l[2] = 'X'
+        ref[2] = 'X'
+        self.l.append( 'Y' )
+        ref.append( 'Y' )
+        del self.l[0]
+        del ref[0]
+        self.assertEqual( self.l, ref )
+
+        self.assertEqual( ['Z'] + self.l + ['Z'], ['Z'] + ref + ['Z'] )
+        self.assertTrue( isinstance( self.l + ref, CategoricalList ) )
+
+        self.assertTrue( N.all( N.array( self.l ) == N.array( ref ) ) )
+
+        import pickle
+        self.assertEqual( pickle.loads( pickle.dumps( self.l ) ), ref )
+
+    def test_vectorized(self):
+        """CategoricalList take/concat/isin test"""
+        ref = [ 'ALA', 'GLY', 'ALA', 'TRP', None ]
+        self.l = CategoricalList( ref )
+
+        self.assertEqual( self.l.take( [4, 0, 0] ), [None, 'ALA', 'ALA'] )
+        self.assertEqual( self.l.compress( [0,1,0,1,0] ), ['GLY', 'TRP'] )
+
+        self.c = self.l.concat( CategoricalList( ['TYR', 'GLY'] ), ['ALA'] )
+        self.assertEqual( self.c, ref + ['TYR', 'GLY', 'ALA'] )
+
+        self.assertEqual( self.l.isin( ['GLY', 'TRP', 'XXX'] ).tolist(),
+                          [ x in ['GLY', 'TRP'] for x in ref ] )
+        self.assertEqual( self.l.apply( lambda x: x == 'ALA' ).tolist(),
+                          [ x == 'ALA' for x in ref ] )
+
+        self.c = self.c.take( [0, 1] )
+        self.c.compact()
+        self.assertEqual( self.c.vocabulary, ['ALA', 'GLY'] )
+
+        self.a = CategoricalList( N.array( ['B', 'A', 'B'] ) )
+        self.assertEqual( self.a, ['B', 'A', 'B'] )
+
+
+if __name__ == '__main__':
+
+    BT.localTest()
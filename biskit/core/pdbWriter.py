@@ -0,0 +1,384 @@
+##
+## Biskit, a toolkit for the manipulation of macromolecular structures
+## Copyright (C) 2004-2018 Raik Gruenberg & Johan Leckner
+##
+## This program is free software; you can redistribute it and/or
+## modify it under the terms of the GNU General Public License as
+## published by the Free Software Foundation; either version 3 of the
+## License, or any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+## General Public License for more details.
+##
+## You find a copy of the GNU General Public License in the file
+## license.txt along with this program; if not, write to the Free
+## Software Foundation, Inc., 675 Mass Ave, Cambridge, MA 02139, USA.
+##
+##
+
+"""
+Fast writing of PDBModel coordinates (one or many frames) to PDB files.
+"""
+
+import io
+import copy
+
+import numpy as N
+
+import biskit.tools as T
+from biskit.core.scientificIO import PDB as IO
+
+
+class PDBWriter:
+    """
+    Write ATOM/HETATM and TER records of a PDBModel for one or many sets
+    of coordinates. All atom-specific columns (record type, serial number,
+    atom and residue names, chain id, occupancy, B-factor, element, etc.)
+    are formatted only once into a line template. Each set of coordinates
+    is then inserted into this template with a single string formatting
+    operation.
+
+    The output is identical to the one of
+    :class:`biskit.core.scientificIO.PDB.PDBFile` (which PDBModel.writePdb
+    used for each single atom before).
+
+    Usage::
+
+      w = PDBWriter( model )
+      w.write( 'model.pdb' )
+      w.writeModels( 'traj.pdb.gz', traj.frames )  ## MODEL/ENDMDL records
+    """
+
+    NUMBERS = [ str( i ) for i in range( 10 ) ]
+
+    #: format of coordinate columns (3F8.3)
+    XYZ_FORMAT = '%8.3f%8.3f%8.3f'
+
+    def __init__( self, model, ter=1, amber=0, original=0, left=0, wrap=0 ):
+        """
+        :param model: model providing atom profiles (and default coordinates)
+        :type  model: PDBModel
+        :param ter: Option of how to treat the terminal record:
+
+                    * 0 - don't write any TER statements
+                    * 1 - restore original TER statements (doesn't work, \
+                          if preceeding atom has been deleted) [default]
+                    * 2 - put TER between all detected chains
+                    * 3 - as 2 but also detect and split discontinuous chains
+
+        :type  ter: int
+        :param amber: amber formatted atom names
+                      (implies ter=3, left=1, wrap=0) (default 0)
+        :type  amber: 1||0
+        :param original: revert atom names to the ones parsed in from PDB
+                         (default 0)
+        :type  original: 1||0
+        :param left: left-align atom names (as in amber pdbs)(default 0)
+        :type  left: 1||0
+        :param wrap: write e.g. 'NH12' as '2NH1' (default 0)
+        :type  wrap: 1||0
+        """
+        self.model = model
+
+        if amber:
+            resnames = copy.copy( model.atoms['residue_name'] )
+            anames   = copy.copy( model.atoms['name'] )
+            model.xplor2amber()
+            ter = 3
+            wrap = 0
+            left = 1
+
+        try:
+            names = model.atoms['name']
+            if original and not amber:
+                names = model.atoms['name_original']
+
+            self.names = [ self.__atomName( a, left, wrap ) for a in names ]
+
+            #: positions after which a TER record follows
+            self.terAfter = self.__terPositions( ter )
+
+            self.lines = self.__atomLines()
+
+        finally:
+            if amber:
+                model.atoms['residue_name'] = resnames
+                model.atoms['name'] = anames
+
+        self.__templates = {}
+
+
+    def __atomName( self, aname, left, wrap ):
+        """atom name as it is passed on to the PDB formatter"""
+        ## PDBFile prints atom names 1 column too far left
+        if wrap and len(aname) == 4 and aname[0] in self.NUMBERS:
+            aname = aname[1:] + aname[0]
+        if not left and len(aname) < 4:
+            aname = ' ' + aname.strip()
+        return aname
+
+
+    def __terPositions( self, ter ):
+        """
+        :return: indices of atoms that are followed by a TER record
+        :rtype: set of int
+        """
+        if ter == 2 or ter == 3:
+            i = self.model.chainIndex( breaks=(ter==3) )[1:]
+        elif ter == 1:
+            i = N.flatnonzero( self.model.atoms['after_ter'] )
+        else:
+            return set()
+
+        return set( ( N.asarray( i, int ) - 1 ).tolist() )
+
+
+    def __column( self, key, default ):
+        """atom profile as list or [default] * atoms"""
+        if key in self.model.atoms:
+            p = self.model.atoms[ key ]
+            return p.tolist() if isinstance( p, N.ndarray ) else list( p )
+        return [ default ] * len( self.names )
+
+
+    @staticmethod
+    def _a( value, length ):
+        """Fortran A<length> field"""
+        return ( value + length * ' ' )[ :length ]
+
+    @staticmethod
+    def _i( value, length ):
+        """Fortran I<length> field"""
+        s = '' if value is None else repr( int( value ) )
+        return ( length * ' ' + s )[ -length: ]
+
+    @staticmethod
+    def _f( value, length, fraction ):
+        """Fortran F<length>.<fraction> field"""
+        s = '' if value is None else \
+            ( '%' + repr(length) + '.' + repr(fraction) + 'f' ) % value
+        return ( length * ' ' + s.upper() )[ -length: ]
+
+
+    def __atomLines( self ):
+        """
+        Pre-format all atom and TER records without coordinates.
+
+        :return: (text before coordinates, text after coordinates, TER record
+                 or None) for each atom
+        :rtype: [ (str, str, str) ]
+        """
+        a, i, f = self._a, self._i, self._f
+
+        c = self.__column
+        cols = zip( c( 'type', 'ATOM' ), c( 'serial_number', 1 ), self.names,
+                    c( 'alternate', '' ), c( 'residue_name', '' ),
+                    c( 'chain_id', '' ), c( 'residue_number', 1 ),
+                    c( 'insertion_code', '' ), c( 'occupancy', 0. ),
+                    c( 'temperature_factor', 0. ), c( 'segment_id', '' ),
+                    c( 'element', '' ), c( 'charge', '' ) )
+
+        r = []
+        for k, (rtype, serial, name, alt, resname, chain, resnum, icode,
+                occ, bfac, seg, elem, charge) in enumerate( cols ):
+
+            residue = a( resname.rjust( 3 ), 4 ) + a( chain, 1 ) + \
+                      i( resnum, 4 ) + a( icode, 1 )
+
+            head = a( rtype, 6 ) + i( serial, 5 ) + ' ' + a( name, 4 ) + \
+                   a( alt, 1 ) + residue + '   '
+
+            tail = f( occ, 6, 2 ) + f( bfac, 6, 2 ) + 6 * ' ' + \
+                   a( seg, 4 ) + a( elem.rjust( 2 ), 2 ) + a( charge, 2 )
+
+            ter = None
+            if k in self.terAfter:
+                ter = ( a( 'TER', 6 ) + i( serial, 5 ) + 6 * ' ' +
+                        residue ).rstrip()
+
+            r.append( ( head, tail.rstrip(), ter ) )
+
+        return r
+
+
+    def template( self, xyzformat=XYZ_FORMAT ):
+        """
+        :param xyzformat: place holder(s) for the 3 coordinates of each atom
+        :type  xyzformat: str
+
+        :return: format string for all atom (and TER) records of one model
+        :rtype: str
+        """
+        if xyzformat not in self.__templates:
+            r = []
+            for head, tail, ter in self.lines:
+                r.append( head.replace( '%', '%%' ) + xyzformat +
+                          tail.replace( '%', '%%' ) + '\n' )
+                if ter is not None:
+                    r.append( ter.replace( '%', '%%' ) + '\n' )
+
+            self.__templates[ xyzformat ] = ''.join( r )
+
+        return self.__templates[ xyzformat ]
+
+
+    def format( self, xyz=None ):
+        """
+        Create all ATOM/HETATM and TER records for one set of coordinates.
+
+        :param xyz: coordinates, N_atoms x 3 (default: None, model.xyz)
+        :type  xyz: array
+
+        :return: PDB records, separated and terminated by newline
+        :rtype: str
+        """
+        if xyz is None:
+            xyz = self.model.getXyz()
+
+        xyz = N.asarray( xyz )
+
+        if len( xyz ) != len( self.lines ):
+            raise ValueError( 'Expected %i coordinates, got %i.' %
+                              ( len( self.lines ), len( xyz ) ) )
+
+        values = xyz.ravel().tolist()
+
+        ## regular case: all values fit into the 8 columns of %8.3f
+        if N.all( N.isfinite( xyz ) ) and ( len( xyz ) == 0 or
+           ( N.max( xyz ) < 9999.9995 and N.min( xyz ) > -999.9995 ) ):
+            return self.template() % tuple( values )
+
+        ## otherwise cut numbers exactly like FortranLine does
+        values = [ self._f( v, 8, 3 ) for v in values ]
+        return self.template( '%s%s%s' ) % tuple( values )
+
+
+    def headerLines( self, lines ):
+        """
+        Format additional records with PDBFile.writeLine.
+
+        :param lines: [( str, dict or str)], list of record / data tuples
+        :type  lines: list of tuples
+
+        :return: formatted records
+        :rtype: str
+        """
+        if not lines:
+            return ''
+
+        s = io.StringIO()
+        f = IO.PDBFile( s, mode='w' )
+        for l in lines:
+            f.writeLine( l[0], l[1] )
+        f.open = 0  ## don't write END
+
+        return s.getvalue()
+
+
+    def write( self, fname, xyz=None, headlines=None, taillines=None ):
+        """
+        Write a PDB file (compressed if the name ends with .gz).
+
+        :param fname: name of new file
+        :type  fname: str
+        :param xyz: coordinates, N_atoms x 3 (default: None, model.xyz)
+        :type  xyz: array
+        :param headlines: [( str, dict or str)], list of record / data tuples::
+                          e.g. [ ('SEQRES', '  1 A 22  ALA GLY ALA'), ]
+        :type  headlines: list of tuples
+        :param taillines: same as headlines but appended after all atoms
+        :type  taillines: list of tuples
+        """
+        with T.gzopen( fname, 'wt' ) as f:
+            f.write( self.headerLines( headlines ) )
+            f.write( self.format( xyz ) )
+            f.write( self.headerLines( taillines ) )
+            f.write( 'END\n' )
+
+
+    def writeModels( self, fname, frames, serials=None ):
+        """
+        Write an NMR-style MODEL/ENDMDL PDB file (compressed if the name
+        ends with .gz). Frames are formatted and written one by one.
+
+        :param fname: name of new file
+        :type  fname: str
+        :param frames: coordinate sets, each N_atoms x 3
+        :type  frames: iterable of array (e.g. array N_frames x N_atoms x 3)
+        :param serials: MODEL serial numbers (default: None, 0, 1, 2 ..)
+        :type  serials: [int]
+        """
+        if serials is None:
+            serials = range( len( frames ) )
+
+        with T.gzopen( fname, 'wt' ) as f:
+            for n, xyz in zip( serials, frames ):
+                f.write( "MODEL%6i\n" % n )
+                f.write( self.format( xyz ) )
+                f.write( "ENDMDL\n" )
+
+            f.write( "END" )
+
+
+#############
+##  TESTING
+#############
+import biskit.test as BT
+
+class Test(BT.BiskitTest):
+    """Test PDBWriter"""
+
+    def prepare(self):
+        import tempfile
+        self.fout = tempfile.mktemp( '_writer.pdb' )
+
+    def cleanUp(self):
+        T.tryRemove( self.fout )
+        T.tryRemove( self.fout + '.gz' )
+
+    def test_format(self):
+        """PDBWriter line format test (compared to scientificIO.PDBFile)"""
+        from biskit import PDBModel
+
+        self.m = PDBModel( T.testRoot( 'rec/1A2P_rec_original.pdb' ) )
+        self.m.xyz[0] = [ 10000.1234, -1000.5, N.nan ]
+
+        self.w = PDBWriter( self.m, ter=2 )
+        s = self.w.format()
+
+        ## reference: PDBFile.writeLine for every atom
+        ref = io.StringIO()
+        f = IO.PDBFile( ref, mode='w' )
+        for i, a in enumerate( self.m.atoms.toDicts() ):
+            a['position'] = self.m.xyz[ i ]
+            a['name'] = self.w.names[ i ]
+            f.writeLine( a['type'], a )
+            if i in self.w.terAfter:
+                f.writeLine( 'TER', a )
+
+        self.assertEqual( s, ref.getvalue() )
+
+    def test_writeModels(self):
+        """PDBWriter.writeModels test"""
+        from biskit import PDBModel
+
+        self.m = PDBModel( T.testRoot( 'com/1BGS.pdb' ) )
+        frames = [ self.m.xyz, self.m.xyz + 1. ]
+
+        self.w = PDBWriter( self.m )
+        self.w.writeModels( self.fout + '.gz', frames, serials=[5, 6] )
+
+        with T.gzopen( self.fout + '.gz' ) as f:
+            lines = f.readlines()
+
+        self.assertEqual( lines[0], 'MODEL     5\n' )
+        self.assertEqual( lines[-1], 'END' )
+        self.assertEqual( len( [ l for l in lines if l[:4] == 'ATOM' ] ),
+                          2 * N.sum( self.m.maskFrom( 'type', 'ATOM' ) ) )
+
+
+if __name__ == '__main__':
+
+    BT.localTest()
@@ -26,8 +26,10 @@ Parse a PDB file into a PDBModel.
 .. seealso:: `biskit.PDBModel` `biskit.PDBParserFactory`
 """
 import biskit.core.scientificIO.PDB as IO
+from biskit.core.scientificIO.TextFile import TextFile
 import biskit.core.oldnumeric as N0
-import re
+import numpy as N
+import re, io
 
 import biskit as B
 import biskit.mathUtils as M
@@ -48,6 +50,34 @@ class PDBParseFile( PDBParser ):
                    
                    ]
 
+    #: fixed PDB columns (start, stop) of ATOM/HETATM records
+    COLUMNS = { 'serial_number' : (6, 11),
+                'name_original' : (12, 16),
+                'alternate' : (16, 17),
+                'residue_name' : (17, 21),
+                'chain_id' : (21, 22),
+                'residue_number' : (22, 26),
+                'insertion_code' : (26, 27),
+                'x' : (30, 38),
+                'y' : (38, 46),
+                'z' : (46, 54),
+                'occupancy' : (54, 60),
+                'temperature_factor' : (60, 66),
+                'segment_id' : (72, 76),
+                'element' : (76, 78),
+                'charge' : (78, 80) }
+
+    def __init__( self, log=None, bulk=True ):
+        """
+        :param log: Log for warnings [default log to STDERR]
+        :type  log: biskit.LogFile.LogFile
+        :param bulk: parse ATOM/HETATM records column-wise with numpy
+                     rather than line by line (default True)
+        :type  bulk: bool
+        """
+        PDBParser.__init__( self, log=log )
+        self.bulk = bulk
+
     @staticmethod
     def supports( source ):
         """
@@ -323,6 +353,261 @@ REMEDY: run the script fixAtomIndices.py
                  and (2) xyz array N x 3
         :rtype: ( list, array )
         """
+        headPatterns = headPatterns or self.RE_REMARKS
+        patterns = [ (key, re.compile(ex)) for key,ex in headPatterns ]
+
+        if self.bulk:
+            try:
+                return self.__collectBulk( fname, skipRes, list(patterns) )
+            except PDBParserError:
+                raise
+            except:
+                self.log.add('Warning: bulk parsing of %s failed, parsing '\
+                             'line by line.' % T.stripFilename( fname ) )
+
+        return self.__collectLines( fname, skipRes, patterns )
+
+
+    def __readRecords( self, fname ):
+        """
+        Read all lines of a (compressed) PDB file up to the first END or
+        ENDMDL record and sort them into header lines and ATOM/HETATM
+        records. TER records are only used to flag the atom that follows.
+
+        :param fname: name of pdb file
+        :type  fname: str
+
+        :return: header lines, atom lines, record types, after_ter flags
+        :rtype: ( [str], [str], [str], [int] )
+        """
+        f = TextFile( fname )
+        try:
+            text = f.read()
+        finally:
+            f.close()
+
+        if isinstance( text, bytes ):
+            text = text.decode( 'latin-1' )
+
+        header, atoms, types, after_ter = [], [], [], []
+        follows_ter = False
+
+        for l in text.splitlines():
+            l = l.strip()
+            if not l:
+                continue
+
+            rec = l[:6].rstrip()
+
+            if rec == 'END' or rec == 'ENDMDL':
+                break
+
+            if rec == 'ATOM' or rec == 'HETATM':
+                atoms.append( l )
+                types.append( rec )
+                after_ter.append( int( follows_ter ) )
+
+            elif not atoms:
+                header.append( l )
+
+            ## a TER record only flags the line directly following it
+            follows_ter = rec == 'TER' and not follows_ter
+
+        return header, atoms, types, after_ter
+
+
+    def __parseHeaderLines( self, lines, patterns ):
+        """
+        Extract HEADER, REMARK and BIOMT information from the lines
+        preceding the first atom record.
+
+        :param lines: header lines
+        :type  lines: [str]
+        :param patterns: [(putIntoKey, compiled regex)] REMARKS to extract
+        :type  patterns: [(str, regex)]
+
+        :return: info dictionary
+        :rtype: dict
+        """
+        info = {}
+        f = IO.PDBFile( io.StringIO( '\n'.join( lines ) ) )
+
+        line = f.readLine()
+
+        while line[0] != 'END':
+
+            if line[0] == 'HEADER':
+                info.update( self.__parseHeader( line ) )
+
+            if line[0] == 'REMARK':
+                if line[1].startswith(' 350'):
+                    biomtDict, line = self.__parseBiomt( f, line )
+                    info.update( biomtDict )
+                    continue
+                else:
+                    info.update( self.__parseRemark( line, patterns ) )
+
+            line = f.readLine()
+
+        return info
+
+
+    def __column( self, raw, key ):
+        """
+        :param raw: atom records as N x 80 array of byte values
+        :type  raw: array of uint8
+        :param key: field name (see COLUMNS)
+        :type  key: str
+        
+        :return: one fixed-width field of all records
+        :rtype: array of bytes
+        """
+        start, stop = self.COLUMNS[ key ]
+        return raw[:, start:stop].copy().view( 'S%i' % (stop-start) )[:,0]
+
+
+    def __numbers( self, raw, key, dtype ):
+        """
+        Convert one fixed-width column into numbers; blank fields become 0.
+        The fields are separated by blanks and parsed in a single
+        numpy.fromstring call.
+
+        :param raw: atom records as N x 80 array of byte values
+        :type  raw: array of uint8
+        :param key: field name (see COLUMNS)
+        :type  key: str
+        :param dtype: numpy type of result (int or float)
+        :type  dtype: type
+
+        :return: numbers
+        :rtype: array
+
+        :raise ValueError: if any field cannot be converted
+        """
+        start, stop = self.COLUMNS[ key ]
+        n = len( raw )
+
+        r = N.empty( (n, stop - start + 1), N.uint8 )
+        r[:, :-1] = raw[:, start:stop]
+        r[:, -1] = ord(' ')
+
+        blank = N.all( r == ord(' '), axis=1 )
+        r[ blank, -1 ] = ord('0')
+
+        values = N.fromstring( r.tobytes().decode('ascii'), dtype, sep=' ' )
+        if len( values ) != n:
+            raise ValueError('invalid number in PDB column %i-%i' %\
+                             (start+1, stop))
+        return values
+
+
+    def __strings( self, raw, key, strip=True ):
+        """
+        :param raw: atom records as N x 80 array of byte values
+        :type  raw: array of uint8
+        :param key: field name (see COLUMNS)
+        :type  key: str
+        :param strip: remove leading and trailing white space (default True)
+        :type  strip: bool
+
+        :return: one fixed-width column as list of str
+        :rtype: [ str ]
+        """
+        r = self.__column( raw, key )
+        if strip:
+            r = N.char.strip( r )
+        return r.astype( 'U' ).tolist()
+
+
+    def __collectBulk( self, fname, skipRes, patterns ):
+        """
+        Parse all ATOM/HETATM records in one go by slicing the fixed PDB
+        columns out of a N x 80 byte array. Results are identical to
+        __collectLines.
+
+        :param fname: name of pdb file
+        :type  fname: str
+        :param skipRes: list with residue names that should be skipped
+        :type  skipRes: list of str
+        :param patterns: [(putIntoKey, compiled regex)] REMARKS to extract
+        :type  patterns: [(str, regex)]
+
+        :return: tuple of (1) dictionary of profiles,
+                 (2) xyz array N x 3 and (3) info dictionary
+        :rtype: ( dict, array, dict )
+        """
+        header, lines, types, after_ter = self.__readRecords( fname )
+
+        info = self.__parseHeaderLines( header, patterns )
+
+        if len( lines ) == 0:
+            raise PDBParserError("Error parsing file "+fname+": "+
+                            "Couldn't find any atoms.")
+
+        ## non-ASCII characters would shift columns -> line-by-line parsing
+        buf = ''.join( [ l[:80].ljust(80) for l in lines ] ).encode('ascii')
+        raw = N.frombuffer( buf, N.uint8 ).reshape( len(lines), 80 )
+        after_ter = N.array( after_ter, int )
+
+        if skipRes:
+            resnames = self.__strings( raw, 'residue_name' )
+            keep = N.array( [ r not in skipRes for r in resnames ], bool )
+            raw = raw[ keep ]
+            after_ter = after_ter[ keep ]
+            types = [ t for t, k in zip( types, keep ) if k ]
+
+            if len( raw ) == 0:
+                raise PDBParserError("Error parsing file "+fname+": "+
+                                "Couldn't find any atoms.")
+
+        aProfs = {}
+
+        for k in ['serial_number', 'residue_number']:
+            aProfs[k] = self.__numbers( raw, k, int )
+
+        for k in ['occupancy', 'temperature_factor']:
+            aProfs[k] = self.__numbers( raw, k, float )
+
+        for k in ['alternate', 'residue_name', 'chain_id', 'insertion_code',
+                  'segment_id', 'element', 'charge']:
+            aProfs[k] = self.__strings( raw, k )
+
+        aProfs['name_original'] = self.__strings( raw, 'name_original',
+                                                  strip=False )
+        aProfs['name'] = [ n.strip() for n in aProfs['name_original'] ]
+
+        aProfs['type'] = types
+        aProfs['after_ter'] = after_ter
+
+        element = aProfs['element']
+        for i in [ i for i, e in enumerate( element ) if e == '' ]:
+            element[i] = self.__firstLetter( aProfs['name'][i] )
+
+        xyz = [ self.__numbers( raw, k, float ) for k in ['x', 'y', 'z'] ]
+        xyz = N.transpose( xyz ).astype( N0.Float32 )
+
+        aProfs = dict( [ (k, aProfs[k]) for k in B.PDBModel.PDB_KEYS ] )
+
+        return aProfs, xyz, info
+
+
+    def __collectLines( self, fname, skipRes=None, patterns=[] ):
+        """
+        Parse ATOM/HETATM lines from PDB record by record (see __collectAll).
+        This is the slower reference implementation which is used as
+        fall-back for files that cannot be parsed by __collectBulk.
+
+        :param fname: name of pdb file
+        :type  fname: str
+        :param skipRes: list with residue names that should be skipped
+        :type  skipRes: list of str
+        :param patterns: [(putIntoKey, compiled regex)] REMARKS to extract
+        :type  patterns: [(str, regex)]
+
+        :return: tuple of (1) dictionary of profiles,
+                 (2) xyz array N x 3 and (3) info dictionary
+        :rtype: ( dict, array, dict )
+        """
         xyz   = []
 
         aProfs = {}
@@ -330,10 +615,7 @@ REMEDY: run the script fixAtomIndices.py
         info = {}
 
         in_header = True
-        
-        headPatterns = headPatterns or self.RE_REMARKS
-        patterns = [ (key, re.compile(ex)) for key,ex in headPatterns ]
-        
+
         for k in B.PDBModel.PDB_KEYS:
             aProfs[k] = list()
 
@@ -426,7 +708,7 @@ REMEDY: run the script fixAtomIndices.py
 ##  TESTING        
 #############
 import biskit.test as BT
-import time
+import time, tempfile
 
 def clock( s, ns=globals() ):
     import cProfile
@@ -468,6 +750,59 @@ class Test(BT.BiskitTest):
         self.assertAlmostEqual( N0.sum( self.m.centerOfMass() ), 
                                 -74.1017, 1 )
 
+    def test_bulkParsing( self ):
+        """PDBParseFile bulk vs. line-by-line parsing test"""
+        f = T.testRoot() + '/biounit/2V4E.pdb'
+
+        self.m1 = PDBParseFile( bulk=True ).parse2new( f, skipRes=['HOH'] )
+        self.m2 = PDBParseFile( bulk=False ).parse2new( f, skipRes=['HOH'] )
+
+        self.assertTrue( N0.all( self.m1.xyz == self.m2.xyz ) )
+        self.assertEqual( self.m1.xyz.dtype, self.m2.xyz.dtype )
+        self.assertEqual( list(self.m1.info.keys()),
+                          list(self.m2.info.keys()) )
+
+        for k in self.m2.atoms.keys():
+            self.assertTrue( M.arrayEqual( self.m1[k], self.m2[k] ) or \
+                             self.m1[k] == self.m2[k], k )
+
+
+class LongTest(BT.BiskitTest):
+    """Benchmark bulk against line-by-line parsing"""
+
+    TAGS = [ BT.LONG ]
+
+    def prepare(self):
+        self.f_out = tempfile.mktemp( '.pdb', 'big_' )
+
+        records = [ l for l in open( T.testRoot() + '/biounit/2V4E.pdb' )
+                    if l[:6] in ['ATOM  ', 'HETATM', 'TER   '] ]
+
+        with open( self.f_out, 'w' ) as f:
+            f.writelines( records * 5 )
+
+    def cleanUp(self):
+        T.tryRemove( self.f_out )
+
+    def test_benchmark( self ):
+        """PDBParseFile bulk parsing benchmark"""
+        t = time.time()
+        self.m1 = PDBParseFile( bulk=True ).parse2new( self.f_out )
+        self.t_bulk = time.time() - t
+
+        t = time.time()
+        self.m2 = PDBParseFile( bulk=False ).parse2new( self.f_out )
+        self.t_lines = time.time() - t
+
+        if self.local:
+            print('%i atoms: bulk %5.2f s, line-by-line %5.2f s' %\
+                  (len(self.m1), self.t_bulk, self.t_lines))
+
+        self.assertTrue( N0.all( self.m1.xyz == self.m2.xyz ) )
+        self.assertEqual( self.m1['name_original'], self.m2['name_original'])
+        self.assertTrue( N0.all( self.m1['after_ter']==self.m2['after_ter']))
+        self.assertTrue( self.t_bulk < self.t_lines )
+
 
 
 if __name__ == '__main__':
@@ -23,6 +23,8 @@ from biskit import EHandler
 try:
     from .complex import Complex, ComplexError
     from .complexList import ComplexList, ComplexListError
+    from .poseSet import PoseSet, PoseSetError
+    from .contactScorer import ContactScorer, ContactScorerError
     from .complexModelRegistry import ComplexModelRegistry, RegistryError
     from .complexvc import ComplexVC
     from .complexvcList import ComplexVCList
@@ -27,6 +27,8 @@ from copy import deepcopy, copy
 from numpy import ndarray as arraytype
 from difflib import SequenceMatcher
 
+import numpy as N
+
 import biskit
 import biskit.core.oldnumeric as N0
 from biskit import PDBModel, molUtils, mathUtils, StdLog, EHandler
@@ -811,6 +813,9 @@ class Complex:
     def __atomContacts(self, cutoff, rec_mask, lig_mask, cache):
         """
         Intermolecular distances below cutoff after applying the two masks.
+        The dense distance matrix is only calculated if it is to be cached
+        (or a cached one is available), otherwise contacts are collected
+        from the sparse atom pairs of L{atomContactPairs}.
         
         @param cutoff: cutoff for B{atom-atom} contact in \AA
         @type  cutoff: float
@@ -824,12 +829,26 @@ class Complex:
         @return: atom contact matrix, array sum_rec_mask x sum_lig_mask
         @rtype: array
         """
+        ## get pair-wise distances -> atoms_rec x atoms_lig
+        dist = getattr( self, 'pw_dist', None )
+
+        if not cache and dist is None:
+            i, j = self.atomContactPairs( cutoff, rec_mask, lig_mask )
+
+            ## position of each atom within the masked atoms
+            rec_mask = N.asarray( rec_mask ).astype( bool )
+            lig_mask = N.asarray( lig_mask ).astype( bool )
+            i = N.take( N.cumsum( rec_mask ) - 1, i )
+            j = N.take( N.cumsum( lig_mask ) - 1, j )
+
+            r = N.zeros( ( N.sum(rec_mask), N.sum(lig_mask) ), bool )
+            r[ i, j ] = True
+            return r
+
         ## get atom coordinats as array 3 x all_atoms
         rec_xyz = self.rec().getXyz()
         lig_xyz = self.lig().getXyz()
 
-        ## get pair-wise distances -> atoms_rec x atoms_lig
-        dist = getattr( self, 'pw_dist', None )
         if dist is None or \
                N0.shape( dist ) != ( N0.sum(rec_mask), N0.sum(lig_mask) ):
             dist = self.__pairwiseDistances(N0.compress( rec_mask, rec_xyz, 0),
@@ -841,6 +860,40 @@ class Complex:
         return N0.less( dist, cutoff )
 
 
+    def atomContactPairs( self, cutoff=4.5, rec_mask=None, lig_mask=None ):
+        """
+        Find all inter-molecular B{atom-atom} contacts between rec and lig
+        without creating any rec x lig matrix. Only atom pairs from
+        neighboring cells of a spatial grid are compared. The grid is
+        built from (and cached with) the receptor model, so it is re-used
+        by all complexes that share the same receptor.
+        
+        @param cutoff: cutoff for atom - atom contact in \AA
+        @type  cutoff: float
+        @param rec_mask: atom mask (default: all heavy)
+        @type  rec_mask: [1|0]
+        @param lig_mask: atom mask (default: all heavy)
+        @type  lig_mask: [1|0]
+        
+        @return: receptor and ligand atom indices of all contacts,
+                 sorted by receptor atom
+        @rtype: (array of int, array of int)
+        """
+        if lig_mask is None:
+            lig_mask = self.lig().maskHeavy()
+
+        if rec_mask is None:
+            rec_mask = self.rec().maskHeavy()
+
+        lig_atoms = N.flatnonzero( lig_mask )
+        lig_xyz = N.take( self.lig().getXyz(), lig_atoms, 0 )
+
+        i, j = self.rec().pairsWithin( lig_xyz, cutoff )
+
+        keep = N.take( N.asarray( rec_mask ).astype( bool ), i )
+        return i[ keep ], N.take( lig_atoms, j[ keep ] )
+
+
     def atomContacts( self, cutoff=4.5, rec_mask=None, lig_mask=None, cache=0,
                       map_back=1 ):
         """
@@ -859,6 +912,8 @@ class Complex:
         
         @return: atom contact matrix, Numpy array N(atoms_lig) x N(atoms_rec)
         @rtype: array
+
+        @see: L{atomContactPairs} for a sparse version of the same result
         """
         if lig_mask is None:
             lig_mask = self.lig().maskHeavy()
@@ -866,6 +921,13 @@ class Complex:
         if rec_mask is None:
             rec_mask = self.rec().maskHeavy()
 
+        if map_back and not cache and getattr( self, 'pw_dist', None ) is None:
+            i, j = self.atomContactPairs( cutoff, rec_mask, lig_mask )
+
+            r = N0.zeros( ( len(self.rec_model), len(self.lig_model) ) )
+            r[ i, j ] = 1
+            return r
+
         contacts = self.__atomContacts( cutoff, rec_mask, lig_mask, cache )
 
         if not map_back:
@@ -875,6 +937,29 @@ class Complex:
         return self.__unmaskedMatrix( contacts, rec_mask, lig_mask )
 
 
+    def resContactPairs( self, cutoff=4.5, maskRec=None, maskLig=None ):
+        """
+        Sparse version of L{resContacts} (which is not used as a cache).
+        A contact between residues A and B is set if any atom of A
+        (within maskRec) is within |cutoff| A of any atom of B (within
+        maskLig).
+
+        @param cutoff: distance cutoff in \AA (default: 4.5)
+        @type  cutoff: float
+        @param maskRec: atom mask (default: all heavy)
+        @type  maskRec: [1|0]
+        @param maskLig: atom mask (default: all heavy)
+        @type  maskLig: [1|0]
+
+        @return: receptor and ligand residue indices of all residue
+                 contacts, each pair listed once and sorted by receptor
+                 residue
+        @rtype: (array of int, array of int)
+        """
+        i, j = self.atomContactPairs( cutoff, maskRec, maskLig )
+        return self.__atom2residuePairs( i, j )
+
+
     def __resContacts(self, cutoff, maskRec=None, maskLig=None, cache=0 ):
         """
         Find all inter-molecule B{residue-residue} contacts between receptor
@@ -896,11 +981,52 @@ class Complex:
                  1-contact, 0-no contact
         @rtype: array
         """
-        ## get contact matrix atoms_rec x atoms_lig
-        c = self.atomContacts( cutoff, maskRec, maskLig, cache )
+        if cache or getattr( self, 'pw_dist', None ) is not None:
+            ## get contact matrix atoms_rec x atoms_lig
+            c = self.atomContacts( cutoff, maskRec, maskLig, cache )
+
+            ## convert atoms x atoms to residues x residues matrix
+            return self.__atom2residueMatrix( c )
 
-        ## convert atoms x atoms to residues x residues matrix
-        return self.__atom2residueMatrix( c )
+        i, j = self.resContactPairs( cutoff, maskRec, maskLig )
+        return self.__residuePairs2Matrix( i, j )
+
+
+    def __atom2residuePairs( self, i, j ):
+        """
+        Reduce atom contacts to residue contacts.
+
+        @param i: receptor atom indices of contacts
+        @type  i: array of int
+        @param j: ligand atom indices of contacts
+        @type  j: array of int
+
+        @return: unique receptor and ligand residue indices of contacts
+        @rtype: (array of int, array of int)
+        """
+        n_lig = self.lig_model.lenResidues()
+
+        pairs = N.take( self.rec().resMap(), i ) * n_lig \
+                + N.take( self.lig_model.resMap(), j )
+
+        return divmod( N.unique( pairs ), n_lig )
+
+
+    def __residuePairs2Matrix( self, i, j ):
+        """
+        @param i: receptor residue indices of contacts
+        @type  i: array of int
+        @param j: ligand residue indices of contacts
+        @type  j: array of int
+
+        @return: residue contact matrix,
+                 2-D numpy array(residues_receptor x residues_ligand)
+        @rtype: array
+        """
+        r = N0.zeros( ( self.rec().lenResidues(),
+                        self.lig_model.lenResidues() ), N0.Int )
+        r[ i, j ] = 1
+        return r
 
 
     def __atom2residueMatrix( self, m ):
@@ -915,24 +1041,8 @@ class Complex:
                  2-D numpy array(residues_receptor x residues_ligand)
         @rtype: array
         """
-        recInd = N0.concatenate((self.rec().resIndex(),
-                              [ self.rec().lenAtoms()] ))
-        ligInd = N0.concatenate((self.lig_model.resIndex(),
-                              [ self.lig_model.lenAtoms() ] ))
-
-        residueMatrix = N0.zeros(( len(recInd)-1, len(ligInd)-1 ), N0.Int)
-
-        for r in range( len(recInd)-1 ):
-
-            for l in range( len(ligInd)-1 ):
-
-                res2res = m[ int(recInd[r]):int(recInd[r+1]),
-                             int(ligInd[l]):int(ligInd[l+1]) ]
-
-                if N0.any( res2res ):
-                    residueMatrix[r, l] = 1
-
-        return residueMatrix
+        i, j = N.nonzero( m )
+        return self.__residuePairs2Matrix( *self.__atom2residuePairs( i, j ) )
 
 
     def equalAtoms( self, ref ):
@@ -1460,6 +1570,25 @@ class Test(BT.BiskitTest):
 
         self.assertEqual( N0.sum(contProfile_lig) + N0.sum(contProfile_rec),
                           2462 )
+
+    def test_sparseContacts(self):
+        """Dock.Complex sparse vs. dense contacts test"""
+        c = t.load( t.testRoot() + '/com/ref.complex' )
+
+        i, j = c.atomContactPairs( 4.5 )
+        masked = c.atomContacts( 4.5, map_back=0 )
+
+        dense = c.atomContacts( 4.5, cache=1 )
+
+        self.assertTrue( N.all( N.nonzero( dense ) == N.array( (i, j) ) ) )
+        self.assertTrue( N.all( masked == c.atomContacts( 4.5, map_back=0 ) ))
+
+        c.pw_dist = None
+        sparse = c.resContacts( 4.5, force=1, cache=0 )
+        dense = c.resContacts( 4.5, force=1, cache=0, cache_pw=1 )
+
+        self.assertTrue( N.all( sparse == dense ) )
+        self.assertEqual( len( c.resContactPairs( 4.5 )[0] ), N.sum( dense ) )
    
 
 if __name__ == '__main__':
@@ -0,0 +1,401 @@
+##
+## Biskit, a toolkit for the manipulation of macromolecular structures
+## Copyright (C) 2004-2018 Raik Gruenberg & Johan Leckner
+##
+## This program is free software; you can redistribute it and/or
+## modify it under the terms of the GNU General Public License as
+## published by the Free Software Foundation; either version 3 of the
+## License, or any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+## General Public License for more details.
+##
+## You find a copy of the GNU General Public License in the file
+## license.txt along with this program; if not, write to the Free
+## Software Foundation, Inc., 675 Mass Ave, Cambridge, MA 02139, USA.
+##
+##
+
+"""
+Batch scoring of residue contacts of many complexes against a reference.
+"""
+
+import numpy as N
+
+from biskit.errors import BiskitError
+
+## allow relative imports when calling module by itself for testing (pep-0366)
+if __name__ == "__main__" and __package__ is None:
+    import biskit.dock; __package__ = "biskit.dock"
+
+from .poseSet import PoseSet
+
+
+class ContactScorerError( BiskitError ):
+    pass
+
+
+## models of the worker processes, see ContactScorer.contactCodes
+_shared = {}
+
+def _initWorker( models ):
+    _shared.update( models=models )
+
+def _codesWorker( task ):
+    group, pos, matrices, cutoff = task
+    rec, lig = _shared['models'][ group ]
+    return pos, _poseCodes( rec, lig, matrices, cutoff )
+
+
+def _poseCodes( rec, lig, matrices, cutoff ):
+    """
+    Residue contacts of several ligand positions, each as sorted array of
+    raveled positions in the (receptor residues x ligand residues) contact
+    matrix (the format of L{Complex.slim} and L{biskit.mathUtils.packBinaryMatrix}).
+
+    @param rec: receptor model
+    @type  rec: PDBModel
+    @param lig: ligand model
+    @type  lig: PDBModel
+    @param matrices: ligand transformation matrices, n x 4 x 4
+    @type  matrices: array
+    @param cutoff: distance cutoff in \AA
+    @type  cutoff: float
+
+    @return: contact codes of each ligand position
+    @rtype: [ array of int32 ]
+    """
+    poses = PoseSet( rec, lig, matrices )
+    p, i, j = poses.resContactPairs( cutoff )
+
+    codes = ( i * lig.lenResidues() + j ).astype( N.int32 )
+    ends = N.cumsum( N.bincount( p, minlength=len( poses ) ) )
+
+    return N.split( codes, ends[:-1] )
+
+
+class ContactScorer( object ):
+    """
+    Compare the B{residue-residue} contacts of many complexes with those of
+    one reference (native) complex. Results are identical to
+    L{Complex.fractionNativeContacts}, L{Complex.contactsOverlap},
+    L{Complex.contactsShared} and L{Complex.contactsDiff} but the
+    reference contacts are calculated only once and no contact matrix is
+    created. Contacts are handled as sparse sets of raveled matrix
+    positions, complexes sharing the same receptor and ligand models are
+    processed L{PoseSet.CHUNK} at a time (optionally in several processes)::
+
+      scorer = ContactScorer( native, cutoff=4.5, ncpu=4 )
+      scorer.score( complex_list )     ## -> 'fnac' and 'c_overlap' info
+
+    Contacts cached in a complex (L{Complex.resContacts}, compressed or not)
+    are re-used if they were calculated with the same cutoff and without
+    atom masks. Contacts of complexes with a different sequence than the
+    reference are aligned to it (see L{Complex.resContacts} refComplex).
+    """
+
+    def __init__( self, ref, cutoff=4.5, ncpu=1 ):
+        """
+        @param ref: native / reference complex
+        @type  ref: Complex
+        @param cutoff: maximal atom-atom distance (default: 4.5)
+        @type  cutoff: float
+        @param ncpu: number of worker processes (default: 1, no pool)
+        @type  ncpu: int
+
+        @raise ContactScorerError: if reference has no contacts
+        """
+        self.ref = ref
+        self.cutoff = cutoff
+        self.ncpu = ncpu
+
+        self.shape = ( ref.rec_model.lenResidues(),
+                       ref.lig_model.lenResidues() )
+
+        i, j = ref.resContactPairs( cutoff )
+        self.native = N.unique( i * self.shape[1] + j ).astype( N.int32 )
+
+        if not len( self.native ):
+            raise ContactScorerError( 'no contacts in reference complex.' )
+
+        self.__sequences = {}
+
+
+    def __sameSequence( self, m, ref_m ):
+        """
+        @return: True if model m has the same residues as ref_m
+        @rtype: bool
+        """
+        if m is ref_m:
+            return True
+        key = ( id( m ), id( ref_m ) )
+        if key not in self.__sequences:
+            self.__sequences[ key ] = ( m, m.sequence() == ref_m.sequence() )
+        return self.__sequences[ key ][1]
+
+
+    def __cached( self, c ):
+        """
+        @return: contact codes of complex c from its contact cache OR None
+        @rtype: array of int32
+        """
+        cont = c.contacts
+        if cont is None or isinstance( cont, str ) \
+           or cont['cutoff'] != self.cutoff \
+           or cont['maskRec'] is not None or cont['maskLig'] is not None:
+            return None
+
+        m = cont['result']
+        if N.ndim( m ) == 2:
+            if N.shape( m ) == self.shape:
+                return N.flatnonzero( m ).astype( N.int32 )
+            return None
+
+        if tuple( cont.get( 'shape', () ) ) == self.shape:
+            return N.sort( N.asarray( m, N.int32 ) )
+
+        return None
+
+
+    def contactCodes( self, complexes, cache=0 ):
+        """
+        Residue contacts of many complexes, each as sorted array of
+        raveled positions in the (receptor x ligand residues) contact
+        matrix of the reference complex.
+
+        @param complexes: complexes with the same (or aligned) receptor
+                          and ligand as the reference
+        @type  complexes: [Complex] OR ComplexList
+        @param cache: put new contacts into each complex' contact cache
+                      (compressed like in L{Complex.slim}) (default: 0)
+        @type  cache: 1|0
+
+        @return: contact codes of each complex
+        @rtype: [ array of int32 ]
+
+        @raise ContactScorerError: if contacts of a complex cannot be
+                                   aligned to the reference
+        """
+        r = [ None ] * len( complexes )
+        groups = {}
+
+        for k, c in enumerate( complexes ):
+
+            if self.__sameSequence( c.rec_model, self.ref.rec_model ) and \
+               self.__sameSequence( c.lig_model, self.ref.lig_model ):
+
+                r[k] = self.__cached( c )
+                if r[k] is None:
+                    key = ( id( c.rec_model ), id( c.lig_model ) )
+                    groups.setdefault( key, [] ).append( k )
+
+            else:
+                ## cached contacts are not aligned to the reference
+                m = c.resContacts( self.cutoff, refComplex=self.ref,
+                                   cache=cache )
+                if N.shape( m ) != self.shape:
+                    raise ContactScorerError(
+                        'cannot align contacts of complex %i to reference.'
+                        % k )
+                r[k] = N.flatnonzero( m ).astype( N.int32 )
+
+        models = [ ( complexes[ g[0] ].rec_model, complexes[ g[0] ].lig_model )
+                   for g in groups.values() ]
+
+        tasks = []
+        for i, pos in enumerate( groups.values() ):
+            for start in range( 0, len( pos ), PoseSet.CHUNK ):
+                p = pos[ start : start + PoseSet.CHUNK ]
+                m = N.array( [ complexes[k].ligandMatrix for k in p ],
+                             N.float32 )
+                tasks.append( ( i, p, m, self.cutoff ) )
+
+        def save( pos, codes ):
+            for k, x in zip( pos, codes ):
+                r[k] = x
+                if cache:
+                    complexes[k].contacts = { 'cutoff': self.cutoff,
+                                              'maskRec': None,
+                                              'maskLig': None,
+                                              'result': x,
+                                              'shape': self.shape }
+
+        if self.ncpu > 1 and len( tasks ) > 1:
+            import multiprocessing
+
+            with multiprocessing.Pool( self.ncpu, _initWorker,
+                                       ( models, ) ) as pool:
+                for pos, codes in pool.imap_unordered( _codesWorker, tasks ):
+                    save( pos, codes )
+        else:
+            for i, pos, m, cutoff in tasks:
+                save( pos, _poseCodes( models[i][0], models[i][1], m,
+                                       cutoff ) )
+
+        return r
+
+
+    def scores( self, complexes, cache=0 ):
+        """
+        @param complexes: complexes to compare with the reference
+        @type  complexes: [Complex] OR ComplexList
+        @param cache: put new contacts into each complex' contact cache
+                      (default: 0)
+        @type  cache: 1|0
+
+        @return: arrays with 'fnac' (fraction of native contacts),
+                 'overlap' (shared / all contacts), 'shared' (number of
+                 native contacts) and 'diff' (number of non-shared
+                 contacts) for each complex
+        @rtype: {str : array}
+        """
+        codes = self.contactCodes( complexes, cache=cache )
+
+        lengths = N.array( [ len( x ) for x in codes ], int )
+        hits = N.isin( N.concatenate( [ N.zeros( 0, N.int32 ) ] + codes ),
+                       self.native )
+        owner = N.repeat( N.arange( len( codes ) ), lengths )
+
+        shared = N.bincount( owner, hits, minlength=len( codes ) ).astype(int)
+        total = lengths + len( self.native ) - shared
+
+        return { 'fnac': shared / float( len( self.native ) ),
+                 'overlap': shared / total.astype( float ),
+                 'shared': shared,
+                 'diff': total - shared }
+
+
+    def score( self, complexes, fnac='fnac', overlap='c_overlap',
+               shared=None, diff=None, cache=0 ):
+        """
+        Score many complexes against the reference and put the results
+        into the info dictionary of each complex. An indexed ComplexList
+        is re-indexed afterwards.
+
+        @param complexes: complexes to compare with the reference
+        @type  complexes: [Complex] OR ComplexList
+        @param fnac: info key for fraction of native contacts
+                     (default: 'fnac', None .. skip)
+        @type  fnac: str
+        @param overlap: info key for contact overlap
+                        (default: 'c_overlap', None .. skip)
+        @type  overlap: str
+        @param shared: info key for number of shared contacts
+                       (default: None, skip)
+        @type  shared: str
+        @param diff: info key for number of different contacts
+                     (default: None, skip)
+        @type  diff: str
+        @param cache: put new contacts into each complex' contact cache
+                      (default: 0)
+        @type  cache: 1|0
+
+        @return: see L{scores}
+        @rtype: {str : array}
+        """
+        r = self.scores( complexes, cache=cache )
+
+        keys = [ ( key, r[ name ].tolist() )
+                 for key, name in ( ( fnac, 'fnac' ), ( overlap, 'overlap' ),
+                                    ( shared, 'shared' ), ( diff, 'diff' ) )
+                 if key is not None ]
+
+        for k, c in enumerate( complexes ):
+            for key, values in keys:
+                c[ key ] = values[ k ]
+
+        if getattr( complexes, 'isIndexed', lambda: False )():
+            complexes.reindex()
+
+        return r
+
+
+#############
+##  TESTING
+#############
+import biskit.test as BT
+
+class Test(BT.BiskitTest):
+    """Test case"""
+
+    def prepare(self):
+        import biskit.tools as t
+        from .hexparser import HexParser
+
+        rec_dic = t.load( t.testRoot() + "/dock/rec/1A2P_model.dic" )
+        lig_dic = t.load( t.testRoot() + "/dock/lig/1A19_model.dic" )
+        f = t.testRoot() + "/dock/hex/1A2P-1A19_hex8.out"
+
+        self.cl = HexParser( f, rec_dic, lig_dic ).parseHex()
+
+    def test_ContactScorer(self):
+        """Dock.ContactScorer vs. Complex contact scores test"""
+        native = self.cl.min( 'rms' )
+        sub = self.cl.take( range( 0, len( self.cl ), 25 ) )
+        sub.append( native )
+
+        self.scorer = ContactScorer( native )
+        r = self.scorer.score( sub, shared='c_shared', diff='c_diff' )
+
+        self.assertAlmostEqual( sub[-1]['fnac'], 1.0, 7 )
+        self.assertEqual( len( r['fnac'] ), len( sub ) )
+
+        for c in sub:
+            self.assertAlmostEqual( c['fnac'],
+                                    c.fractionNativeContacts( native ), 7 )
+            self.assertAlmostEqual( c['c_overlap'],
+                                    c.contactsOverlap( native ), 7 )
+            self.assertEqual( c['c_shared'], c.contactsShared( native ) )
+            self.assertEqual( c['c_diff'], c.contactsDiff( native ) )
+
+        ## contacts are now cached in (uncompressed) matrices
+        for c in sub:
+            c.slim()
+        r2 = ContactScorer( native, ncpu=2 ).scores( sub )
+        self.assertTrue( N.all( r2['overlap'] == r['overlap'] ) )
+
+        ## parallel calculation from scratch, contacts are cached
+        sub = self.cl.take( range( 3, len( self.cl ), 40 ) )
+        r3 = ContactScorer( native, ncpu=2 ).scores( sub, cache=1 )
+        r4 = ContactScorer( native ).scores( sub )
+        self.assertTrue( N.all( r3['shared'] == r4['shared'] ) )
+        self.assertEqual( sub[0].resContacts().sum(), r3['diff'][0] +
+                          2 * r3['shared'][0] - len( self.scorer.native ) )
+
+        if self.local:
+            print( '\nfnac:', r['fnac'] )
+            print( 'overlap:', r['overlap'] )
+
+    def test_sequenceMismatch(self):
+        """Dock.ContactScorer with different ligand sequence test"""
+        from .complex import Complex
+
+        native = self.cl.min( 'rms' )
+        lig = native.lig_model.takeResidues(
+            range( 1, native.lig_model.lenResidues() ) )
+
+        self.c = Complex( native.rec_model, lig, native.ligandMatrix )
+        self.scorer = ContactScorer( native )
+
+        fnac = self.scorer.scores( [ self.c ] )['fnac'][0]
+        self.assertAlmostEqual( fnac, self.c.fractionNativeContacts( native ),
+                                7 )
+
+        ## now with (unaligned) contacts cached by fractionNativeContacts
+        self.assertTrue( self.c.contacts is not None )
+        r = self.scorer.scores( [ self.c ] )
+        self.assertAlmostEqual( r['fnac'][0], fnac, 7 )
+        self.assertTrue( fnac > 0.9 )
+
+        ## homodimer of the receptor -- must not be matched to the ligand
+        m = native.rec_model.clone()
+        self.c = Complex( m, m, native.ligandMatrix )
+        self.assertRaises( ContactScorerError,
+                           self.scorer.scores, [ self.c ] )
+
+
+if __name__ == '__main__':
+
+    BT.localTest()
@@ -32,6 +32,7 @@ from biskit import XplorModel
 
 from biskit.dock.complex import Complex
 from biskit.dock.complexList import ComplexList
+from biskit.dock.poseSet import PoseSet
 
 
 class HexParser:
@@ -79,6 +80,25 @@ class HexParser:
         @return: Complex created from the output from Hex
         @rtype: Complex
         """
+        r = self.nextRecord()
+        if r is None:
+            return None
+        i, matrix = r
+
+        ## Create new complex taking PCR models from dictionary
+        c = Complex( self.rec_models[ i['model1'] ],
+                     self.lig_models[ i['model2'] ],  matrix, i )
+        return c
+
+
+    def nextRecord(self):
+        """
+        Extract info dictionary and transformation matrix of the next
+        solution without creating a Complex.
+
+        @return: info dictionary and 4 x 4 matrix OR None at end of file
+        @rtype: (dict, array) OR None
+        """
         ## get set of lines describing next complex:
         lines = self._nextBlock()
         if lines is None:
@@ -87,6 +107,8 @@ class HexParser:
         ## skip incomplete records
         if len(lines) < 13:
             lines = self._nextBlock()
+            if lines is None:
+                return None
 
         ## fill info dictionary
         i = {}
@@ -143,12 +165,9 @@ class HexParser:
                         ## create 4 by 4 Numeric array from 4 by 4 list
                         matrix = N0.array(matrix, N0.Float32)
             except AttributeError:
-                print("HexParser.nextComplex(): ",t.lastError())
+                print("HexParser.nextRecord(): ",t.lastError())
 
-        ## Create new complex taking PCR models from dictionary
-        c = Complex( self.rec_models[ i['model1'] ],
-                     self.lig_models[ i['model2'] ],  matrix, i )
-        return c
+        return i, matrix
 
 
     def _nextBlock(self):
@@ -192,6 +211,25 @@ class HexParser:
         return complexes
 
 
+    def parsePoses(self):
+        """
+        Read all solutions from hex output file into a compact PoseSet
+        (one matrix array and one array per info record) instead of
+        creating one Complex per solution.
+
+        @return: PoseSet with all solutions from the Hex output
+        @rtype: PoseSet
+        """
+        records = []
+        r = self.nextRecord()
+
+        while r is not None:
+            records.append( r )
+            r = self.nextRecord()
+
+        return PoseSet.fromRecords( self.rec_models, self.lig_models, records )
+
+
 #############
 ##  TESTING        
 #############
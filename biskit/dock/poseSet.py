@@ -0,0 +1,604 @@
+##
+## Biskit, a toolkit for the manipulation of macromolecular structures
+## Copyright (C) 2004-2018 Raik Gruenberg & Johan Leckner
+##
+## This program is free software; you can redistribute it and/or
+## modify it under the terms of the GNU General Public License as
+## published by the Free Software Foundation; either version 3 of the
+## License, or any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+## General Public License for more details.
+##
+## You find a copy of the GNU General Public License in the file
+## license.txt along with this program; if not, write to the Free
+## Software Foundation, Inc., 675 Mass Ave, Cambridge, MA 02139, USA.
+##
+##
+
+"""
+Compact array representation of many docking solutions.
+"""
+
+import numbers
+import numpy as N
+
+import biskit.rmsFit as rmsFit
+from biskit.errors import BiskitError
+
+## allow relative imports when calling module by itself for testing (pep-0366)
+if __name__ == "__main__" and __package__ is None:
+    import biskit.dock; __package__ = "biskit.dock"
+
+from .complex import Complex
+from .complexList import ComplexList
+
+
+class PoseSetError( BiskitError ):
+    pass
+
+
+def _column( values ):
+    """
+    Convert list of info values into an array. Integer values give an int
+    array, other numbers a float array (None -> nan), anything else
+    (including integers with missing values) an object array.
+
+    @param values: values, None for missing values
+    @type  values: [any]
+
+    @return: column
+    @rtype: array
+    """
+    present = [ v for v in values if v is not None ]
+    kinds = set( map( type, present ) )
+
+    if all( [ issubclass( k, numbers.Integral ) for k in kinds ] ) \
+       and len( present ) == len( values ):
+        return N.array( values, int )
+
+    if all( [ issubclass( k, numbers.Real ) for k in kinds ] ) and \
+       not all( [ issubclass( k, numbers.Integral ) for k in kinds ] ):
+        return N.array( [ N.nan if v is None else v for v in values ], float )
+
+    r = N.empty( len( values ), object )
+    for i, v in enumerate( values ):
+        r[i] = v
+    return r
+
+
+class PoseSet( object ):
+    """
+    Many docking solutions (poses) of the same receptor and ligand models,
+    stored as one (n x 4 x 4) float32 array of ligand transformation
+    matrices plus one array per info/score record (e.g. 'soln', 'hex_etotal').
+    In contrast to a L{ComplexList}, no Complex and no transformed ligand
+    model is created per solution::
+
+      poses = HexParser( 'hex.out', rec_dic, lig_dic ).parsePoses()
+      poses['hex_etotal']                -> array with one value per pose
+      best = poses.sortBy( 'hex_etotal' )[:100]
+      fnac = best.fnac( ref_complex )    -> array of float
+      c = best[0]                        -> Complex
+
+    Contacts, fraction of native contacts and interface rmsd are calculated
+    for L{CHUNK} poses at a time from ligand coordinates that are
+    transformed on the fly.
+
+    Receptor and ligand models can be given as dictionaries indexed by model
+    number (as used by L{HexParser}); the model of each pose is then taken
+    from the info records 'model1' (receptor) and 'model2' (ligand).
+    """
+
+    #: number of poses transformed at once
+    CHUNK = 500
+
+    def __init__( self, rec_models, lig_models, matrices=None, info={} ):
+        """
+        @param rec_models: receptor model OR models indexed by model number
+        @type  rec_models: PDBModel OR {int:PDBModel}
+        @param lig_models: ligand model OR models indexed by model number
+        @type  lig_models: PDBModel OR {int:PDBModel}
+        @param matrices: ligand transformation matrices, n x 4 x 4
+                         (default: None, empty set)
+        @type  matrices: array
+        @param info: info values of all poses, indexed by info key
+        @type  info: {str:[any]}
+        """
+        if not isinstance( rec_models, dict ):
+            rec_models = { 1 : rec_models }
+        if not isinstance( lig_models, dict ):
+            lig_models = { 1 : lig_models }
+
+        self.rec_models = rec_models
+        self.lig_models = lig_models
+
+        if matrices is None:
+            matrices = N.zeros( (0, 4, 4) )
+        self.matrices = N.reshape( N.asarray( matrices, N.float32 ),
+                                   (-1, 4, 4) )
+
+        self.info = {}
+        for key, values in info.items():
+            self.setInfo( key, values )
+
+
+    @classmethod
+    def fromRecords( cls, rec_models, lig_models, records ):
+        """
+        Create PoseSet from info dictionaries and matrices of single poses.
+
+        @param rec_models: receptor model OR models indexed by model number
+        @type  rec_models: PDBModel OR {int:PDBModel}
+        @param lig_models: ligand model OR models indexed by model number
+        @type  lig_models: PDBModel OR {int:PDBModel}
+        @param records: info dict and 4 x 4 matrix of each pose
+        @type  records: [ (dict, array) ]
+
+        @return: new PoseSet
+        @rtype: PoseSet
+        """
+        keys = {}
+        for info, m in records:
+            keys.update( dict.fromkeys( info ) )
+
+        info = dict( [ (k, [ r[0].get( k ) for r in records ]) for k in keys ])
+        matrices = [ r[1] for r in records ]
+
+        return cls( rec_models, lig_models, matrices, info )
+
+
+    def __len__( self ):
+        return len( self.matrices )
+
+
+    def __getitem__( self, i ):
+        """
+        Examples:
+
+          - C{poses[ int ]} -> Complex
+          - C{poses[ str ]} -> array with info values of all poses
+          - C{poses[ slice or [int] or mask ]} -> PoseSet
+        """
+        if isinstance( i, str ):
+            return self.info[ i ]
+
+        if isinstance( i, numbers.Integral ):
+            return self.complex( i )
+
+        if isinstance( i, slice ):
+            return self.take( N.arange( len( self ) )[ i ] )
+
+        i = N.asarray( i )
+        if i.dtype == bool:
+            return self.compress( i )
+        return self.take( i )
+
+
+    def keys( self ):
+        """
+        @return: info keys
+        @rtype: [str]
+        """
+        return list( self.info.keys() )
+
+
+    def setInfo( self, key, values ):
+        """
+        Add or replace info values of all poses.
+
+        @param key: info key
+        @type  key: str
+        @param values: one value per pose (None for missing values)
+        @type  values: [any] OR array
+
+        @raise PoseSetError: if the number of values is wrong
+        """
+        if not isinstance( values, N.ndarray ):
+            values = _column( list( values ) )
+
+        if len( values ) != len( self ):
+            raise PoseSetError( '%i values for %i poses given for %s' % \
+                                ( len( values ), len( self ), key ) )
+
+        self.info[ key ] = values
+
+
+    def take( self, indices ):
+        """
+        @param indices: pose positions
+        @type  indices: [int]
+
+        @return: PoseSet with the given poses only
+        @rtype: PoseSet
+        """
+        indices = N.asarray( indices, int )
+        info = dict( [ ( k, v[ indices ] ) for k, v in self.info.items() ] )
+        return self.__class__( self.rec_models, self.lig_models,
+                               self.matrices[ indices ], info )
+
+
+    def compress( self, mask ):
+        """
+        @param mask: 1 for all poses to keep
+        @type  mask: [1|0]
+
+        @return: PoseSet with masked poses only
+        @rtype: PoseSet
+        """
+        return self.take( N.flatnonzero( mask ) )
+
+
+    def concat( self, *others ):
+        """
+        Concatenate with poses of other PoseSets (same info keys).
+
+        @param others: more poses of the same models
+        @type  others: PoseSet
+
+        @return: new PoseSet
+        @rtype: PoseSet
+        """
+        rec_models = dict( self.rec_models )
+        lig_models = dict( self.lig_models )
+        for o in others:
+            rec_models.update( o.rec_models )
+            lig_models.update( o.lig_models )
+
+        sets = ( self, ) + others
+        matrices = N.concatenate( [ s.matrices for s in sets ] )
+        info = dict( [ ( k, N.concatenate( [ s.info[k] for s in sets ] ) )
+                       for k in self.info ] )
+
+        return self.__class__( rec_models, lig_models, matrices, info )
+
+
+    def argsort( self, infoKey ):
+        """
+        @param infoKey: info key to sort by
+        @type  infoKey: str
+
+        @return: pose indices in order of increasing info values
+        @rtype: array of int
+        """
+        return N.argsort( self.info[ infoKey ], kind='mergesort' )
+
+
+    def sortBy( self, infoKey ):
+        """
+        @param infoKey: info key to sort by
+        @type  infoKey: str
+
+        @return: PoseSet sorted by increasing info values
+        @rtype: PoseSet
+        """
+        return self.take( self.argsort( infoKey ) )
+
+
+    def __modelKeys( self, i ):
+        """
+        @return: receptor and ligand model number of pose i
+        @rtype: (int, int)
+        """
+        r = [ self.info[k][i] if k in self.info else list( models )[0]
+              for k, models in ( ('model1', self.rec_models),
+                                 ('model2', self.lig_models) ) ]
+        return tuple( r )
+
+
+    def models( self, i ):
+        """
+        @param i: pose index
+        @type  i: int
+
+        @return: receptor and (untransformed) ligand model of pose i
+        @rtype: (PDBModel, PDBModel)
+        """
+        k_rec, k_lig = self.__modelKeys( i )
+        return self.rec_models[ k_rec ], self.lig_models[ k_lig ]
+
+
+    def complex( self, i ):
+        """
+        Create a Complex for a single pose.
+
+        @param i: pose index
+        @type  i: int
+
+        @return: complex with ligand matrix and info values of pose i
+        @rtype: Complex
+        """
+        info = {}
+        for k, values in self.info.items():
+            v = values[i]
+            if v is None or ( isinstance( v, float ) and N.isnan( v ) ):
+                continue
+            info[ k ] = v.item() if isinstance( v, N.generic ) else v
+
+        rec, lig = self.models( i )
+        return Complex( rec, lig, N.array( self.matrices[i] ), info )
+
+
+    def toComplexList( self, indices=None ):
+        """
+        @param indices: pose positions (default: None, all)
+        @type  indices: [int]
+
+        @return: one Complex for each (selected) pose
+        @rtype: ComplexList
+        """
+        if indices is None:
+            indices = range( len( self ) )
+        return ComplexList( [ self.complex( i ) for i in indices ] )
+
+
+    def __chunks( self, indices=None ):
+        """
+        Split poses into groups of identical models and at most CHUNK poses.
+
+        @param indices: pose positions (default: None, all)
+        @type  indices: [int]
+
+        @return: positions in indices, receptor and ligand model
+        @rtype: generator of (array of int, PDBModel, PDBModel)
+        """
+        if indices is None:
+            indices = N.arange( len( self ) )
+        indices = N.asarray( indices, int )
+
+        keys = [ self.__modelKeys( i ) for i in indices ] \
+               if 'model1' in self.info or 'model2' in self.info \
+               else [ self.__modelKeys( 0 ) ] * len( indices )
+
+        for key in sorted( set( keys ) ):
+            pos = N.flatnonzero( [ k == key for k in keys ] )
+            rec, lig = self.rec_models[ key[0] ], self.lig_models[ key[1] ]
+
+            for start in range( 0, len( pos ), self.CHUNK ):
+                yield pos[ start : start + self.CHUNK ], rec, lig
+
+
+    def transformed( self, xyz, indices ):
+        """
+        Apply ligand matrices of several poses to the same coordinates.
+
+        @param xyz: ligand coordinates, n_atoms x 3
+        @type  xyz: array
+        @param indices: pose positions
+        @type  indices: [int]
+
+        @return: coordinates of each pose, n_poses x n_atoms x 3
+        @rtype: array of float32
+        """
+        m = self.matrices[ indices ]
+        r = N.matmul( N.asarray( xyz, N.float32 ),
+                      N.transpose( m[:, :3, :3], (0, 2, 1) ) )
+        return r + m[:, N.newaxis, :3, 3]
+
+
+    def resContactPairs( self, cutoff=4.5, rec_mask=None, lig_mask=None,
+                         indices=None ):
+        """
+        Residue - residue contacts of many poses, without creating any
+        contact matrix (see L{Complex.resContactPairs}). The transformed
+        ligand atoms of CHUNK poses are matched against the (cached)
+        neighbor grid of the receptor in one go.
+
+        @param cutoff: distance cutoff in \AA (default: 4.5)
+        @type  cutoff: float
+        @param rec_mask: receptor atom mask (default: all heavy)
+        @type  rec_mask: [1|0]
+        @param lig_mask: ligand atom mask (default: all heavy)
+        @type  lig_mask: [1|0]
+        @param indices: pose positions (default: None, all)
+        @type  indices: [int]
+
+        @return: position in indices, receptor and ligand residue index
+                 of all contacts, sorted by pose
+        @rtype: (array of int, array of int, array of int)
+        """
+        if indices is None:
+            indices = N.arange( len( self ) )
+        indices = N.asarray( indices, int )
+
+        r = [ ( N.zeros( 0, int ), ) * 3 ]
+
+        for pos, rec, lig in self.__chunks( indices ):
+
+            lmask = lig.maskHeavy() if lig_mask is None else lig_mask
+            rmask = rec.maskHeavy() if rec_mask is None else rec_mask
+
+            lig_atoms = N.flatnonzero( lmask )
+            n = len( lig_atoms )
+            xyz = self.transformed( lig.getXyz()[ lig_atoms ], indices[pos] )
+
+            i, j = rec.pairsWithin( N.reshape( xyz, (-1, 3) ), cutoff )
+            keep = N.asarray( rmask, bool )[ i ]
+            i, j = i[ keep ], j[ keep ]
+
+            n_rec = rec.lenResidues()
+            n_lig = lig.lenResidues()
+
+            codes = ( j // n * n_rec + N.take( rec.resMap(), i ) ) * n_lig \
+                    + N.take( lig.resMap(), lig_atoms[ j % n ] )
+
+            p, res = divmod( N.unique( codes ), n_rec * n_lig )
+            r.append( ( pos[ p ], ) + divmod( res, n_lig ) )
+
+        p, i, j = [ N.concatenate( x ) for x in zip( *r ) ]
+        order = N.argsort( p, kind='mergesort' )
+
+        return p[ order ], i[ order ], j[ order ]
+
+
+    def __checkReference( self, ref, rec, lig ):
+        """
+        @raise PoseSetError: if ref has different models than the poses
+        """
+        if len( ref.rec_model ) != len( rec ) \
+           or len( ref.lig_model ) != len( lig ) \
+           or ref.rec_model.lenResidues() != rec.lenResidues() \
+           or ref.lig_model.lenResidues() != lig.lenResidues():
+            raise PoseSetError( 'reference complex has different atoms '+\
+                                'than the docked models.' )
+
+
+    def fnac( self, ref, cutoff=4.5, indices=None ):
+        """
+        Fraction of native B{residue-residue} contacts of many poses (see
+        L{Complex.fractionNativeContacts}). The reference contacts are
+        calculated only once.
+
+        @param ref: native complex with the same atoms as the pose models
+        @type  ref: Complex
+        @param cutoff: maximal atom-atom distance (default: 4.5)
+        @type  cutoff: float
+        @param indices: pose positions (default: None, all)
+        @type  indices: [int]
+
+        @return: fraction of native contacts for each (selected) pose
+        @rtype: array of float
+
+        @raise PoseSetError: if ref has different models than the poses
+        """
+        if indices is None:
+            indices = N.arange( len( self ) )
+
+        for pos, rec, lig in self.__chunks( indices ):
+            self.__checkReference( ref, rec, lig )
+
+        n_lig = ref.lig_model.lenResidues()
+        ri, rj = ref.resContactPairs( cutoff )
+        native = ri * n_lig + rj
+
+        p, i, j = self.resContactPairs( cutoff, indices=indices )
+        hits = N.isin( i * n_lig + j, native )
+
+        r = N.bincount( p, hits, minlength=len( indices ) )
+        return r / float( len( native ) )
+
+
+    def rmsInterface( self, ref, cutoff=4.5, fit=1, indices=None ):
+        """
+        Rmsd between the interface of many poses and a reference interface
+        (see L{Complex.rmsInterface}). The interface is defined as any
+        heavy atom of residues in contact within the reference complex.
+
+        @param ref: reference complex with the same atoms as the pose models
+        @type  ref: Complex
+        @param cutoff: atom distance cutoff for interface residue definition
+                       (default: 4.5)
+        @type  cutoff: float
+        @param fit: least-squares fit before calculating the rms (default: 1)
+        @type  fit: 1|0
+        @param indices: pose positions (default: None, all)
+        @type  indices: [int]
+
+        @return: interface rmsd of each (selected) pose
+        @rtype: array of float
+
+        @raise PoseSetError: if ref has different models than the poses
+        """
+        if indices is None:
+            indices = N.arange( len( self ) )
+        indices = N.asarray( indices, int )
+
+        contacts = ref.resContacts( cutoff )
+        if_rec = ref.rec_model.res2atomMask( N.sum( contacts, 1 ) ) \
+                 * ref.rec_model.maskHeavy()
+        if_lig = ref.lig_model.res2atomMask( N.sum( contacts, 0 ) ) \
+                 * ref.lig_model.maskHeavy()
+
+        if_rec = N.flatnonzero( if_rec )
+        if_lig = N.flatnonzero( if_lig )
+
+        x = N.concatenate( ( ref.rec().getXyz()[ if_rec ],
+                             ref.lig().getXyz()[ if_lig ] ) )
+
+        result = N.zeros( len( indices ) )
+
+        for pos, rec, lig in self.__chunks( indices ):
+            self.__checkReference( ref, rec, lig )
+
+            y_lig = self.transformed( lig.getXyz()[ if_lig ], indices[pos] )
+            y_rec = N.broadcast_to( rec.getXyz()[ if_rec ],
+                                    ( len( pos ), len( if_rec ), 3 ) )
+            y = N.concatenate( ( y_rec, y_lig ), 1 ).astype( N.float64 )
+
+            if fit:
+                r, t = rmsFit.findTransformations( x, y )
+                y = N.matmul( y, N.transpose( r, (0, 2, 1) ) ) \
+                    + t[:, N.newaxis, :]
+
+            result[ pos ] = N.sqrt( N.mean( N.sum( ( y - x )**2, -1 ), -1 ) )
+
+        return result
+
+
+#############
+##  TESTING
+#############
+import biskit.test as BT
+
+class Test(BT.BiskitTest):
+    """Test case"""
+
+    def prepare(self):
+        import biskit.tools as t
+        from .hexparser import HexParser
+
+        rec_dic = t.load( t.testRoot() + "/dock/rec/1A2P_model.dic" )
+        lig_dic = t.load( t.testRoot() + "/dock/lig/1A19_model.dic" )
+        f = t.testRoot() + "/dock/hex/1A2P-1A19_hex8.out"
+
+        self.cl = HexParser( f, rec_dic, lig_dic ).parseHex()
+        self.poses = HexParser( f, rec_dic, lig_dic ).parsePoses()
+
+    def test_PoseSet(self):
+        """Dock.PoseSet vs. ComplexList test"""
+        self.assertEqual( len( self.poses ), len( self.cl ) )
+        self.assertEqual( self.poses.matrices.dtype, N.float32 )
+        self.assertTrue( N.all( self.poses['soln'] ==
+                                self.cl.valuesOf( 'soln' ) ) )
+
+        c = self.poses[5]
+        ref = self.cl[5]
+        self.assertTrue( N.all( c.ligandMatrix == ref.ligandMatrix ) )
+        self.assertEqual( sorted( c.info.keys() ), sorted( ref.info.keys() ) )
+        self.assertEqual( c['hex_etotal'], ref['hex_etotal'] )
+        self.assertTrue( N.allclose( c.lig().getXyz(), ref.lig().getXyz() ) )
+
+        best = self.poses.sortBy( 'hex_etotal' )[:20]
+        self.assertEqual( best[0]['soln'], self.cl.min( 'hex_etotal' )['soln'] )
+
+        ## batch scores against the complex with lowest rms as reference
+        native = self.cl.min( 'rms' )
+        i = list( range( 0, len( self.poses ), 51 ) )
+        i += list( N.flatnonzero( self.poses['soln'] == native['soln'] ) )
+
+        fnac = self.poses.fnac( native, indices=i )
+        irms = self.poses.rmsInterface( native, indices=i, fit=0 )
+        irms_fit = self.poses.rmsInterface( native, indices=i )
+
+        for k, pos in enumerate( i ):
+            c = self.cl[ pos ]
+            self.assertAlmostEqual( fnac[k],
+                                    c.fractionNativeContacts( native ), 5 )
+            self.assertAlmostEqual( irms[k],
+                                    c.rmsInterface( native, fit=0 ), 3 )
+
+        ## Complex.rmsInterface fit does not exclude reflections
+        self.assertTrue( N.all( irms_fit <= irms + 1e-6 ) )
+        self.assertAlmostEqual( fnac[-1], 1.0, 7 )
+        self.assertAlmostEqual( irms_fit[-1], 0.0, 3 )
+
+        if self.local:
+            print( '\nfnac:', fnac )
+            print( 'interface rms:', irms_fit )
+
+
+if __name__ == '__main__':
+
+    BT.localTest()
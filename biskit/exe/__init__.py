@@ -7,6 +7,8 @@ if __name__ == "__main__" and __package__ is None:
 from .exeConfig import ExeConfig, ExeConfigError
 from .exeConfigCache import ExeConfigCache
 from .executor import Executor, TemplateError
+from .executorPool import ExecutorPool
+from .resultCache import ResultCache, ResultCacheError
 
 from .tmalign import TMAlign
 from .dssp import Dssp, Dssp_Error
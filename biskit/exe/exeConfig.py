@@ -96,6 +96,8 @@ class ExeConfig( object ):
       - shell ...    wrap process in separate shell
       - shellexe ... which shell (empty -- sh)
       - pipes ...    paste input via STDIN, collect output at STDOUT
+      - version ...  program version (optional, empty -- unknown); used to
+                     tell apart cached results of different program versions
 
     Missing options are reset to their default value; See
     :class:` ExeConfig.reset() `.  All entries in section BINARY are put into the
@@ -169,6 +171,7 @@ class ExeConfig( object ):
         self.shellexe = None
         self.pipes = 0
         self.cwd = None   #'./'
+        self.version = None
 
         self.replaceEnv = 0
         self.env = None
@@ -26,7 +26,7 @@ Class for calls to external programs.
 if __name__ == "__main__" and __package__ is None:
     import biskit.exe; __package__ = "biskit.exe"
 
-import tempfile, os, time, subprocess, sys
+import tempfile, os, time, subprocess, sys, re
 
 import biskit as B
 import biskit.tools as t
@@ -35,6 +35,7 @@ from biskit import StdLog
 from biskit.errors import BiskitError
 
 from .exeConfigCache import ExeConfigCache
+from .resultCache import ResultCache
 
 class RunError( BiskitError ):
     pass
@@ -233,6 +234,19 @@ class Executor:
     Look at `generateInp()` to see what is actually going on. 
 
 
+    **Result cache**
+
+
+      If a :class:`ResultCache` is given (`cache` parameter), Executor
+      creates a hash from the program (binary, version), the arguments
+      and the program input (see `cacheKey()`) right before execution.
+      If the cache already holds a result for this hash, it is returned
+      without starting the program and `finish()` is not called. Only
+      `self.result` is restored; sub-classes that (also) change other
+      objects in `finish()` should not be used with a cache. Results of
+      successful runs are added to the cache.
+
+
     **References**
     
 
@@ -246,7 +260,8 @@ class Executor:
     def __init__( self, name, args='', template=None, f_in=None, f_out=None,
                   f_err=None, strict=True, catch_out=1, push_inp=1, catch_err=0,
                   node=None, nice=0, cwd=None, tempdir=None, log=None, debug=0,
-                  verbose=None, validate=1, configpath=None, **kw ):
+                  verbose=None, validate=1, configpath=None, timeout=None,
+                  cache=None, **kw ):
 
         """
         Create Executor. *name* must point to an existing program configuration
@@ -305,6 +320,12 @@ class Executor:
         :param validate: validate binary and environment immedeatly (1=default)
                          or only before execution (0)
         :type validate: 1|0 
+        :param timeout: kill the program and raise RunError if it is still
+                        running after this many seconds (default: None)
+        :type  timeout: float
+        :param cache: re-use results of identical earlier calls; True means
+                      ResultCache with default settings (default: None)
+        :type  cache: ResultCache | True
         :param kw: key=value pairs with values for template file or string
         :type  kw: key=value
         
@@ -349,6 +370,13 @@ class Executor:
 
         self.cwd = cwd or self.exe.cwd
 
+        self.timeout = timeout
+
+        if cache is True:
+            cache = ResultCache()
+        self.cache = cache
+        self.cache_key = None  #: set by run() if a cache is used
+
         #: Log object for own messages; undocumented: capture string as well
         self.log = log or StdLog()
         if type(self.log) is str:
@@ -431,6 +459,7 @@ class Executor:
         :rtype: str, str
         
         :raise RunError: if OSError occurs during Popen or Popen.communicate
+                         or if the process exceeds self.timeout
         """
         try:
             p = subprocess.Popen( cmd.split(),
@@ -444,7 +473,14 @@ class Executor:
 
             self.pid = p.pid
 
-            output, error = p.communicate( inp )
+            try:
+                output, error = p.communicate( inp,
+                                        timeout=getattr(self, 'timeout', None))
+            except subprocess.TimeoutExpired:
+                p.kill()
+                p.communicate()
+                raise RunError('%s did not finish within %s seconds.' \
+                               % (self.exe.name, self.timeout))
         
             #convert byte string to actual string for Python 3.x compatibility
 ##            if output is not None: output = output.decode(sys.stdout.encoding)
@@ -548,6 +584,14 @@ class Executor:
 
             self.inp  = self.generateInp()
 
+            if getattr( self, 'cache', None ) is not None:
+                self.cache_key = self.cacheKey( self.inp )
+                found, result = self.cache.get( self.cache_key )
+                if found:
+                    self.result = result
+                    self.cleanup()
+                    return self.result
+
             self.runTime = self.execute( inp=self.inp )
 
             self.postProcess()
@@ -564,12 +608,75 @@ class Executor:
                 self.fail()
             else:
                 self.finish()
+                if getattr( self, 'cache', None ) is not None:
+                    self.cache.put( self.cache_key, self.result )
         finally:
             self.cleanup()
 
         return self.result
 
 
+    def __fileContent( self, s ):
+        """
+        Replace names of existing files in a string by the file content and
+        names of temporary files by place holders.
+        """
+        r = []
+        temp = [ (self.f_in, '<f_in>'), (self.f_out, '<f_out>'),
+                 (self.f_err, '<f_err>'), (self.tempdir, '<tempdir>') ]
+
+        for token in re.split( r'([\s=\'",;]+)', s ):
+            f = os.path.join( self.cwd or '', token )
+
+            if token and os.path.isfile( f ) and f != self.f_out:
+                with open( f, 'rb' ) as fh:
+                    token = fh.read()
+            else:
+                for fname, holder in temp:
+                    if fname:
+                        token = token.replace( fname, holder )
+            r.append( token )
+
+        return r
+
+
+    def cacheKey( self, inp=None ):
+        """
+        Create the hash that identifies results in the cache. It covers
+        class name, program binary and version, arguments and program
+        input. Names of existing files in the arguments or input are
+        replaced by their content; names of temporary files are ignored.
+        The program version is taken from the ExeConfig `version` option
+        or, if not given, modification time and size of the binary.
+        Override to include additional information.
+
+        :param inp: program input (input string or name of input file)
+        :type  inp: str
+
+        :return: hash
+        :rtype: str
+        """
+        version = self.exe.version
+        if not version:
+            try:
+                st = os.stat( t.absbinary( self.exe.bin ) )
+                version = (st.st_mtime, st.st_size)
+            except IOError:
+                version = None
+
+        parts = [ self.__class__.__name__, self.exe.bin, version ]
+        parts += self.__fileContent( self.args or '' )
+
+        if self.exe.pipes and inp:
+            parts += self.__fileContent( inp )
+
+        elif self.f_in and os.path.isfile( self.f_in ):
+            with open( self.f_in, 'r', errors='replace' ) as fh:
+                parts += self.__fileContent( fh.read() )
+
+        return ResultCache.key( *parts )
+
+
     def command( self ):
         """
         Compose command string from binary, arguments, nice, and node.
@@ -824,6 +931,50 @@ class Test(BT.BiskitTest):
 
         self.assertTrue( not os.path.exists( self.e.tempdir ),
                       'tempfolder has not been removed.')
+
+    def test_cache(self):
+        """Executor test re-using results from a ResultCache"""
+        self.cache = ResultCache( tempfile.mkdtemp( '', 'resultcache_' ) )
+
+        f_script = tempfile.mktemp( '.py', 'script_', self.cache.folder )
+        with open( f_script, 'w' ) as f:
+            f.write( 'import random; print(random.random())' )
+
+        def run( args=f_script, cwd=None ):
+            e = Executor( 'python', args=args, strict=0, tempdir=True,
+                          cache=self.cache, cwd=cwd )
+            e.exe.pipes = 1
+            return e.run()
+
+        try:
+            self.r1 = run()
+            self.r2 = run()
+            self.assertEqual( self.r1, self.r2 )
+
+            ## same file name but different content
+            with open( f_script, 'a' ) as f:
+                f.write( '\n' )
+            self.r3 = run()
+            self.assertNotEqual( self.r1, self.r3 )
+
+            s = self.cache.stats()
+            self.assertEqual( (s['hits'], s['misses'], s['entries']),
+                              (1, 2, 2) )
+
+            ## file name relative to cwd
+            f_rel = os.path.basename( f_script )
+            self.r4 = run( f_rel, cwd=self.cache.folder )
+            self.assertEqual( self.r4, self.r3 )
+
+            with open( f_script, 'a' ) as f:
+                f.write( '\n' )
+            self.r5 = run( f_rel, cwd=self.cache.folder )
+            self.assertNotEqual( self.r4, self.r5 )
+
+            s = self.cache.stats()
+            self.assertEqual( (s['hits'], s['misses']), (2, 3) )
+        finally:
+            t.tryRemove( self.cache.folder, tree=True )
         
         
 
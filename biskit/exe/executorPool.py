@@ -0,0 +1,206 @@
+##
+## Biskit, a toolkit for the manipulation of macromolecular structures
+## Copyright (C) 2004-2018 Raik Gruenberg & Johan Leckner
+##
+## This program is free software; you can redistribute it and/or
+## modify it under the terms of the GNU General Public License as
+## published by the Free Software Foundation; either version 3 of the
+## License, or any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+## General Public License for more details.
+##
+## You find a copy of the GNU General Public License in the file
+## license.txt along with this program; if not, write to the Free
+## Software Foundation, Inc., 675 Mass Ave, Cambridge, MA 02139, USA.
+##
+##
+
+"""
+Run many Executor jobs concurrently.
+"""
+
+## allow relative imports when calling module as main script for testing https://www.python.org/dev/peps/pep-0366/
+if __name__ == "__main__" and __package__ is None:
+    import biskit.exe; __package__ = "biskit.exe"
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import biskit.tools as t
+
+from .executor import Executor
+
+
+class ExecutorPool:
+    """
+    Run many external program calls at the same time, each one wrapped
+    into its own :class:`Executor` instance. Jobs are handed to a bounded
+    number of worker threads; each thread runs the normal Executor life
+    cycle (prepare, execute, postProcess, finish/fail, cleanup). As the
+    threads only wait for their external process, no extra Python
+    processes are needed.
+
+    Usage::
+
+      with ExecutorPool( 4 ) as pool:
+          jobs = [ pool.submit( Dssp, m ) for m in models ]
+          results = [ j.result() for j in jobs ]
+
+    or, shorter:
+
+      results = ExecutorPool( 4 ).map( Dssp, models )
+
+    Jobs that are submitted as Executor class (plus parameters) are only
+    created in the worker thread and, unless a tempdir is given, each one
+    gets a new temporary folder which is removed after the job finishes.
+    Executor instances can be submitted as well but are run as they are.
+    """
+
+    def __init__( self, n_workers=None, timeout=None, isolate=True ):
+        """
+        :param n_workers: maximal number of programs running at the same
+                          time (default: None, number of CPUs)
+        :type  n_workers: int
+        :param timeout: default time limit for each job in seconds,
+                        see Executor (default: None, no limit)
+        :type  timeout: float
+        :param isolate: create a separate temporary folder for each job
+                        that is created by the pool (default: True)
+        :type  isolate: bool
+        """
+        self.n_workers = n_workers or os.cpu_count() or 1
+        self.timeout = timeout
+        self.isolate = isolate
+
+        self.pool = ThreadPoolExecutor( max_workers=self.n_workers )
+
+
+    def __enter__( self ):
+        return self
+
+    def __exit__( self, *args ):
+        self.shutdown()
+
+
+    def _run( self, job, args, kw, timeout ):
+        """
+        Create (if necessary) and run a single Executor job.
+        Called in a worker thread.
+
+        :return: Executor.result
+        :rtype: any
+        """
+        if not isinstance( job, Executor ):
+            if self.isolate:
+                kw.setdefault( 'tempdir', True )
+            job = job( *args, **kw )
+
+        if timeout is not None:
+            job.timeout = timeout
+
+        try:
+            return job.run()
+        except:
+            ## run() does not clean up after errors in execute()
+            job.cleanup()
+            raise
+
+
+    def submit( self, job, *args, **kw ):
+        """
+        Schedule one job.
+
+        :param job: Executor (sub)class OR Executor instance
+        :type  job: class OR Executor
+        :param args: parameters for creating a job from an Executor class
+        :type  args: any
+        :param kw: key=value parameters for creating a job from an Executor
+                   class; a 'timeout' keyword overrides the pool time limit
+        :type  kw: key=value
+
+        :return: future, its result() is the result of Executor.run() (or
+                 re-raises an exception thrown during the job)
+        :rtype: concurrent.futures.Future
+        """
+        timeout = kw.pop( 'timeout', self.timeout )
+
+        return self.pool.submit( self._run, job, args, kw, timeout )
+
+
+    def map( self, job, *iterables, **kw ):
+        """
+        Run one job for each (set of) input parameters and wait for all
+        of them.
+
+        :param job: Executor (sub)class
+        :type  job: class
+        :param iterables: one or more iterables with positional arguments
+        :type  iterables: iterable
+        :param kw: key=value parameters passed to all jobs
+        :type  kw: key=value
+
+        :return: results of all jobs in order of input
+        :rtype: [any]
+        """
+        futures = [ self.submit( job, *a, **dict( kw ) )
+                    for a in zip( *iterables ) ]
+
+        return [ f.result() for f in futures ]
+
+
+    def shutdown( self, wait=True ):
+        """
+        Stop accepting new jobs and (by default) wait for running jobs.
+
+        :param wait: block until all jobs are finished (default: True)
+        :type  wait: bool
+        """
+        self.pool.shutdown( wait=wait )
+
+
+#############
+##  TESTING
+#############
+import biskit.test as BT
+
+class Test(BT.BiskitTest):
+    """ExecutorPool test"""
+
+    TAGS = [ BT.EXE ]
+
+    def test_ExecutorPool( self ):
+        """ExecutorPool test (run 6 python processes on 3 workers)"""
+        from .exeConfigCache import ExeConfigCache
+        from .executor import RunError
+
+        self.x = ExeConfigCache.get( 'python', strict=0 )
+        self.x.pipes = 1
+
+        tempdirs = lambda: [ f for f in os.listdir( t.tempDir() )
+                             if f.startswith( 'executor_' ) ]
+        before = tempdirs()
+
+        with ExecutorPool( 3 ) as self.pool:
+
+            self.r = self.pool.map( Executor, ['python'] * 6,
+                                    args="-c print(6*7)", strict=0 )
+
+            slow = self.pool.submit( Executor, 'python', strict=0,
+                                     args="-c __import__('time').sleep(10)",
+                                     timeout=0.5 )
+
+            self.assertRaises( RunError, slow.result )
+
+        self.assertEqual( len( self.r ), 6 )
+        self.assertTrue( all( [ r[0].strip() == '42' for r in self.r ] ) )
+
+        ## each job had its own temporary folder, which was removed
+        self.assertEqual( tempdirs(), before )
+
+
+if __name__ == '__main__':
+
+    BT.localTest()
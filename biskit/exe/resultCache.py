@@ -0,0 +1,280 @@
+##
+## Biskit, a toolkit for the manipulation of macromolecular structures
+## Copyright (C) 2004-2018 Raik Gruenberg & Johan Leckner
+##
+## This program is free software; you can redistribute it and/or
+## modify it under the terms of the GNU General Public License as
+## published by the Free Software Foundation; either version 3 of the
+## License, or any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+## General Public License for more details.
+##
+## You find a copy of the GNU General Public License in the file
+## license.txt along with this program; if not, write to the Free
+## Software Foundation, Inc., 675 Mass Ave, Cambridge, MA 02139, USA.
+##
+##
+
+"""
+Content-addressed on-disk cache for results of external programs.
+"""
+
+import os
+import pickle
+import hashlib
+import tempfile
+import threading
+
+import biskit.tools as t
+from biskit.errors import BiskitError
+
+
+class ResultCacheError( BiskitError ):
+    pass
+
+
+class ResultCache:
+    """
+    Store pickled results of external program calls in a folder, one file
+    per result, named by a hash of everything that went into the call.
+    Executor (and sub-classes) use the cache if given one::
+
+      cache = ResultCache( maxsize=500 )
+      model = Dssp( m, cache=cache ).run()   ## runs dssp
+      model = Dssp( m, cache=cache ).run()   ## taken from the cache
+
+    The folder is limited to maxsize MB; the least recently used results
+    are removed first. Access times are tracked through the modification
+    time of the cache files, so that the same folder can be shared by
+    several sessions or processes.
+
+    One ResultCache instance counts hits and misses, see stats().
+    """
+
+    #: default cache folder
+    FOLDER = os.path.expanduser( '~/.biskit/cache' )
+
+    #: file extension of cache entries
+    EXT = '.result'
+
+    def __init__( self, folder=None, maxsize=1000 ):
+        """
+        :param folder: folder for cached results, created if needed
+                       (default: None, ~/.biskit/cache)
+        :type  folder: str
+        :param maxsize: maximal size of all cached results in MB
+                        (default: 1000)
+        :type  maxsize: float
+        """
+        self.folder = t.absfile( folder or self.FOLDER )
+        self.maxsize = maxsize
+
+        self.hits = 0
+        self.misses = 0
+
+        self.lock = threading.Lock()
+
+        if not os.path.exists( self.folder ):
+            os.makedirs( self.folder )
+
+
+    @staticmethod
+    def key( *parts ):
+        """
+        Create a hash from strings, bytes or any other objects (which are
+        converted with repr()).
+
+        :param parts: values that identify a program call
+        :type  parts: any
+
+        :return: hex digest
+        :rtype: str
+        """
+        h = hashlib.sha1()
+        for p in parts:
+            if isinstance( p, str ):
+                p = p.encode( 'utf-8' )
+            elif not isinstance( p, bytes ):
+                p = repr( p ).encode( 'utf-8' )
+            h.update( p )
+            h.update( b'\0' )
+        return h.hexdigest()
+
+
+    def fname( self, key ):
+        """
+        :return: cache file for given key
+        :rtype: str
+        """
+        return os.path.join( self.folder, key + self.EXT )
+
+
+    def get( self, key ):
+        """
+        Look up a result.
+
+        :param key: hash, see key()
+        :type  key: str
+
+        :return: (True, result) OR (False, None) if not found
+        :rtype: (bool, any)
+        """
+        f = self.fname( key )
+        try:
+            with open( f, 'rb' ) as fh:
+                r = pickle.load( fh )
+            os.utime( f, None )  ## mark as recently used
+
+        except (IOError, OSError, EOFError, pickle.UnpicklingError):
+            with self.lock:
+                self.misses += 1
+            return False, None
+
+        with self.lock:
+            self.hits += 1
+        return True, r
+
+
+    def put( self, key, result ):
+        """
+        Store a result and remove old results beyond the size limit.
+
+        :param key: hash, see key()
+        :type  key: str
+        :param result: any pickle-able object
+        :type  result: any
+
+        :raise ResultCacheError: if result cannot be pickled
+        """
+        try:
+            data = pickle.dumps( result, protocol=pickle.HIGHEST_PROTOCOL )
+        except Exception as why:
+            raise ResultCacheError( 'Cannot cache result: %r' % why )
+
+        ## write to temporary file first so that readers never see half files
+        fd, ftemp = tempfile.mkstemp( '.tmp', 'result_', self.folder )
+        with os.fdopen( fd, 'wb' ) as fh:
+            fh.write( data )
+        os.replace( ftemp, self.fname( key ) )
+
+        self.evict()
+
+
+    def entries( self ):
+        """
+        :return: cache files with size and last access, oldest first
+        :rtype: [ (float, int, str) ] -- (mtime, size, file name)
+        """
+        r = []
+        for f in os.listdir( self.folder ):
+            if not f.endswith( self.EXT ):
+                continue
+            f = os.path.join( self.folder, f )
+            try:
+                st = os.stat( f )
+                r.append( (st.st_mtime, st.st_size, f) )
+            except OSError:
+                pass  ## removed in the meantime
+        r.sort()
+        return r
+
+
+    def size( self ):
+        """
+        :return: size of all cached results in bytes
+        :rtype: int
+        """
+        return sum( [ e[1] for e in self.entries() ] )
+
+
+    def evict( self ):
+        """
+        Remove least recently used results until the cache is smaller
+        than maxsize.
+        """
+        entries = self.entries()
+        total = sum( [ e[1] for e in entries ] )
+        limit = self.maxsize * 1024 * 1024
+
+        while entries and total > limit:
+            mtime, size, f = entries.pop( 0 )
+            t.tryRemove( f )
+            total -= size
+
+
+    def clear( self ):
+        """
+        Remove all cached results and reset statistics.
+        """
+        for e in self.entries():
+            t.tryRemove( e[2] )
+        self.hits = self.misses = 0
+
+
+    def stats( self ):
+        """
+        :return: dict with number of 'hits' and 'misses' (of this instance),
+                 number of cache 'entries' and total 'size' in bytes
+        :rtype: dict
+        """
+        entries = self.entries()
+        return { 'hits': self.hits, 'misses': self.misses,
+                 'entries': len( entries ),
+                 'size': sum( [ e[1] for e in entries ] ) }
+
+
+#############
+##  TESTING
+#############
+import biskit.test as BT
+
+class Test(BT.BiskitTest):
+    """ResultCache test"""
+
+    def prepare(self):
+        self.folder = tempfile.mkdtemp( '', 'resultcache_' )
+
+    def cleanUp(self):
+        t.tryRemove( self.folder, tree=True )
+
+    def test_ResultCache(self):
+        """ResultCache put/get/eviction test"""
+        self.c = ResultCache( self.folder, maxsize=0.05 )
+
+        k = ResultCache.key( 'dssp', 'some input', b'\x00', 1.0 )
+        self.assertEqual( k, ResultCache.key( 'dssp', 'some input', b'\x00',
+                                               1.0 ) )
+        self.assertNotEqual( k, ResultCache.key( 'dssp', 'some input' ) )
+
+        self.assertEqual( self.c.get( k ), (False, None) )
+        self.c.put( k, ('out', None, 0) )
+        self.assertEqual( self.c.get( k ), (True, ('out', None, 0)) )
+
+        ## 20 kB each, only 2 of them fit next to the first result
+        keys = [ ResultCache.key( i ) for i in range( 4 ) ]
+        for i, key in enumerate( keys ):
+            self.c.put( key, 'x' * 20000 )
+            os.utime( self.c.fname( key ), (i+1, i+1) )
+            self.c.evict()
+
+        self.assertFalse( self.c.get( keys[1] )[0] )
+        self.assertTrue( self.c.get( keys[3] )[0] )
+
+        s = self.c.stats()
+        if self.local:
+            print( s )
+
+        self.assertEqual( s['entries'], 3 )
+        self.assertEqual( (s['hits'], s['misses']), (2, 2) )
+        self.assertTrue( s['size'] <= 0.05 * 1024 * 1024 )
+
+        self.c.clear()
+        self.assertEqual( self.c.stats()['entries'], 0 )
+
+
+if __name__ == '__main__':
+
+    BT.localTest()
@@ -202,14 +202,14 @@ def pairwiseDistances(u, v):
     :return: array( len(u) x len(v) ) of double
     :rtype: array
     """
-    diag1 = N0.diagonal( N0.dot( u, N0.transpose(u) ) )
-    diag2 = N0.diagonal( N0.dot( v, N0.transpose(v) ) )
-    dist = -N0.dot( v,N0.transpose(u) )\
-         -N0.transpose( N0.dot( u, N0.transpose(v) ) )
-    dist = N0.transpose( N0.asarray( list(map( lambda column,a:column+a, \
-                                        N0.transpose(dist), diag1)) ) )
-    return N0.transpose( N0.sqrt( N0.asarray(
-        list(map( lambda row,a: row+a, dist, diag2 ) ) )))
+    u, v = N0.asarray( u, N0.Float64 ), N0.asarray( v, N0.Float64 )
+    diag1 = N0.sum( u * u, 1 )
+    diag2 = N0.sum( v * v, 1 )
+    uv = N0.dot( u, N0.transpose(v) )
+
+    ## rounding may give slightly negative values for coincident points
+    d2 = -uv - uv + diag1[:, N0.NewAxis] + diag2
+    return N0.sqrt( N0.maximum( d2, 0. ) )
 
 
 def randomMask( nOnes, length ):
@@ -4,12 +4,16 @@ if __name__ == "__main__" and __package__ is None:
     import biskit.md; __package__ = "biskit.md"
 
 from .trajectory import Trajectory, TrajError, TrajProfiles
+from .pca import PCA, PCAError
 from .ensembleTraj import EnsembleTraj, traj2ensemble
 
 from .amberLeap import AmberLeap
 from .amberParmBuilder import AmberParmBuilder
 from .amberCrdParser import AmberCrdParser, ParseError
 from .amberRstParser import AmberRstParser
+from .pdbTrajParser import PDBTrajParser
+from .binaryTrajParser import BinaryTrajParser, BinaryTrajError, DCDFile,\
+     NetCDFFile
 
 from .amberCrdEntropist import AmberCrdEntropist, EntropistError
 
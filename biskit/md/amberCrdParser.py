@@ -28,6 +28,7 @@ import biskit.core.oldnumeric as N0
 
 import re
 import sys
+import itertools
 
 import biskit.tools as T
 from biskit import PDBModel, StdLog
@@ -169,36 +170,135 @@ class AmberCrdParser:
         return N.reshape( xyz, ( len(xyz) // 3, 3 ) ).astype(N.float)
 
 
-    def crd2traj( self ):
+    def lenFrames( self ):
+        """
+        Count the frames in the crd file without parsing them.
+
+        :return: number of complete frames
+        :rtype: int
+        """
+        n_lines = 0
+        last = b'\n'
+
+        with T.gzopen( self.fcrd, 'rb' ) as f:
+            for chunk in iter( lambda: f.read( 2**20 ), b'' ):
+                n_lines += chunk.count( b'\n' )
+                last = chunk[-1:]
+
+        if last != b'\n':
+            n_lines += 1
+
+        ## first line is a title
+        return max( n_lines - 1, 0 ) // self.lines_per_frame
+
+
+    def __parseBlock( self, lines ):
+        """
+        Convert the lines of several complete frames into coordinates.
+        Each line holds up to 10 numbers in fields of 8 characters, which
+        are cut out and converted by numpy in a single step.
+
+        :param lines: lines of k frames (including box lines)
+        :type  lines: [str]
+
+        :return: coordinates, k x N x 3
+        :rtype: array of float32
+
+        :raise ParseError: if lines do not match the expected format
+        """
+        k = len( lines ) // self.lines_per_frame
+
+        if self.box:
+            box = lines[ self.lines_per_frame - 1 :: self.lines_per_frame ]
+            for l in box:
+                if len( self.line2numbers( l ) ) != 3:
+                    raise ParseError( "BoxInfo must consist of 3 numbers." )
+
+            del lines[ self.lines_per_frame - 1 :: self.lines_per_frame ]
+
+        buf = ''.join( [ l.rstrip( '\r\n' ) for l in lines ] )
+
+        if len( buf ) != k * self.n * 3 * 8:
+            raise ParseError( 'Unexpected line length in %s' % self.fcrd )
+
+        raw = N.frombuffer( buf.encode( 'ascii' ), N.uint8 ).reshape( -1, 8 )
+
+        ## separate the 8-character fields by a blank for fromstring
+        r = N.empty( ( len( raw ), 9 ), N.uint8 )
+        r[:, :8] = raw
+        r[:, 8] = ord(' ')
+
+        xyz = N.fromstring( r.tobytes().decode('ascii'), N.float32, sep=' ' )
+
+        if len( xyz ) != k * self.n * 3:
+            raise ParseError( 'Invalid coordinates in %s' % self.fcrd )
+
+        return N.reshape( xyz, ( k, self.n, 3 ) )
+
+
+    def frameBlocks( self, block=500 ):
+        """
+        Iterate over the frames of the crd file in blocks without loading
+        the whole file. Uses its own file handle and is independent of
+        L{nextFrame}. An incomplete frame at the end of the file is ignored.
+
+        :param block: number of frames per block (default: 500)
+        :type  block: int
+
+        :return: generator of coordinate blocks, block x N x 3
+        :rtype: generator of array( float32 )
+
+        :raise ParseError: if lines do not match the expected format
+        """
+        with T.gzopen( self.fcrd ) as f:
+
+            ## skip first title line
+            f.readline()
+
+            while True:
+                lines = list( itertools.islice( f,
+                                                block * self.lines_per_frame ))
+
+                k = len( lines ) // self.lines_per_frame
+                if k == 0:
+                    break
+
+                yield self.__parseBlock( lines[ : k * self.lines_per_frame ] )
+
+                if k < block:
+                    break
+
+
+    def crd2traj( self, block=500 ):
         """
         Convert coordinates into a Trajectory object.
 
+        :param block: number of frames parsed at once (default: 500)
+        :type  block: int
+
         :return: trajectory object
         :rtype: Trajectory
         """
-        ## skip first empty line
-        self.crd.readline()
+        n_frames = self.lenFrames()
 
-        xyz = []
+        frames = N.zeros( ( n_frames, self.n, 3 ), N.float32 )
         i = 0
 
         if self.verbose: self.log.write( "Reading frames .." )
 
-        try:
-            while 1==1:
+        for xyz in self.frameBlocks( block ):
 
-                xyz += [ self.nextFrame() ]
-                i += 1
+            frames[ i : i + len( xyz ) ] = xyz
+            i += len( xyz )
 
-                if i % 100 == 0 and self.verbose:
-                    self.log.write( '#' )
+            if self.verbose:
+                self.log.write( '#' )
 
-        except EOFError:
-            if self.verbose: self.log.write("Read %i frames.\n" % i)
+        if self.verbose: self.log.write("Read %i frames.\n" % i)
 
         t = Trajectory( refpdb=self.ref )
 
-        t.frames = N0.array( xyz ).astype(N0.Float32)
+        t.frames = frames[ : i ]
 
         t.setRef( self.ref )
         t.ref.disconnect()
@@ -243,6 +343,20 @@ class Test( BT.BiskitTest ):
         self.assertEqual( len(self.t), 10 )
         self.assertEqual( self.t.lenAtoms(), 440 )
 
+    def test_frameBlocks(self):
+        """AmberCrdParser.frameBlocks vs. nextFrame test"""
+        self.p = AmberCrdParser( self.finp, self.fref, box=True )
+
+        blocks = list( self.p.frameBlocks( block=3 ) )
+        self.assertEqual( [ len(b) for b in blocks ], [3, 3, 3, 1] )
+        self.assertEqual( self.p.lenFrames(), 10 )
+
+        self.p.crd.readline()
+        for b in blocks:
+            for xyz in b:
+                self.assertTrue( N.all( N.abs( self.p.nextFrame() - xyz )
+                                        < 1e-4 ) )
+
 if __name__ == '__main__':
 
     BT.localTest()
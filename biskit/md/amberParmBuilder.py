@@ -275,17 +275,10 @@ class AmberParmBuilder:
         if len( m ) < 2:
             return []
 
-        pw = MU.pairwiseDistances( m.xyz, m.xyz )
+        i, j = m.pairsWithin( cutoff )
 
-        pw = N0.less( pw, cutoff )
-
-        r = []
-        for i in range( len( pw ) ):
-            for j in range( i+1, len(pw) ):
-                if pw[i,j]:
-                    r += [ (m.atoms['residue_number'][i],
-                            m.atoms['residue_number'][j]) ]
-        return r
+        resnum = m.atoms['residue_number']
+        return [ (resnum[a], resnum[b]) for a, b in zip( i, j ) ]
 
 
     def __cys2cyx( self, model, ss_residues ):
@@ -0,0 +1,644 @@
+##
+## Biskit, a toolkit for the manipulation of macromolecular structures
+## Copyright (C) 2004-2018 Raik Gruenberg & Johan Leckner
+##
+## This program is free software; you can redistribute it and/or
+## modify it under the terms of the GNU General Public License as
+## published by the Free Software Foundation; either version 3 of the
+## License, or any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+## General Public License for more details.
+##
+## You find a copy of the GNU General Public License in the file
+## license.txt along with this program; if not, write to the Free
+## Software Foundation, Inc., 675 Mass Ave, Cambridge, MA 02139, USA.
+##
+##
+"""
+Read and write binary MD trajectories (Amber NetCDF and CHARMM/NAMD DCD).
+
+Both formats are accessed through numpy.memmap, i.e. only the frames (and
+atoms) that are actually requested are read from disk.
+"""
+
+import os
+import struct
+
+import numpy as N
+
+import biskit
+import biskit.tools as T
+from biskit import PDBModel, StdLog
+
+## allow relative imports when calling module by itself for testing (pep-0366)
+if __name__ == "__main__" and __package__ is None:
+    import biskit.md; __package__ = "biskit.md"
+
+from .trajectory import Trajectory, TrajError
+from .ensembleTraj import EnsembleTraj, EnsembleTrajError
+
+
+class BinaryTrajError( TrajError ):
+    pass
+
+
+class DCDFile:
+    """
+    CHARMM / NAMD / X-PLOR DCD trajectory file.
+
+    Each frame is a sequence of Fortran records (optional unit cell, then
+    all x, all y and all z coordinates). The frame block is mapped into
+    memory as array of structured records. Files with fixed atoms or 4-D
+    coordinates are not supported.
+    """
+
+    def __init__( self, fname ):
+        """
+        :param fname: path to DCD file
+        :type  fname: str
+
+        :raise BinaryTrajError: if the file is not a supported DCD file
+        """
+        self.fname = T.absfile( fname )
+
+        with open( self.fname, 'rb' ) as f:
+            head = f.read( 92 )
+
+            if len( head ) < 92 or head[4:8] != b'CORD':
+                raise BinaryTrajError( '%s is not a DCD file.' % self.fname )
+
+            for e in '<>':
+                if N.frombuffer( head[:4], e + 'i4' )[0] == 84:
+                    break
+            else:
+                raise BinaryTrajError( '%s is not a DCD file.' % self.fname )
+
+            icntrl = N.frombuffer( head[8:88], e + 'i4' )
+
+            charmm = icntrl[19] != 0
+            self.hasCell = charmm and icntrl[10] != 0
+
+            if charmm and icntrl[11] != 0:
+                raise BinaryTrajError( '4-D DCD files are not supported.' )
+            if icntrl[8] != 0:
+                raise BinaryTrajError( 'DCD files with fixed atoms are not '
+                                       'supported.' )
+
+            ## title record
+            size = N.frombuffer( f.read( 4 ), e + 'i4' )[0]
+            f.seek( size + 4, 1 )
+
+            ## number of atoms record
+            self.n_atoms = int( N.frombuffer( f.read( 12 ), e+'i4' )[1] )
+
+            self.offset = f.tell()
+
+        self.dtype = self.frameType( self.n_atoms, self.hasCell, e )
+
+        size = os.path.getsize( self.fname ) - self.offset
+        self.n_frames = size // self.dtype.itemsize
+
+
+    @staticmethod
+    def frameType( n_atoms, cell=False, endian='<' ):
+        """
+        :return: record layout of one frame
+        :rtype: numpy.dtype
+        """
+        fields = []
+        if cell:
+            fields += [ ('cell_head', endian+'i4'), ('cell', endian+'f8', (6,)),
+                        ('cell_tail', endian+'i4') ]
+
+        for c in 'xyz':
+            fields += [ (c + '_head', endian+'i4'),
+                        (c, endian+'f4', (n_atoms,)),
+                        (c + '_tail', endian+'i4') ]
+
+        return N.dtype( fields )
+
+
+    def read( self, start=0, stop=None, step=1, atoms=None ):
+        """
+        Read coordinates of a range of frames.
+
+        :param start: first frame (default: 0)
+        :type  start: int
+        :param stop: stop before this frame (default: None, read to end)
+        :type  stop: int
+        :param step: read every step-th frame (default: 1)
+        :type  step: int
+        :param atoms: indices of atoms to read (default: None, all)
+        :type  atoms: [int]
+
+        :return: coordinates, frames x atoms x 3
+        :rtype: array( float32 )
+        """
+        recs = N.memmap( self.fname, self.dtype, mode='r',
+                         offset=self.offset, shape=( self.n_frames, ) )
+        recs = recs[ start : stop : step ]
+
+        n = self.n_atoms if atoms is None else len( atoms )
+        r = N.empty( ( len( recs ), n, 3 ), N.float32 )
+
+        for i, c in enumerate( 'xyz' ):
+            xyz = recs[ c ]
+            if atoms is not None:
+                xyz = N.take( xyz, atoms, 1 )
+            r[ :, :, i ] = xyz
+
+        return r
+
+
+    @staticmethod
+    def write( fname, frames, title='', block=500 ):
+        """
+        Write coordinates into a new (CHARMM-style) DCD file.
+
+        :param fname: output file name
+        :type  fname: str
+        :param frames: coordinates, frames x atoms x 3
+        :type  frames: array
+        :param title: title line (default: '')
+        :type  title: str
+        :param block: number of frames converted at once (default: 500)
+        :type  block: int
+        """
+        n_frames, n_atoms = N.shape( frames )[:2]
+
+        icntrl = N.zeros( 20, '<i4' )
+        icntrl[0] = n_frames        ## NSET
+        icntrl[2] = 1               ## NSAVC
+        icntrl[3] = n_frames        ## NSTEP
+        icntrl[9] = N.array( 1., '<f4' ).view( '<i4' )  ## DELTA
+        icntrl[19] = 24             ## CHARMM version
+
+        title = ( title or 'Created by Biskit %s' % biskit.__version__ )
+        title = title[:80].ljust( 80 ).encode( 'ascii' )
+
+        dtype = DCDFile.frameType( n_atoms )
+
+        with open( T.absfile( fname ), 'wb' ) as f:
+            f.write( struct.pack( '<i4s', 84, b'CORD' ) + icntrl.tobytes()
+                     + struct.pack( '<i', 84 ) )
+            f.write( struct.pack( '<ii', 84, 1 ) + title
+                     + struct.pack( '<i', 84 ) )
+            f.write( struct.pack( '<iii', 4, n_atoms, 4 ) )
+
+            for start in range( 0, n_frames, block ):
+                xyz = N.asarray( frames[ start : start + block ] )
+
+                recs = N.zeros( len( xyz ), dtype )
+                for i, c in enumerate( 'xyz' ):
+                    recs[ c + '_head' ] = recs[ c + '_tail' ] = 4 * n_atoms
+                    recs[ c ] = xyz[ :, :, i ]
+
+                recs.tofile( f )
+
+
+class NetCDFFile:
+    """
+    Amber NetCDF trajectory file (NetCDF-3 classic or 64-bit offset).
+
+    Only the header is parsed, variables are exposed as (strided) views
+    into a memory map of the file. Record variables like 'coordinates'
+    have the unlimited 'frame' dimension first.
+    """
+
+    #: NetCDF type code -> numpy type (big endian)
+    TYPES = { 1:'>i1', 2:'S1', 3:'>i2', 4:'>i4', 5:'>f4', 6:'>f8' }
+
+    NC_DIMENSION = 10
+    NC_VARIABLE = 11
+    NC_ATTRIBUTE = 12
+
+    def __init__( self, fname ):
+        """
+        :param fname: path to NetCDF file
+        :type  fname: str
+
+        :raise BinaryTrajError: if the file is not a NetCDF-3 file
+        """
+        self.fname = T.absfile( fname )
+        self.__map = N.memmap( self.fname, N.uint8, mode='r' )
+        self.__pos = 0
+
+        magic = self.__map[:4].tobytes()
+        if magic[:3] != b'CDF' or magic[3] not in (1, 2):
+            raise BinaryTrajError( '%s is not a NetCDF-3 file.' % self.fname )
+
+        self.version = magic[3]
+        self.__pos = 4
+
+        self.n_records = self.__int()
+
+        #: [ (name, length) ], length 0 marks the record dimension
+        self.dimensions = self.__list( self.NC_DIMENSION, self.__dimension )
+        self.attributes = dict( self.__list( self.NC_ATTRIBUTE,
+                                             self.__attribute ) )
+        self.variables = dict( self.__list( self.NC_VARIABLE,
+                                            self.__variable ) )
+
+        rec_vars = [ v for v in self.variables.values() if v['record'] ]
+
+        self.recsize = sum( [ v['vsize'] for v in rec_vars ] )
+
+        ## streaming files do not know their number of records
+        if self.n_records < 0 and rec_vars:
+            first = min( [ v['begin'] for v in rec_vars ] )
+            self.n_records = ( len( self.__map ) - first ) // self.recsize
+
+
+    def __read( self, dtype, n=1 ):
+        dtype = N.dtype( dtype )
+        size = dtype.itemsize * n
+
+        r = self.__map[ self.__pos : self.__pos + size ].view( dtype )
+        self.__pos += size + ( -size % 4 )  ## values are padded to 4 bytes
+
+        return r
+
+    def __int( self ):
+        return int( self.__read( '>i4' )[0] )
+
+    def __name( self ):
+        return self.__read( 'S1', self.__int() ).tobytes().decode( 'ascii' )
+
+    def __list( self, tag, parse ):
+        """parse a tagged list of dimensions, attributes or variables"""
+        t, n = self.__int(), self.__int()
+
+        if t == 0 and n == 0:  ## ABSENT
+            return []
+        if t != tag:
+            raise BinaryTrajError( 'Invalid NetCDF header in %s' % self.fname )
+
+        return [ parse() for i in range( n ) ]
+
+    def __dimension( self ):
+        return self.__name(), self.__int()
+
+    def __attribute( self ):
+        name = self.__name()
+        dtype = self.TYPES[ self.__int() ]
+        value = self.__read( dtype, self.__int() )
+
+        if dtype == 'S1':
+            return name, value.tobytes().decode( 'ascii' )
+        return name, value.astype( dtype[1:] )
+
+    def __variable( self ):
+        name = self.__name()
+        dims = [ self.__int() for i in range( self.__int() ) ]
+        attributes = dict( self.__list( self.NC_ATTRIBUTE, self.__attribute ))
+        dtype = self.TYPES[ self.__int() ]
+        vsize = self.__int()
+        begin = int( self.__read( '>i8' if self.version == 2 else '>i4' )[0] )
+
+        shape = [ self.dimensions[ d ][1] for d in dims ]
+        record = bool( dims ) and shape[0] == 0
+
+        return name, { 'dims': [ self.dimensions[ d ][0] for d in dims ],
+                       'shape': shape, 'dtype': N.dtype( dtype ),
+                       'attributes': attributes, 'vsize': vsize,
+                       'begin': begin, 'record': record }
+
+
+    def view( self, name ):
+        """
+        Get a variable as read-only view into the memory-mapped file.
+
+        :param name: variable name, e.g. 'coordinates'
+        :type  name: str
+
+        :return: big-endian array view, record variables have the number
+                 of frames as first dimension
+        :rtype: array
+
+        :raise BinaryTrajError: if there is no such variable
+        """
+        try:
+            v = self.variables[ name ]
+        except KeyError:
+            raise BinaryTrajError( '%s has no variable %s' % (self.fname, name))
+
+        shape = list( v['shape'] )
+        strides = list( N.cumprod( [ v['dtype'].itemsize ] +
+                                   shape[:0:-1] )[::-1] )
+
+        if v['record']:
+            shape[0] = self.n_records
+            strides[0] = self.recsize
+
+        return N.ndarray( shape, v['dtype'], buffer=self.__map,
+                          offset=v['begin'], strides=strides )
+
+
+    @property
+    def n_frames( self ):
+        return self.n_records
+
+    @property
+    def n_atoms( self ):
+        return dict( self.dimensions ).get( 'atom', 0 )
+
+
+    def read( self, start=0, stop=None, step=1, atoms=None ):
+        """
+        Read coordinates of a range of frames.
+
+        :param start: first frame (default: 0)
+        :type  start: int
+        :param stop: stop before this frame (default: None, read to end)
+        :type  stop: int
+        :param step: read every step-th frame (default: 1)
+        :type  step: int
+        :param atoms: indices of atoms to read (default: None, all)
+        :type  atoms: [int]
+
+        :return: coordinates, frames x atoms x 3
+        :rtype: array( float32 )
+        """
+        xyz = self.view( 'coordinates' )[ start : stop : step ]
+
+        if atoms is not None:
+            xyz = N.take( xyz, atoms, 1 )
+
+        return N.asarray( xyz, N.float32 )
+
+
+    @staticmethod
+    def __pack( fmt, *values ):
+        return struct.pack( '>' + fmt, *values )
+
+    @staticmethod
+    def __packName( name ):
+        name = name.encode( 'ascii' )
+        return struct.pack( '>i', len( name ) ) + name + \
+               b'\0' * ( -len( name ) % 4 )
+
+    @staticmethod
+    def __packText( name, text ):
+        """character attribute"""
+        text = text.encode( 'ascii' )
+        return NetCDFFile.__packName( name ) + \
+               struct.pack( '>ii', 2, len( text ) ) + text + \
+               b'\0' * ( -len( text ) % 4 )
+
+
+    @staticmethod
+    def write( fname, frames, time=None, title='', block=500 ):
+        """
+        Write coordinates into a new NetCDF (64-bit offset) file following
+        the Amber trajectory conventions.
+
+        :param fname: output file name
+        :type  fname: str
+        :param frames: coordinates, frames x atoms x 3
+        :type  frames: array
+        :param time: time in ps of each frame (default: None, frame index)
+        :type  time: [float]
+        :param title: title attribute (default: '')
+        :type  title: str
+        :param block: number of frames converted at once (default: 500)
+        :type  block: int
+        """
+        pack, name, text = NetCDFFile.__pack, NetCDFFile.__packName, \
+                           NetCDFFile.__packText
+
+        n_frames, n_atoms = N.shape( frames )[:2]
+
+        if time is None:
+            time = N.arange( n_frames )
+
+        ABSENT = pack( 'ii', 0, 0 )
+        FLOAT, CHAR = 5, 2
+
+        dims = pack( 'ii', NetCDFFile.NC_DIMENSION, 3 ) \
+               + name( 'frame' ) + pack( 'i', 0 ) \
+               + name( 'spatial' ) + pack( 'i', 3 ) \
+               + name( 'atom' ) + pack( 'i', n_atoms )
+
+        atts = pack( 'ii', NetCDFFile.NC_ATTRIBUTE, 6 ) \
+               + text( 'title', title ) \
+               + text( 'application', 'AMBER' ) \
+               + text( 'program', 'biskit' ) \
+               + text( 'programVersion', biskit.__version__ ) \
+               + text( 'Conventions', 'AMBER' ) \
+               + text( 'ConventionVersion', '1.0' )
+
+        def variables( begin ):
+            units = lambda u: pack( 'ii', NetCDFFile.NC_ATTRIBUTE, 1 ) \
+                              + text( 'units', u )
+
+            return pack( 'ii', NetCDFFile.NC_VARIABLE, 3 ) \
+                + name( 'spatial' ) + pack( 'ii', 1, 1 ) + ABSENT \
+                + pack( 'iiq', CHAR, 4, begin ) \
+                + name( 'time' ) + pack( 'ii', 1, 0 ) + units( 'picosecond' )\
+                + pack( 'iiq', FLOAT, 4, begin + 4 ) \
+                + name( 'coordinates' ) + pack( 'iiii', 3, 0, 2, 1 ) \
+                + units( 'angstrom' ) \
+                + pack( 'iiq', FLOAT, 12 * n_atoms, begin + 8 )
+
+        head = b'CDF\x02' + pack( 'i', n_frames ) + dims + atts
+        head += variables( len( head ) + len( variables( 0 ) ) )
+
+        dtype = N.dtype( [ ('time', '>f4'), ('xyz', '>f4', (n_atoms, 3)) ] )
+
+        with open( T.absfile( fname ), 'wb' ) as f:
+            f.write( head )
+            f.write( b'xyz\0' )
+
+            for start in range( 0, n_frames, block ):
+                xyz = N.asarray( frames[ start : start + block ] )
+
+                recs = N.zeros( len( xyz ), dtype )
+                recs['time'] = time[ start : start + block ]
+                recs['xyz'] = xyz
+
+                recs.tofile( f )
+
+
+class BinaryTrajParser:
+    """
+    Convert a binary Amber NetCDF (.nc, .ncdf, .netcdf) or DCD (.dcd)
+    trajectory into a Trajectory object. The file format is determined
+    from the file extension. Frame range, stride and atom selection are
+    applied while reading, so only the selected coordinates are loaded.
+    """
+
+    FORMATS = { '.dcd': DCDFile, '.nc': NetCDFFile, '.ncdf': NetCDFFile,
+                '.netcdf': NetCDFFile }
+
+    def __init__( self, ftraj, fref, start=0, stop=None, step=1, atoms=None,
+                  rnAmber=0, pdbCode=None, log=StdLog(), verbose=0 ):
+        """
+        :param ftraj: path to binary trajectory file
+        :type  ftraj: str
+        :param fref: PDB or pickled PDBModel with same atom content and order
+        :type  fref: str OR PDBModel
+        :param start: first frame to read (default: 0)
+        :type  start: int
+        :param stop: stop before this frame (default: None, read to end)
+        :type  stop: int
+        :param step: read only every step-th frame (default: 1)
+        :type  step: int
+        :param atoms: indices of atoms to read (default: None, all)
+        :type  atoms: [int]
+        :param rnAmber: rename amber style residues into standard (default: 0)
+        :type  rnAmber: 1|0
+        :param pdbCode: pdb code to be put into the model (default: None)
+        :type  pdbCode: str
+        :param log: LogFile instance [Biskit.StdLog]
+        :type  log: biskit.LogFile
+        :param verbose: print progress to log [0]
+        :type  verbose: int
+
+        :raise BinaryTrajError: if format is unknown or the reference does
+                                not match the trajectory
+        """
+        self.ftraj = T.absfile( ftraj )
+
+        ext = os.path.splitext( self.ftraj )[1].lower()
+        if ext not in self.FORMATS:
+            raise BinaryTrajError( 'Unknown trajectory format: %s' % ext )
+
+        self.file = self.FORMATS[ ext ]( self.ftraj )
+
+        if isinstance( fref, PDBModel ):
+            self.ref = fref.clone()
+        else:
+            self.ref = PDBModel( T.absfile( fref ), pdbCode=pdbCode )
+
+        if self.ref.lenAtoms() != self.file.n_atoms:
+            raise BinaryTrajError( '%s has %i atoms but reference has %i.' %\
+                       (self.ftraj, self.file.n_atoms, self.ref.lenAtoms()) )
+
+        if rnAmber:
+            self.ref.renameAmberRes()
+
+        self.frames = list( range( self.file.n_frames ) )[ start:stop:step ]
+        self.start, self.stop, self.step = start, stop, step
+
+        self.atoms = atoms
+        if atoms is not None:
+            self.ref = self.ref.take( atoms )
+
+        self.log = log
+        self.verbose = verbose
+
+
+    def parse2traj( self, n_members=None, block=1000 ):
+        """
+        Convert the selected frames and atoms into a Trajectory object.
+
+        :param n_members: return EnsembleTraj with this number of members
+                          (default: None, return normal Trajectory)
+        :type  n_members: int
+        :param block: number of frames read at once (default: 1000)
+        :type  block: int
+
+        :return: trajectory object, frame names are the frame positions
+                 in the file
+        :rtype: Trajectory OR EnsembleTraj
+        """
+        n_frames = len( self.frames )
+
+        frames = N.zeros( ( n_frames, self.ref.lenAtoms(), 3 ), N.float32 )
+
+        if self.verbose: self.log.write( "Reading %i frames .." % n_frames )
+
+        step = self.step
+
+        for i in range( 0, n_frames, block ):
+            pos = self.frames[ i : i + block ]
+
+            ## read forward, reverse afterwards for negative steps
+            x = self.file.read( min( pos ), max( pos ) + 1, abs( step ),
+                                self.atoms )
+            frames[ i : i + len( pos ) ] = x if step > 0 else x[::-1]
+            if self.verbose:
+                self.log.write( '#' )
+
+        if self.verbose: self.log.write( "done\n" )
+
+        if n_members:
+            if n_frames % n_members != 0:
+                raise EnsembleTrajError( 'Member trajectories must have '\
+                                         'equal number of frames.' )
+            t = EnsembleTraj( n_members=n_members )
+        else:
+            t = Trajectory()
+
+        t.frames = frames
+        t.setRef( self.ref )
+        t.ref.disconnect()
+
+        t.resIndex = t.ref.resMap()
+        t.frameNames = [ str( i ) for i in self.frames ]
+
+        return t
+
+
+import biskit.test as BT
+
+class Test( BT.BiskitTest ):
+    """Test BinaryTrajParser, DCDFile and NetCDFFile"""
+
+    def prepare(self):
+        import tempfile
+        self.traj = T.load( T.testRoot() + '/lig_pcr_00/traj.dat' )
+        self.fdcd = tempfile.mktemp( '.dcd', 'traj_' )
+        self.fnc = tempfile.mktemp( '.nc', 'traj_' )
+
+    def cleanUp(self):
+        T.tryRemove( self.fdcd )
+        T.tryRemove( self.fnc )
+
+    def _check( self, fname ):
+        atoms = list( range( 10, 200 ) )
+
+        p = BinaryTrajParser( fname, self.traj.ref, start=5, stop=50, step=3,
+                              atoms=atoms, log=self.log, verbose=self.local )
+        self.t = p.parse2traj( block=4 )
+
+        self.assertEqual( len( self.t ), 15 )
+        self.assertEqual( self.t.frameNames[:3], ['5', '8', '11'] )
+        self.assertEqual( self.t.lenAtoms(), 190 )
+
+        ref = self.traj.frames[ 5:50:3 ][ :, 10:200 ]
+        self.assertTrue( N.all( self.t.frames == ref ) )
+
+        p = BinaryTrajParser( fname, self.traj.ref, start=20, step=-3 )
+        self.t = p.parse2traj( block=4 )
+        self.assertEqual( self.t.frameNames,
+                          [ str( i ) for i in range( 20, -1, -3 ) ] )
+        self.assertTrue( N.all( self.t.frames == self.traj.frames[20::-3] ) )
+
+        self.t = BinaryTrajParser( fname, self.traj.ref ).parse2traj( 10 )
+        self.assertTrue( N.all( self.t.frames == self.traj.frames ) )
+
+    def test_DCD(self):
+        """BinaryTrajParser DCD test"""
+        self.traj.writeDCD( self.fdcd )
+        self.assertEqual( DCDFile( self.fdcd ).n_frames, len( self.traj ) )
+        self._check( self.fdcd )
+
+    def test_NetCDF(self):
+        """BinaryTrajParser NetCDF test"""
+        self.traj.writeNetCDF( self.fnc )
+
+        f = NetCDFFile( self.fnc )
+        self.assertEqual( f.attributes['Conventions'], 'AMBER' )
+        self.assertEqual( f.view('spatial').tobytes(), b'xyz' )
+        self.assertEqual( f.n_frames, len( self.traj ) )
+
+        self._check( self.fnc )
+
+
+if __name__ == '__main__':
+
+    BT.localTest()
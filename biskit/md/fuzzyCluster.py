@@ -32,6 +32,7 @@ Reference::
   PROTEINS: Structure, Function and Genetics 14:249-264 1992
 """
 
+import numpy as N
 import biskit.core.oldnumeric as N0
 import biskit.mathUtils as MU
 import biskit.tools as tools
@@ -50,15 +51,28 @@ import numpy.random.mtrand as R # seed, random / converted from oldnumeric/rando
 ## def standardDeviation(x, avg = None):
 ##     return N0.sqrt(variance(x, avg))
 
-def squared_distance_matrix(x, y):
+def squared_distance_matrix(x, y, y2=None):
+    """
+    @param x: k x d array
+    @type  x: array
+    @param y: n x d array
+    @type  y: array
+    @param y2: pre-calculated squared norms of the rows of y (default: None)
+    @type  y2: array
 
-    d1 = N0.diagonal(N0.dot(x, N0.transpose(x)))
-    d2 = N0.diagonal(N0.dot(y, N0.transpose(y)))
+    @return: squared euclidean distance between rows of x and y, k x n
+    @rtype: array
+    """
+    x = N.asarray( x )
+    y = N.asarray( y )
 
-    a1 = N0.add.outer(d1,d2)
-    a2 = N0.dot(x, N0.transpose(y))
+    d1 = N.sum( N.asarray( x, N.float64 )**2, 1 )
+    if y2 is None:
+        y2 = N.sum( N.asarray( y, N.float64 )**2, 1 )
 
-    return a1 - 2 * a2
+    a2 = N.dot( N.asarray( x, y.dtype ), N.transpose(y) )
+
+    return N.add.outer( d1, y2 ) - 2 * a2
 
 
 def distance_matrix(x, y):
@@ -66,7 +80,25 @@ def distance_matrix(x, y):
 
 
 class FuzzyCluster:
-    def __init__(self, data, n_cluster, weight, seedx = 0, seedy = 0):
+    """
+    Fuzzy c-means clustering of the rows (e.g. raveled frames) of a data
+    matrix. Distances, memberships and new centers are calculated for one
+    block of rows at a time so that no temporary array ever scales with
+    the square of the number of rows or with rows x dimension. The data
+    can be kept in single precision (dtype=N.float32) to halve the memory
+    needed; distances, memberships and centers are always accumulated in
+    double precision.
+
+    Clustering starts either from a random membership matrix
+    (init='random') or from centers picked with the k-means++ scheme
+    (init='kmeans++'). go() also accepts start centers, e.g. from a
+    previous run with a different number of clusters.
+    """
+
+    INIT = ['random', 'kmeans++']
+
+    def __init__(self, data, n_cluster, weight, seedx = 0, seedy = 0,
+                 dtype=N0.Float, block=1000, init='random'):
         """
         @param data: cluster this
         @type  data: [float] OR array
@@ -79,30 +111,86 @@ class FuzzyCluster:
         @param seedy: random seed value for RandomArray.seed
         (default: 0, set seed from clock)
         @type  seedy: int OR 0
+        @param dtype: data type used for storing the data, e.g. N.float32
+                      (default: N0.Float, i.e. float64)
+        @type  dtype: type
+        @param block: number of data points processed at once (default: 1000)
+        @type  block: int
+        @param init: initialization, 'random' memberships or 'kmeans++'
+                     centers (default: 'random')
+        @type  init: str
         """
-        self.data = N0.array(data, N0.Float)
+        if init not in self.INIT:
+            raise ValueError( 'unknown initialization %r' % init )
+
+        self.data = N.asarray(data, dtype)
         self.w = weight
         self.n_cluster = n_cluster
-        self.npoints, self.dimension = N0.shape(data)
+        self.npoints, self.dimension = N0.shape(self.data)
         self.seedx = seedx
         self.seedy = seedy
+        self.block = block
+        self.init = init
+
+        ## squared norm of each data point
+        self.norms = N.concatenate(
+            [ N.sum( N.asarray( self.data[s], N.float64 )**2, 1 )
+              for s in self.blocks() ] or [ N.zeros( 0 ) ] )
+
+
+    def blocks(self):
+        """
+        @return: slices of at most self.block data points
+        @rtype: generator of slice
+        """
+        for i in range( 0, self.npoints, self.block ):
+            yield slice( i, min( i + self.block, self.npoints ) )
+
+
+    def seed(self):
+        """
+        Seed random number generator with seedx, seedy (or from clock).
+        """
+        ## default signature has changed oldnumeric->numpy
+        if (self.seedx==0 or self.seedy==0):
+            R.seed()
+        else:
+            R.seed((self.seedx, self.seedy))
+
+
+    def squared_distances(self, centers):
+        """
+        @param centers: array with cluster centers
+        @type  centers: array('f')
+
+        @return: squared distances between centers and data, k x npoints
+        @rtype: array
+        """
+        d2 = N.empty( ( len(centers), self.npoints ) )
+        for s in self.blocks():
+            d2[:, s] = squared_distance_matrix( centers, self.data[s],
+                                                self.norms[s] )
+        return d2
 
 
     def calc_membership_matrix(self, d2):
         ## remove 0s (if a cluster center is exactly on one item)
         d2 = N0.clip( d2, N0.power(1e200, 1-self.w), 1e300 )
-        q = N0.power(d2, 1. / (1. - self.w))
+        ## relative to the closest center to avoid overflow
+        q = N0.power(d2 / N.min(d2, 0), 1. / (1. - self.w))
         return q / N0.sum(q)
 
 
     def calc_cluster_center(self, msm):
         p = N0.power(msm, self.w)
-        ccenter = N0.transpose(N0.dot(p, self.data))
-        return N0.transpose(ccenter / N0.sum(p, 1))
+        ccenter = N.zeros( ( len(msm), self.dimension ) )
+        for s in self.blocks():
+            ccenter += N.dot( p[:, s].astype( self.data.dtype ), self.data[s] )
+        return ccenter / N.sum(p, 1)[:, N.newaxis]
 
 
     def updateDistanceMatrix(self):
-        return squared_distance_matrix(self.cluster_center, self.data)
+        return self.squared_distances(self.cluster_center)
 
 
     def iterate(self, centers):
@@ -113,11 +201,21 @@ class FuzzyCluster:
         @return: distance to the centers, membership matrix, array of cenetrs
         @rtype: array, array, array
         """
-        d2 = squared_distance_matrix(centers, self.data)
-        msm = self.calc_membership_matrix(d2)
-        centers = self.calc_cluster_center(msm)
+        d2 = N.empty( ( len(centers), self.npoints ) )
+        msm = N.empty( ( len(centers), self.npoints ) )
+        ccenter = N.zeros( ( len(centers), self.dimension ) )
+        psum = N.zeros( len(centers) )
+
+        for s in self.blocks():
+            d2[:, s] = squared_distance_matrix( centers, self.data[s],
+                                                self.norms[s] )
+            msm[:, s] = self.calc_membership_matrix( d2[:, s] )
+
+            p = N0.power( msm[:, s], self.w )
+            ccenter += N.dot( p.astype( self.data.dtype ), self.data[s] )
+            psum += N.sum( p, 1 )
 
-        return d2, msm, centers
+        return d2, msm, ccenter / psum[:, N.newaxis]
 
 
     def error(self, msm, d2):
@@ -130,9 +228,8 @@ class FuzzyCluster:
         @return: weighted error 
         @rtype: float
         """
-        p = N0.power(msm, self.w)
-        product = N0.dot(p, N0.transpose(d2))
-        return N0.trace(product)
+        ## == trace( dot( msm^w, d2^T ) )
+        return N.sum( N0.power(msm, self.w) * d2 )
 
 
     def create_membership_matrix(self):
@@ -143,17 +240,56 @@ class FuzzyCluster:
                  cluster times number of clusters
         @rtype: array('f')
         """
-        ## default signature has changed oldnumeric->numpy
-        if (self.seedx==0 or self.seedy==0):  
-            R.seed()
-        else:
-            R.seed((self.seedx, self.seedy))
+        self.seed()
 
         r = R.random_sample((self.npoints, self.n_cluster))
         return N0.transpose(r / N0.sum(r))
 
 
-    def go(self, errorthreshold, n_iterations=1e10, nstep=10, verbose=1):
+    def create_cluster_centers(self, centers=None):
+        """
+        Pick cluster centers from the data following the k-means++ scheme:
+        each new center is drawn with a probability proportional to the
+        squared distance to the closest center picked so far.
+
+        @param centers: start with these centers (default: None, pick the
+                        first center at random); surplus centers are
+                        dropped, missing ones are added
+        @type  centers: array('f')
+
+        @return: n_cluster x dimension array of centers
+        @rtype: array
+        """
+        centers = N.zeros((0, self.dimension)) if centers is None \
+                  else N.array( centers, N.float64 )[:self.n_cluster]
+
+        if len(centers) == self.n_cluster:
+            return centers
+
+        self.seed()
+
+        if len(centers) == 0:
+            i = R.randint( self.npoints )
+            centers = N.array( self.data[i:i+1], N.float64 )
+
+        dmin = N.min( self.squared_distances( centers ), 0 )
+
+        while len(centers) < self.n_cluster:
+            p = N.clip( dmin, 0, None )
+            if N.sum(p) > 0:
+                i = R.choice( self.npoints, p=p / N.sum(p) )
+            else:
+                i = R.randint( self.npoints )
+
+            c = N.array( self.data[i:i+1], N.float64 )
+            centers = N.concatenate( (centers, c) )
+            dmin = N.minimum( dmin, self.squared_distances( c )[0] )
+
+        return centers
+
+
+    def go(self, errorthreshold, n_iterations=1e10, nstep=10, verbose=1,
+           centers=None):
         """
         Start the cluestering. Run until the error is below the error
         treshold or the max number of iterations have been run.
@@ -165,6 +301,9 @@ class FuzzyCluster:
         @type  n_iterations: int
         @param nstep: print information for every n'th step in the iteration
         @type  nstep: int
+        @param centers: start from these cluster centers, missing centers
+                        are added by k-means++ (default: None)
+        @type  centers: array('f')
 
         @return: array with cluster centers
         @rtype: array('f')
@@ -173,8 +312,11 @@ class FuzzyCluster:
         rel_err = 1e10
         error = 1.e10
 
-        msm = self.create_membership_matrix()
-        centers = self.calc_cluster_center(msm)
+        if centers is not None or self.init == 'kmeans++':
+            centers = self.create_cluster_centers( centers )
+        else:
+            msm = self.create_membership_matrix()
+            centers = self.calc_cluster_center(msm)
 
         while rel_err > errorthreshold and iteration < n_iterations:
             d2, msm, centers = self.iterate(centers)
@@ -263,6 +405,40 @@ class Test(BT.BiskitTest):
 
         self.assertEqual( N0.shape(self.centers), (5, 2) )
 
+    def test_FuzzyClusterBlocks( self ):
+        """FuzzyCluster float32/k-means++/warm start test"""
+        R.seed( 3 )
+        offsets = N.array( [ [0, 0, 0], [5, 0, 0], [0, 5, 0] ] )
+        self.x = N.concatenate( [ R.random_sample((300,3)) + o
+                                  for o in offsets ] )
+
+        ref = FuzzyCluster( self.x, n_cluster=3, weight=1.5, init='kmeans++',
+                            seedx=1, seedy=2 )
+        ref.go( 1.e-10, n_iterations=100, verbose=self.local )
+
+        self.fuzzy = FuzzyCluster( self.x, n_cluster=3, weight=1.5,
+                                   dtype=N.float32, block=100 )
+        self.assertEqual( self.fuzzy.data.dtype, N.float32 )
+
+        ## blocked single precision version starting from the same centers
+        centers = ref.create_cluster_centers()
+        d2, msm, c = ref.iterate( centers )
+        d2b, msmb, cb = self.fuzzy.iterate( centers )
+        self.assertTrue( N.allclose( msm, msmb, atol=1e-4 ) )
+        self.assertTrue( N.allclose( c, cb, atol=1e-4 ) )
+
+        ## each cluster center is found close to one blob center
+        blobs = offsets + 0.5
+        d = distance_matrix( blobs, ref.centers )
+        self.assertTrue( N.all( N.min( d, 1 ) < 0.2 ) )
+
+        ## warm start with an additional cluster
+        self.fuzzy.n_cluster = 4
+        c4 = self.fuzzy.go( 1.e-10, n_iterations=100, verbose=self.local,
+                            centers=ref.centers )
+        self.assertEqual( N.shape( c4 ), (4, 3) )
+        self.assertTrue( N.allclose( N.sum( self.fuzzy.msm, 0 ), 1 ) )
+
 if __name__ == '__main__':
 
     BT.localTest()
@@ -0,0 +1,419 @@
+##
+## Biskit, a toolkit for the manipulation of macromolecular structures
+## Copyright (C) 2004-2018 Raik Gruenberg & Johan Leckner
+##
+## This program is free software; you can redistribute it and/or
+## modify it under the terms of the GNU General Public License as
+## published by the Free Software Foundation; either version 3 of the
+## License, or any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+## General Public License for more details.
+##
+## You find a copy of the GNU General Public License in the file
+## license.txt along with this program; if not, write to the Free
+## Software Foundation, Inc., 675 Mass Ave, Cambridge, MA 02139, USA.
+##
+##
+"""
+Principal component analysis of (large) sets of coordinate frames.
+"""
+
+import numpy as N
+import numpy.linalg as LA
+
+from biskit.errors import BiskitError
+
+
+class PCAError( BiskitError ):
+    pass
+
+
+class PCA:
+    """
+    Principal component analysis of coordinate frames, which are read
+    block by block. Except for 'svd', no method needs more than one block
+    of frames as centered float64 copy in memory, so the frames can be a
+    numpy memmap (see `Trajectory.loadMapped`).
+
+    Four methods are available:
+
+      * 'svd' -- exact, singular value decomposition of the complete
+        (frames x 3N) data matrix (as Trajectory.pca used to do); loads
+        all selected frames into memory as one float64 array
+      * 'cov' -- exact, eigen decomposition of the (3N x 3N) covariance
+        matrix which is accumulated block by block; best if there are
+        many more frames than coordinates
+      * 'randomized' -- approximate top n_components from a randomized
+        range finder (Halko et al., 2011) with a few power iterations;
+        each iteration needs two passes over the frames
+      * 'incremental' -- approximate top n_components, updated with one
+        block of frames at a time (Ross et al., 2008); also available
+        directly via partial_fit() for data that arrive in chunks
+
+    'auto' picks 'randomized' if only few components are requested,
+    'cov' if there are more frames than coordinates and 'svd' otherwise --
+    choose another method explicitly if the selected frames do not fit
+    into memory. partial_fit() decomposes the new block stacked onto the
+    current components, i.e. needs memory for one block plus
+    n_components rows.
+
+    Results follow the conventions of Trajectory.getPca: eigenvalues are
+    squared singular values of the centered data and projections are the
+    coordinates of each frame along the components. The sign of each
+    component is chosen such that its largest element is positive.
+
+    Usage::
+
+      pca = PCA( n_components=10 ).fit( traj.frames )
+      pca.components    -> 10 x 3N, eigenvectors (rows)
+      pca.evalues       -> 10, eigenvalues
+      pca.projections   -> N_frames x 10
+    """
+
+    METHODS = [ 'auto', 'svd', 'cov', 'randomized', 'incremental' ]
+
+    def __init__( self, n_components=None, method='auto', block=1000,
+                  oversampling=10, n_iter=4, seed=None ):
+        """
+        :param n_components: number of components to keep
+                             (default: None, all)
+        :type  n_components: int
+        :param method: 'auto', 'svd', 'cov', 'randomized' or 'incremental'
+        :type  method: str
+        :param block: number of frames processed at once (default: 1000)
+        :type  block: int
+        :param oversampling: additional random vectors for 'randomized'
+                             (default: 10)
+        :type  oversampling: int
+        :param n_iter: power iterations for 'randomized' (default: 4)
+        :type  n_iter: int
+        :param seed: seed for random vectors of 'randomized' (default: None)
+        :type  seed: int
+
+        :raise PCAError: if method is not known
+        """
+        if method not in self.METHODS:
+            raise PCAError( 'Unknown PCA method %r' % method )
+
+        self.n_components = n_components
+        self.method = method
+        self.block = block
+        self.oversampling = oversampling
+        self.n_iter = n_iter
+        self.seed = seed
+
+        self.mean = None         #: average of frames, 1 x 3N
+        self.components = None   #: eigenvectors (rows), k x 3N
+        self.evalues = None      #: eigenvalues, k
+        self.projections = None  #: projection of each frame, N_frames x k
+        self.n_frames = 0        #: number of frames analyzed
+        self.fixedMean = False   #: True if mean was given (incremental)
+
+
+    def __rows( self, frames, rows ):
+        """iterate over (slice or index array) of row blocks"""
+        if rows is None:
+            for i in range( 0, len( frames ), self.block ):
+                yield slice( i, min( i + self.block, len( frames ) ) )
+        else:
+            for i in range( 0, len( rows ), self.block ):
+                yield rows[ i : i + self.block ]
+
+
+    def blocks( self, frames, rows=None, cols=None, mean=None ):
+        """
+        Iterate over blocks of frames as 2-D float64 arrays.
+
+        :param frames: N_frames x N_atoms x 3 or N_frames x 3N
+        :type  frames: array
+        :param rows: frame indices to use (default: None, all)
+        :type  rows: array of int
+        :param cols: atom indices to use (default: None, all)
+        :type  cols: array of int
+        :param mean: subtract this average from each frame (default: None)
+        :type  mean: array
+
+        :return: blocks of (centered) raveled frames, block x 3N
+        :rtype: generator of array
+        """
+        for r in self.__rows( frames, rows ):
+            x = N.asarray( frames[ r ] )
+            if cols is not None:
+                x = x[:, cols]
+            x = x.reshape( len( x ), -1 ).astype( N.float64 )
+            if mean is not None:
+                x -= mean
+            yield x
+
+
+    def average( self, frames, rows=None, cols=None ):
+        """
+        :return: average frame (raveled), 1 x 3N
+        :rtype: array
+        """
+        s = 0
+        n = 0
+        for x in self.blocks( frames, rows, cols ):
+            s = s + N.sum( x, 0 )
+            n += len( x )
+
+        if n == 0:
+            raise PCAError( 'No frames.' )
+
+        return s / n
+
+
+    def __k( self, n, d ):
+        """number of components to keep"""
+        k = min( n, d )
+        if self.n_components is not None:
+            k = min( k, self.n_components )
+        return k
+
+
+    def __flip( self, components, projections=None ):
+        """make largest element of each component positive"""
+        i = N.argmax( N.abs( components ), 1 )
+        signs = N.sign( components[ N.arange( len(components) ), i ] )
+        signs[ signs == 0 ] = 1
+
+        components *= signs[:, N.newaxis]
+        if projections is not None:
+            projections *= signs
+
+        return components, projections
+
+
+    def fit( self, frames, rows=None, cols=None, mean=None ):
+        """
+        Calculate principal components (and projections) of frames.
+
+        :param frames: N_frames x N_atoms x 3 or N_frames x 3N
+        :type  frames: array (or memmap)
+        :param rows: frame indices to use (default: None, all)
+        :type  rows: array of int
+        :param cols: atom indices to use (default: None, all)
+        :type  cols: array of int
+        :param mean: center frames on this average (default: None, the
+                     average of all frames selected by rows)
+        :type  mean: array
+
+        :return: self, with components, evalues and projections set
+        :rtype: PCA
+        """
+        if mean is None:
+            mean = self.average( frames, rows, cols )
+        self.mean = N.asarray( mean, N.float64 ).ravel()
+
+        n = len( frames ) if rows is None else len( rows )
+        d = len( self.mean )
+        k = self.__k( n, d )
+
+        method = self.method
+        if method == 'auto':
+            if k < min( n, d ) // 2:
+                method = 'randomized'
+            elif n > d:
+                method = 'cov'
+            else:
+                method = 'svd'
+
+        if method == 'svd':
+            x = N.concatenate( list( self.blocks( frames, rows, cols,
+                                                  self.mean ) ) )
+            V, L, U = LA.svd( x, full_matrices=False )
+            self.components, self.projections = \
+                             self.__flip( U[:k], V[:, :k] * L[:k] )
+            self.evalues = L[:k]**2
+
+        elif method == 'cov':
+            c = N.zeros( ( d, d ) )
+            for x in self.blocks( frames, rows, cols, self.mean ):
+                c += N.dot( x.T, x )
+
+            e, U = LA.eigh( c )
+            order = N.argsort( e )[::-1][:k]
+            self.evalues = N.clip( e[ order ], 0, None )
+            self.components = self.__flip( U[:, order].T.copy() )[0]
+            self.projections = self.transform( frames, rows, cols )
+
+        elif method == 'randomized':
+            self.__randomized( frames, rows, cols, k )
+
+        elif method == 'incremental':
+            self.components = None
+            self.fixedMean = True
+            for x in self.blocks( frames, rows, cols ):
+                self.partial_fit( x )
+            self.projections = self.transform( frames, rows, cols )
+
+        self.n_frames = n
+        return self
+
+
+    def __randomized( self, frames, rows, cols, k ):
+        """randomized range finder with power iterations, 2 passes each"""
+        blocks = lambda: self.blocks( frames, rows, cols, self.mean )
+
+        n = len( frames ) if rows is None else len( rows )
+        l = min( k + self.oversampling, n, len( self.mean ) )
+
+        rng = N.random.RandomState( self.seed )
+        Q = rng.standard_normal( ( len( self.mean ), l ) )
+
+        for i in range( self.n_iter + 1 ):
+            ## Y = X Q
+            Y = N.concatenate( [ N.dot( x, Q ) for x in blocks() ] )
+            Y = LA.qr( Y )[0]
+
+            if i == self.n_iter:
+                break
+
+            ## Q = X^T Y
+            Q = N.zeros( ( len( self.mean ), l ) )
+            start = 0
+            for x in blocks():
+                Q += N.dot( x.T, Y[ start : start + len(x) ] )
+                start += len( x )
+            Q = LA.qr( Q )[0]
+
+        ## B = Y^T X
+        B = N.zeros( ( l, len( self.mean ) ) )
+        start = 0
+        for x in blocks():
+            B += N.dot( Y[ start : start + len(x) ].T, x )
+            start += len( x )
+
+        Ub, s, Vt = LA.svd( B, full_matrices=False )
+
+        self.components, self.projections = \
+                   self.__flip( Vt[:k], N.dot( Y, Ub[:, :k] ) * s[:k] )
+        self.evalues = s[:k]**2
+
+
+    def partial_fit( self, x ):
+        """
+        Update components with one more block of frames (incremental
+        SVD). If a mean has been set before (self.fixedMean), frames are
+        centered on it; otherwise the mean is updated as well.
+        Projections are not calculated, use transform().
+
+        :param x: block of frames, M x N_atoms x 3 or M x 3N
+        :type  x: array
+
+        :return: self
+        :rtype: PCA
+        """
+        x = N.asarray( x, N.float64 )
+        x = x.reshape( len( x ), -1 )
+        m = len( x )
+
+        if m == 0:
+            return self
+
+        if self.components is None:
+            self.n_frames = 0
+            self.evalues = N.zeros( 0 )
+            self.components = N.zeros( ( 0, x.shape[1] ) )
+            if not self.fixedMean:
+                self.mean = N.zeros( x.shape[1] )
+
+        n = self.n_frames
+        rows = [ N.sqrt( self.evalues )[:, N.newaxis] * self.components ]
+
+        if self.fixedMean:
+            rows.append( x - self.mean )
+        else:
+            mean_x = N.mean( x, 0 )
+            rows.append( x - mean_x )
+            if n:
+                rows.append( N.sqrt( n * m / (n + m) ) *
+                             ( self.mean - mean_x )[N.newaxis] )
+            self.mean = ( n * self.mean + m * mean_x ) / ( n + m )
+
+        V, L, U = LA.svd( N.concatenate( rows ), full_matrices=False )
+
+        k = self.__k( n + m, x.shape[1] )
+        self.components = self.__flip( U[:k].copy() )[0]
+        self.evalues = L[:k]**2
+        self.n_frames = n + m
+
+        return self
+
+
+    def transform( self, frames, rows=None, cols=None ):
+        """
+        Project frames onto the principal components.
+
+        :param frames: N_frames x N_atoms x 3 or N_frames x 3N
+        :type  frames: array (or memmap)
+        :param rows: frame indices to use (default: None, all)
+        :type  rows: array of int
+        :param cols: atom indices to use (default: None, all)
+        :type  cols: array of int
+
+        :return: projections, N_frames x k
+        :rtype: array
+
+        :raise PCAError: if no components have been calculated yet
+        """
+        if self.components is None:
+            raise PCAError( 'PCA has not been fitted yet.' )
+
+        return N.concatenate( [ N.dot( x, self.components.T ) for x in
+                                self.blocks( frames, rows, cols, self.mean )])
+
+
+#############
+##  TESTING
+#############
+import biskit.test as BT
+
+class Test(BT.BiskitTest):
+    """Test PCA"""
+
+    def prepare(self):
+        import biskit.tools as T
+        self.t = T.load( T.testRoot() + '/lig_pcr_00/traj.dat' )
+        self.t.fit( verbose=self.local )
+        self.cols = N.flatnonzero( self.t.ref.maskCA() )
+
+    def compare( self, pca, ref, k, tol ):
+        r = N.abs( pca.evalues[:k] - ref.evalues[:k] ) / ref.evalues[:k]
+        self.assertTrue( N.all( r < tol ), r )
+
+        p = pca.projections[:, :k] - ref.projections[:, :k]
+        self.assertTrue( N.max( N.abs( p ) ) < tol * N.max( N.abs(
+                                                  ref.projections[:, :k] ) ) )
+
+    def test_exact(self):
+        """PCA svd versus covariance test"""
+        self.ref = PCA( method='svd', block=30 ).fit( self.t.frames,
+                                                       cols=self.cols )
+        self.p = PCA( method='cov', block=30 ).fit( self.t.frames,
+                                                     cols=self.cols )
+        self.assertEqual( self.ref.projections.shape, (100, 100) )
+        self.compare( self.p, self.ref, 20, 1e-6 )
+
+    def test_approximate(self):
+        """PCA randomized and incremental test"""
+        rows = N.arange( 0, 100, 2 )
+
+        self.ref = PCA( method='svd' ).fit( self.t.frames, rows=rows )
+
+        self.p = PCA( 5, method='randomized', seed=1,
+                      block=20 ).fit( self.t.frames, rows=rows )
+        self.assertEqual( self.p.components.shape, (5, 876 * 3) )
+        self.compare( self.p, self.ref, 3, 1e-3 )
+
+        self.p = PCA( 30, method='incremental', block=20 )
+        self.p.fit( self.t.frames, rows=rows )
+        self.compare( self.p, self.ref, 3, 1e-3 )
+
+
+if __name__ == '__main__':
+
+    BT.localTest()
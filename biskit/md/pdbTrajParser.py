@@ -0,0 +1,266 @@
+##
+## Biskit, a toolkit for the manipulation of macromolecular structures
+## Copyright (C) 2004-2018 Raik Gruenberg & Johan Leckner
+##
+## This program is free software; you can redistribute it and/or
+## modify it under the terms of the GNU General Public License as
+## published by the Free Software Foundation; either version 3 of the
+## License, or any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+## General Public License for more details.
+##
+## You find a copy of the GNU General Public License in the file
+## license.txt along with this program; if not, write to the Free
+## Software Foundation, Inc., 675 Mass Ave, Cambridge, MA 02139, USA.
+##
+##
+"""
+Convert a multi-model (NMR-style MODEL/ENDMDL) PDB file into a Trajectory
+"""
+
+import numpy as N
+import biskit.core.oldnumeric as N0
+
+import biskit.tools as T
+from biskit import PDBModel, StdLog
+
+## allow relative imports when calling module by itself for testing (pep-0366)
+if __name__ == "__main__" and __package__ is None:
+    import biskit.md; __package__ = "biskit.md"
+
+from .trajectory import Trajectory, TrajError
+from .ensembleTraj import EnsembleTraj, EnsembleTrajError
+
+
+class PDBTrajParser:
+    """
+    Convert a multi-model PDB file (NMR ensemble or MODEL/ENDMDL dump of a
+    simulation) into a Trajectory object.
+
+    Atom records are only parsed once from the first model, which becomes
+    the reference model of the trajectory. Coordinates of all models are
+    then streamed from the file into a pre-allocated frames x atoms x 3
+    float32 array, so that memory usage is dominated by the coordinates.
+    """
+
+    #: residues removed with rmwat=1 (same as in Trajectory)
+    WATER = ['TIP3', 'HOH', 'WAT', 'Na+', 'Cl-' ]
+
+    def __init__( self, fpdb, rmwat=0, pdbCode=None, log=StdLog(),
+                  verbose=0 ):
+        """
+        :param fpdb: path to multi-model PDB file (pdb or pdb.gz)
+        :type  fpdb: str
+        :param rmwat: skip all TIP3, HOH, WAT, Cl-, Na+ residues (default: 0)
+        :type  rmwat: 1|0
+        :param pdbCode: pdb code to be put into the model (default: None)
+        :type  pdbCode: str
+        :param log: LogFile instance [Biskit.StdLog]
+        :type  log: biskit.LogFile
+        :param verbose: print progress to log [0]
+        :type  verbose: int
+        """
+        self.fpdb = T.absfile( fpdb )
+
+        ## PDBParseFile stops reading at the first ENDMDL record
+        self.ref = PDBModel( self.fpdb, pdbCode=pdbCode )
+
+        self.n = self.ref.lenAtoms()
+
+        #: atoms of each model to keep (None .. all)
+        self.atomMask = None
+
+        if rmwat:
+            mask = N0.logical_not( self.ref.maskFrom('residue_name',
+                                                     self.WATER) )
+            if not N0.all( mask ):
+                self.atomMask = mask
+                self.ref = self.ref.compress( mask )
+
+        self.log = log
+        self.verbose = verbose
+
+
+    def lenModels( self ):
+        """
+        Count the models in the file without parsing them.
+
+        :return: number of MODEL records (1 if there is none)
+        :rtype: int
+        """
+        n = 0
+        with T.gzopen( self.fpdb ) as f:
+            for l in f:
+                if l[:5] == 'MODEL':
+                    n += 1
+        return n or 1
+
+
+    def models( self ):
+        """
+        Iterate over the models of the PDB file.
+
+        :return: generator of (model serial number, ATOM/HETATM lines)
+        :rtype: generator of (int, [str])
+        """
+        lines = []
+        serial = None
+        i = 0
+
+        with T.gzopen( self.fpdb ) as f:
+            for l in f:
+                rec = l[:6]
+
+                if rec == 'ATOM  ' or rec == 'HETATM':
+                    lines.append( l )
+
+                elif rec[:5] == 'MODEL':
+                    try:
+                        serial = int( l[5:].split()[0] )
+                    except:
+                        serial = None
+
+                elif rec == 'ENDMDL' or (rec.rstrip() == 'END' and lines):
+                    i += 1
+                    yield ( i if serial is None else serial ), lines
+                    lines = []
+                    serial = None
+
+        if lines:
+            yield ( i+1 if serial is None else serial ), lines
+
+
+    def xyzFromLines( self, lines ):
+        """
+        Extract coordinates from ATOM/HETATM lines in one vectorized step.
+
+        :param lines: ATOM/HETATM records of one model
+        :type  lines: [str]
+
+        :return: coordinates, N x 3
+        :rtype: array of float
+
+        :raise TrajError: if coordinates cannot be parsed
+        """
+        buf = ''.join( [ l[30:54].ljust(24) for l in lines ] )
+        raw = N.frombuffer( buf.encode('ascii'), N.uint8 ).reshape( -1, 8 )
+
+        ## separate the 8-character fields by a blank for fromstring
+        r = N.empty( ( len(raw), 9 ), N.uint8 )
+        r[:, :8] = raw
+        r[:, 8] = ord(' ')
+
+        xyz = N.fromstring( r.tobytes().decode('ascii'), float, sep=' ' )
+
+        if len( xyz ) != 3 * len( lines ):
+            raise TrajError( 'Invalid coordinates in %s' % self.fpdb )
+
+        return N.reshape( xyz, ( len(lines), 3 ) )
+
+
+    def pdb2traj( self, n_members=None ):
+        """
+        Convert all models of the PDB file into a Trajectory object.
+
+        :param n_members: return EnsembleTraj with this number of members
+                          (default: None, return normal Trajectory)
+        :type  n_members: int
+
+        :return: trajectory object, frame names are the MODEL numbers
+        :rtype: Trajectory OR EnsembleTraj
+
+        :raise TrajError: if the atom content of the models differs
+        """
+        n_frames = self.lenModels()
+
+        frames = N.zeros( ( n_frames, self.ref.lenAtoms(), 3 ), N0.Float32 )
+        names = []
+
+        if self.verbose: self.log.write( "Reading %i models .." % n_frames )
+
+        for i, (serial, lines) in enumerate( self.models() ):
+
+            if i == n_frames:
+                raise TrajError( 'Model %i in %s lacks a MODEL record.' %
+                                 (serial, self.fpdb) )
+
+            if len( lines ) != self.n:
+                raise TrajError( 'Model %i has %i atoms but model 1 has %i.'\
+                                 % (serial, len( lines ), self.n) )
+
+            xyz = self.xyzFromLines( lines )
+            if self.atomMask is not None:
+                xyz = N0.compress( self.atomMask, xyz, 0 )
+
+            frames[i] = xyz
+            names.append( str( serial ) )
+
+            if (i+1) % 100 == 0 and self.verbose:
+                self.log.write( '#' )
+
+        frames = frames[ :len( names ) ]
+
+        if self.verbose: self.log.write("Read %i models.\n" % len( names ))
+
+        if n_members:
+            if len( names ) % n_members != 0:
+                raise EnsembleTrajError( 'Member trajectories must have '\
+                                         'equal number of frames.' )
+            t = EnsembleTraj( n_members=n_members )
+        else:
+            t = Trajectory()
+
+        t.frames = frames
+        t.setRef( self.ref )
+        t.ref.disconnect()
+
+        t.resIndex = t.ref.resMap()
+        t.frameNames = names
+
+        return t
+
+
+import biskit.test as BT
+
+class Test( BT.BiskitTest ):
+    """Test PDBTrajParser"""
+
+    def prepare(self):
+        import tempfile
+        self.fout = tempfile.mktemp('.pdb', 'models_')
+
+    def cleanUp(self):
+        T.tryRemove( self.fout )
+
+    def test_PDBTrajParser(self):
+        """PDBTrajParser test"""
+        self.t0 = T.load( T.testRoot() + '/lig_pcr_00/traj.dat' )
+        self.t0 = self.t0.takeFrames( list(range(5)) )
+        self.t0.writePdbs( self.fout )
+
+        self.p = PDBTrajParser( self.fout, log=self.log,
+                                verbose=self.local )
+        self.t = self.p.pdb2traj()
+
+        if self.local:
+            print("Read Trajectory with %i frames and %i atoms." % \
+                  (len(self.t), self.t.lenAtoms() ))
+
+        self.assertEqual( len( self.t ), 5 )
+        self.assertEqual( self.t.frames.dtype, N.float32 )
+        self.assertEqual( self.t.frameNames, ['0', '1', '2', '3', '4'] )
+        self.assertTrue( N.all( N.abs( self.t.frames - self.t0.frames )
+                                < 1e-3 ) )
+        self.assertEqual( self.t.ref.atomNames(), self.t0.ref.atomNames() )
+
+        self.p = PDBTrajParser( self.fout, rmwat=1 )
+        self.t = self.p.pdb2traj()
+        wat = self.t0.ref.maskFrom( 'residue_name', PDBTrajParser.WATER )
+        self.assertEqual( self.t.lenAtoms(), N.sum( N.logical_not( wat ) ) )
+
+if __name__ == '__main__':
+
+    BT.localTest()
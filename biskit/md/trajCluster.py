@@ -27,6 +27,7 @@ Cluster the members of a trajectory.
 
 import types
 
+import numpy as N
 import biskit.core.oldnumeric as N0
 import biskit.tools as T
 import biskit.rmsFit as rmsFit
@@ -38,6 +39,7 @@ if __name__ == "__main__" and __package__ is None:
     import biskit.md; __package__ = "biskit.md"
 
 from .fuzzyCluster import FuzzyCluster
+from .pca import PCA
 
 
 class ClusterError( BiskitError ):
@@ -45,14 +47,34 @@ class ClusterError( BiskitError ):
 
 class TrajCluster:
 
-    def __init__( self, traj, verbose=1 ):
+    def __init__( self, traj, verbose=1, dtype=N0.Float, block=1000,
+                  init='random' ):
         """
         @param traj: Trajectory to cluster (has to be fitted before hand)
         @type  traj: Trajectory
+        @param dtype: data type of clustered coordinates, N.float32 halves
+                      the memory needed (default: N0.Float, i.e. float64)
+        @type  dtype: type
+        @param block: number of frames processed at once (default: 1000)
+        @type  block: int
+        @param init: start clustering from 'random' memberships or from
+                     'kmeans++' centers, see FuzzyCluster (default: 'random')
+        @type  init: str
         """
         self.traj = traj
         ## atom mask applied before clustering
         self.aMask = None
+        ## number of principal components clustered (None.. coordinates)
+        self.n_components = None
+        ## PCA used for reducing the coordinates
+        self.pca = None
+
+        self.dtype = dtype
+        self.block = block
+        self.init = init
+
+        ## clustered data of last aMask / n_components
+        self.data = None
 
         ## last clustering parameters
         self.n_clusters = 0
@@ -69,14 +91,29 @@ class TrajCluster:
 
     def __raveled( self ):
         """
-        Apply current atom mask and return list of raveled frames.
+        Apply current atom mask and return array of raveled frames or, if
+        n_components is set, their projections on the first principal
+        components. The frames are processed block-wise, the trajectory
+        is not copied.
         """
-        t = self.traj.compressAtoms( self.aMask )
-        return N0.array( list(map( N0.ravel, t.frames )) )
+        frames = self.traj.frames
+        cols = N.flatnonzero( self.aMask )
+
+        if self.n_components:
+            self.pca = PCA( self.n_components, block=self.block )
+            self.pca.fit( frames, cols=cols )
+            return self.pca.projections.astype( self.dtype )
+
+        self.pca = None
+        r = N.empty( ( len( frames ), 3 * len( cols ) ), self.dtype )
+        for i in range( 0, len( frames ), self.block ):
+            x = N.asarray( frames[ i : i + self.block ] )[:, cols]
+            r[ i : i + self.block ] = x.reshape( len( x ), -1 )
+        return r
 
 
     def cluster( self, n_clusters, weight=1.13, converged=1e-11,
-                 aMask=None, force=0 ):
+                 aMask=None, force=0, n_components=None, centers=None ):
         """
         Calculate new clusters.
 
@@ -92,28 +129,57 @@ class TrajCluster:
         @param force: re-calculate even if parameters haven't changed
                       (default:0)
         @type  force: 1|0
+        @param n_components: cluster projections on this many principal
+                             components of the masked coordinates instead
+                             of the coordinates themselves (default: None)
+        @type  n_components: int
+        @param centers: start from these cluster centers (in the space of
+                        the clustered data), surplus centers are ignored,
+                        missing ones are added by k-means++; implies force
+                        (default: None)
+        @type  centers: array
         """
         if aMask is None:
             aMask = N0.ones( self.traj.getRef().lenAtoms() )
 
-        if self.fc is None or force or self.fcWeight != weight \
-           or self.n_clusters != n_clusters or N0.any( self.aMask != aMask) \
-           or self.fcConverged != converged:
+        newData = self.data is None or N0.any( self.aMask != aMask ) \
+                  or self.n_components != n_components
+
+        if self.fc is None or force or newData or self.fcWeight != weight \
+           or self.n_clusters != n_clusters or self.fcConverged != converged \
+           or centers is not None:
 
             self.n_clusters = n_clusters
             self.fcWeight = weight
             self.aMask = aMask
+            self.n_components = n_components
+
+            if newData:
+                self.data = self.__raveled()
 
-            self.fc = FuzzyCluster( self.__raveled(), self.n_clusters,
-                                    self.fcWeight )
+            self.fc = FuzzyCluster( self.data, self.n_clusters,
+                                    self.fcWeight, dtype=self.dtype,
+                                    block=self.block, init=self.init )
 
             self.fcCenters = self.fc.go( self.fcConverged,
                                          1000, nstep=10,
-                                         verbose=self.verbose )
+                                         verbose=self.verbose,
+                                         centers=centers )
+
+
+    def __warmCenters( self ):
+        """
+        Centers of the last clustering sorted by decreasing cluster size
+        (sum of memberships), used as start for a new clustering with more
+        or fewer clusters.
+        """
+        size = N.sum( self.memberships(), 1 )
+        return N.take( self.fcCenters, N.argsort( -size ), 0 )
 
 
     def calcClusterNumber( self, min_clst=5, max_clst=30, rmsLimit=1.0,
-                           weight=1.13, converged=1e-11, aMask=None, force=0 ):
+                           weight=1.13, converged=1e-11, aMask=None, force=0,
+                           n_components=None, warm=1 ):
         """
         Calculate the approximate number of clusters needed to pass
         the average intra-cluster rmsd limit.
@@ -133,6 +199,12 @@ class TrajCluster:
         @param force: re-calculate even if parameters haven't changed
                       (default: 0)
         @type  force: 1|0
+        @param n_components: cluster on this many principal components,
+                             see cluster() (default: None)
+        @type  n_components: int
+        @param warm: start each clustering from the centers of the
+                     previous cluster number (default: 1)
+        @type  warm: 1|0
 
         @return: number of clusters
         @rtype: int
@@ -140,10 +212,14 @@ class TrajCluster:
         @raise ClusterError: if can't determining number of clusters
         """
         pos = [ min_clst, max_clst ]
+        centers = None
 
         while 1:
             clst = int( N0.average(pos) )
-            self.cluster( clst, weight, converged, aMask, force=force )
+            self.cluster( clst, weight, converged, aMask, force=force,
+                          n_components=n_components, centers=centers )
+            if warm:
+                centers = self.__warmCenters()
             rmsLst = [ self.avgRmsd(i, aMask)[0] for i in range(clst)]
 
             if N0.average( rmsLst ) > rmsLimit:
@@ -192,8 +268,12 @@ class TrajCluster:
         @return: N0.array( n_clusters x n_atoms_masked x 3 )
         @rtype: array
         """
-        lenAtoms = N0.shape( self.fcCenters )[1] / 3
-        return N0.reshape( self.fcCenters, ( self.n_clusters, lenAtoms, 3))
+        c = self.fcCenters
+        if self.pca is not None:
+            c = N.dot( c, self.pca.components ) + self.pca.mean
+
+        lenAtoms = N0.shape( c )[1] // 3
+        return N0.reshape( c, ( self.n_clusters, lenAtoms, 3))
 
 
     def centerFrames( self ):
@@ -399,6 +479,35 @@ class Test(BT.BiskitTest):
                                                       len(member_frames[i]),
                                                       member_frames[i] ))
 
+        self.assertEqual( N.shape( self.tc.centers() ),
+                          ( n_clusters, N.sum( aMask ), 3 ) )
+
+    def test_TrajClusterPCA(self):
+        """TrajCluster on principal components (float32, k-means++)"""
+        traj = T.load( T.testRoot()+'/lig_pcr_00/traj.dat')
+
+        aMask = traj.ref.mask( lambda a: a['name'] in ['CA','CB','CG'] )
+        traj.fit( aMask, verbose=self.local )
+
+        self.tc = TrajCluster( traj, verbose=self.local, dtype=N.float32,
+                               block=30, init='kmeans++' )
+        self.tc.cluster( 4, aMask=aMask, n_components=5 )
+
+        self.assertEqual( self.tc.data.shape, ( traj.lenFrames(), 5 ) )
+        self.assertEqual( self.tc.data.dtype, N.float32 )
+        self.assertEqual( N.shape( self.tc.centers() ),
+                          ( 4, N.sum( aMask ), 3 ) )
+
+        ## every frame belongs to exactly one best cluster
+        frames = self.tc.memberFrames()
+        self.assertEqual( sorted( sum( frames, [] ) ),
+                          list( range( traj.lenFrames() ) ) )
+
+        ## warm start from the 4 clusters with one more cluster
+        self.tc.cluster( 5, aMask=aMask, n_components=5,
+                         centers=self.tc.fcCenters )
+        self.assertEqual( len( self.tc.memberFrames() ), 5 )
+
 
 if __name__ == '__main__':
 
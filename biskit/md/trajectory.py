@@ -27,6 +27,7 @@ Trajectory - Collection of coordinate frames of a molecule
 
 import biskit
 import biskit.core.oldnumeric as N0
+import numpy as N
 
 ## superposition module from M. Habeck
 from biskit import rmsFit
@@ -35,6 +36,7 @@ from biskit import tools as T
 from biskit import mathUtils as MU
 from biskit.errors import BiskitError
 from biskit import EHandler, PDBModel, PDBError, ProfileCollection
+from biskit.core.pdbWriter import PDBWriter
 
 import string
 import re
@@ -42,7 +44,7 @@ import copy
 import tempfile, os, types
 
 ## PCA
-import numpy.linalg as LA
+from biskit.md.pca import PCA
 
 class TrajError( BiskitError ):
     pass
@@ -62,6 +64,10 @@ class Trajectory:
     ## used by __cmpFileNames()
     ex_numbers = re.compile('\D*([0-9]+)\D*')
 
+    #: number of frames processed at once by fit() and other operations
+    #: that work through the frames chunk by chunk
+    FRAME_BATCH = 2000
+
     def __init__( self, pdbs=None, refpdb=None, rmwat=1,
                   castAll=0, verbose=1 ):
         """
@@ -203,7 +209,9 @@ class Trajectory:
         Called before pickling the object.
         """
         try:
-            if type( self.frames ) == list or self.frames.dtype.char == 'd':
+            if self.frames is None:
+                pass
+            elif type( self.frames ) == list or self.frames.dtype.char == 'd':
                 EHandler.warning("Converting coordinates to float array.")
                 self.frames = N0.array( self.frames ).astype(N0.Float32)
         except:
@@ -449,7 +457,8 @@ class Trajectory:
         r = self.__class__()
 
         ## this step takes some time for large frames !
-        r.frames = N0.take( self.frames, indices, 0 )
+        ## (frames of a memory-mapped trajectory are read into memory)
+        r.frames = N.asarray( N0.take( self.frames, indices, 0 ) )
 
         ## semi-deep copy of reference model
         r.setRef( self.ref.take( list(range( self.ref.lenAtoms()))) )
@@ -674,43 +683,40 @@ class Trajectory:
 
         refxyz = N0.compress( mask, refxyz, 0 )
 
+        if fit and not self.frames.flags.writeable:
+            raise TrajError('Cannot fit read-only frames. Re-open with '+\
+                            'loadMapped( fname, mode="r+" ) or "c".')
+
         if verbose: T.errWrite( "rmsd fitting..." )
 
-        rms = []          ## rms value of each frame
+        rms = N.zeros( len( self.frames ) )  ## rms value of each frame
         non_outliers = [] ## fraction of atoms considered for rms and fit
-        iterations = []   ## number of iterations performed on each frame
 
-        for i in range(0, len( self.frames) ):
+        ## superimpose batches of frames at once
+        for start in range( 0, len( self.frames ), self.FRAME_BATCH ):
 
-            xyz = self.frames[i]
+            frames = self.frames[ start : start + self.FRAME_BATCH ]
+            xyz = N0.compress( mask, frames, 1 )
 
             if n_it != 1:
-                (r, t), rmsdList = rmsFit.match( refxyz,
-                                                 N0.compress( mask, xyz, 0), n_it)
-                iterations.append( len( rmsdList ) )
-                non_outliers.append( rmsdList[-1][0] )
+                (r, t), (perc, d, n) = rmsFit.matchAll( refxyz, xyz, n_it )
 
-                xyz_transformed = N0.dot( xyz, N0.transpose(r)) + t
-
-                rms += [ rmsdList[-1][1] ]
+                non_outliers.extend( N.round( perc, 2 ) )
+                rms[ start : start + len( frames ) ] = N.round( d, 3 )
 
             else:
-                r, t = rmsFit.findTransformation( refxyz,
-                                                  N0.compress( mask, xyz, 0))
-
-                xyz_transformed = N0.dot( xyz, N0.transpose(r)) + t
+                r, t = rmsFit.findTransformations( refxyz, xyz )
 
-                d = N0.sqrt(N0.sum(N0.power( N0.compress(mask, xyz_transformed,0)\
-                                             - refxyz, 2), 1))
-
-
-                rms += [ N0.sqrt( N0.average(d**2) ) ]
+                d = rmsFit.applyTransformations( xyz, r, t ) - refxyz
 
+                rms[ start : start + len( frames ) ] = \
+                    N.sqrt( N.average( N.sum( d**2, 2 ), 1 ) )
 
             if fit:
-                self.frames[i] = xyz_transformed.astype(N0.Float32)
+                self.frames[ start : start + len( frames ) ] = \
+                    rmsFit.applyTransformations( frames, r, t )
 
-            if verbose and i%100 == 0:
+            if verbose:
                 T.errWrite( '#' )
 
         self.setProfile( prof, rms, n_iterations=n_it, **profInfos )
@@ -740,11 +746,12 @@ class Trajectory:
         r = r.astype(N0.Float32)
         t = t.astype(N0.Float32)
 
-        for i in range( len( self.frames ) ):
-            self.frames[ i ] = N0.array( N0.dot( self.frames[i], r ) ) + t 
-
-##         self.frames = N0.array( [ N0.dot( f, r )  for f in self.frames ] )
-##         self.frames += t
+        ## one matrix product per batch of frames (memory-mapped frames
+        ## are never copied completely)
+        for start in range( 0, len( self.frames ), self.FRAME_BATCH ):
+            stop = start + self.FRAME_BATCH
+            self.frames[ start : stop ] = N.dot( self.frames[ start : stop ],
+                                                 r ) + t
 
 
     def blockFit2ref( self, refModel=None, mask=None, conv=1e-6 ):
@@ -810,7 +817,9 @@ class Trajectory:
 
     def writePdbs( self, fname, frames=None):
         """
-        Write coordinates to an NMR-style MODEL/ENDMDL pdb file.
+        Write coordinates to an NMR-style MODEL/ENDMDL pdb file. Atom
+        records are only formatted once (see PDBWriter), frames are then
+        written one by one. File names ending with .gz are compressed.
 
         :param fname: name of new file
         :type  fname: str
@@ -821,30 +830,9 @@ class Trajectory:
         if frames is None:
             frames = list(range( self.lenFrames())) 
 
-        ## open new file
-        out = open(fname, 'w')
-        ## fetch name for temporary file
-        tmpFile = tempfile.mktemp()  
-
-        for n in frames:
-
-            ## write temporary pdb and open it
-            self.writePdb( n, tmpFile )
-
-            pdb_temp = open( tmpFile )
-
-            out.write("MODEL%6i\n" % n)
-            for line in pdb_temp:
-                if line[:3] != 'END':       # filter out END
-                    out.write(line)
-            out.write("ENDMDL\n")
-
-            ## remove temporary file
-            pdb_temp.close()
-            os.remove( tmpFile )
-
-        out.write("END")
-        out.close()
+        w = PDBWriter( self.ref )
+        w.writeModels( fname, ( self.frames[i] for i in frames ),
+                       serials=frames )
 
 
     def writeCrd( self, fname, frames=None ):
@@ -888,6 +876,118 @@ class Trajectory:
         out.close()
 
 
+    def writeDCD( self, fname, frames=None ):
+        """
+        Write frames to binary CHARMM/NAMD DCD file.
+
+        :param fname: output file name
+        :type  fname: str
+        :param frames: frame indices (default: all)
+        :type  frames: [int]
+        """
+        from .binaryTrajParser import DCDFile
+
+        xyz = self.frames
+        if frames is not None:
+            xyz = N0.take( xyz, frames, 0 )
+
+        DCDFile.write( fname, xyz )
+
+
+    def writeNetCDF( self, fname, frames=None ):
+        """
+        Write frames to binary Amber NetCDF trajectory file.
+
+        :param fname: output file name
+        :type  fname: str
+        :param frames: frame indices (default: all)
+        :type  frames: [int]
+        """
+        from .binaryTrajParser import NetCDFFile
+
+        xyz = self.frames
+        if frames is not None:
+            xyz = N0.take( xyz, frames, 0 )
+
+        NetCDFFile.write( fname, xyz )
+
+
+    def saveMapped( self, fname ):
+        """
+        Save trajectory in a format that can be opened without reading
+        all coordinates into memory (see L{loadMapped}). Two files are
+        created:
+          - fname.npy -- frames as float32 array in numpy .npy format
+          - fname     -- pickled Trajectory without frames (reference
+                         model, profiles, frame names, etc.)
+
+        Frames are copied in chunks, so memory-mapped trajectories can
+        be saved without loading them.
+
+        :param fname: file name of the pickled (frame-less) trajectory
+        :type  fname: str
+
+        :return: name of the .npy frame file
+        :rtype: str
+        """
+        fname = T.absfile( fname )
+        fnpy = fname + '.npy'
+
+        out = N.lib.format.open_memmap( fnpy, mode='w+', dtype=N.float32,
+                                        shape=N.shape( self.frames ) )
+
+        for start in range( 0, len( self.frames ), self.FRAME_BATCH ):
+            stop = start + self.FRAME_BATCH
+            out[ start : stop ] = self.frames[ start : stop ]
+
+        out.flush()
+        del out
+
+        frames, self.frames = self.frames, None
+        try:
+            T.dump( self, fname )
+        finally:
+            self.frames = frames
+
+        return fnpy
+
+
+    @staticmethod
+    def loadMapped( fname, mode='r' ):
+        """
+        Open a trajectory written by L{saveMapped}. Frames are memory-mapped
+        from the .npy file and only read from disk when they are accessed.
+        takeFrames, compressFrames, fit, avgModel and getFluct_global work
+        through the frames chunk by chunk.
+
+        :param fname: file name of the pickled (frame-less) trajectory
+        :type  fname: str
+        :param mode: numpy.memmap mode: 'r' .. read-only, 'r+' .. modify
+                     frames on disk (e.g. by fit), 'c' .. copy-on-write
+                     (default: 'r')
+        :type  mode: str
+
+        :return: trajectory with memory-mapped frames
+        :rtype: Trajectory
+
+        :raise TrajError: if frames do not match the stored trajectory
+        """
+        fname = T.absfile( fname )
+        t = T.load( fname )
+
+        t.frames = N.load( fname + '.npy', mmap_mode=mode )
+
+        if t.frameNames is not None and len( t.frameNames ) != len( t.frames ):
+            raise TrajError('%s.npy has %i frames but %s has %i frame names.'\
+                            % (fname, len(t.frames), fname, len(t.frameNames)))
+
+        if t.ref is not None and t.ref.lenAtoms() != t.frames.shape[1]:
+            raise TrajError('%s.npy does not match the reference model.' \
+                            % fname )
+
+        return t
+
+
     def getPDBModel( self, index ):
         """
         Get PDBModel object for a particular frame of the trajectory.
@@ -1007,12 +1107,24 @@ class Trajectory:
         return self.profiles.plot( *name, **args )
 
 
-    def pairwiseRmsd( self, aMask=None, noFit=0 ):
+    def pairwiseRmsd( self, aMask=None, noFit=0, condensed=0, ncpu=1,
+                      fout=None ):
         """
         Calculate rmsd between each 2 coordinate frames.
+        See L{biskit.rmsFit.pairwiseRmsd} for details.
 
         :param aMask: atom mask
         :type  aMask: [1|0]
+        :param noFit: do not superimpose frames (default: 0)
+        :type  noFit: 1|0
+        :param condensed: return condensed upper triangle, F*(F-1)/2
+                          (default: 0, return full matrix)
+        :type  condensed: 1|0
+        :param ncpu: number of worker processes (default: 1)
+        :type  ncpu: int
+        :param fout: write condensed result into memory-mapped file
+                     (implies condensed=1; default: None)
+        :type  fout: str
         :return: frames x frames array of float
         :rtype: array
         """
@@ -1021,18 +1133,15 @@ class Trajectory:
         if aMask is not None:
             frames = N0.compress( aMask, frames, 1 )
 
-        result = N0.zeros( (len( frames ), len( frames )), N0.Float32 )
+        d = rmsFit.pairwiseRmsd( frames, noFit=noFit, out=fout, ncpu=ncpu )
 
-        for i in range(0, len( frames ) ):
+        if condensed or fout:
+            return d
 
-            for j in range( i+1, len( frames ) ):
-                if noFit:
-                    d = N0.sqrt(N0.sum(N0.power(frames[i]-frames[j], 2), 1))
-                    result[i,j] = result[j,i] = N0.sqrt( N0.average(d**2) )
+        i, j = N.triu_indices( len( frames ), 1 )
 
-                else:
-                    rt, rmsdLst = rmsFit.match( frames[i], frames[j], 1 )
-                    result[i,j] = result[j,i] = rmsdLst[0][1]
+        result = N0.zeros( (len( frames ), len( frames )), N0.Float32 )
+        result[ i, j ] = result[ j, i ] = d
 
         return result
 
@@ -1056,7 +1165,14 @@ class Trajectory:
         ## mean position of each atom in all frames
         avg = N0.average( frames )
 
-        return N0.average(N0.sqrt(N0.sum(N0.power(frames - avg, 2), 2) ))
+        ## sum up deviations chunk by chunk (frames may be memory-mapped)
+        r = N.zeros( N.shape( avg )[0] )
+
+        for start in range( 0, len( frames ), self.FRAME_BATCH ):
+            chunk = frames[ start : start + self.FRAME_BATCH ]
+            r += N0.sum(N0.sqrt(N0.sum(N0.power(chunk - avg, 2), 2) ))
+
+        return r / len( frames )
 
 
     def __resWindow( self, res, n_neighbores, rchainMap=None,
@@ -1118,6 +1234,10 @@ class Trajectory:
         Get mean displacement of each atom from it's average position after
         fitting of each residue to the reference backbone coordinates of itself
         and selected atoms of neighboring residues to the right and left.
+        The fit windows of all residues are collected once as index arrays;
+        all residues of a batch of frames are then superimposed together
+        (see rmsFit.findSegmentTransformations), no per-residue Trajectory
+        is created.
 
         :param mask: N_atoms x 1 array of 0||1, atoms for which fluctuation
                      should be calculated
@@ -1129,7 +1249,8 @@ class Trajectory:
         :param right_atoms: atoms (names) to use from these neighbore residues
         :type  right_atoms: [str]
 
-        :return: Numpy array ( N_unmasked x 1 ) of float
+        :return: Numpy array ( N_unmasked x 1 ) of float, for all atoms of
+                 residues with at least one unmasked atom
         :rtype: array
         """
         if mask is None:
@@ -1145,38 +1266,84 @@ class Trajectory:
         ## chain index of each residue
         rchainMap = N0.take( self.ref.chainMap(), self.ref.resIndex() )
 
-        result = []
+        mask_BB = self.ref.maskBB() * self.ref.maskHeavy()
+
+        ## atoms of each residue and atoms of its fit window, concatenated
+        i_center = []  ## atom indices of all fitted residues
+        i_fit = []     ## atom indices of all fit windows
+        s_center = []  ## window of each center atom
+        s_fit = []     ## first position of each window in i_fit
+        i_result = []  ## position of each center atom in result
+        n_result = 0
 
         for res in residues:
 
             i_res, i_border = self.__resWindow(res, border_res, rchainMap,
                                                fit_atoms_left, fit_atoms_right)
+            window = [ a for a in i_res + i_border if mask_BB[a] ]
+
+            if window:
+                s_fit.append( len( i_fit ) )
+                s_center.extend( [ len( s_fit ) - 1 ] * len( i_res ) )
+                i_center.extend( i_res )
+                i_fit.extend( window )
+                i_result.extend( range( n_result, n_result + len( i_res ) ) )
+            else:
+                T.errWrite('?' + str( res ))
 
-            try:
-                if not len( i_res ): raise PDBError('empty residue')
-
-                t_res = self.takeAtoms( i_res + i_border )
-
-                i_center = range( len( i_res ) )
-
-                mask_BB = t_res.ref.maskBB() * t_res.ref.maskHeavy()
-
-                ## fit with border atoms ..
-                t_res.fit( ref=t_res.ref, mask=mask_BB, verbose=0 )
-                ## .. but calculate only with center residue atoms
-                frames = N0.take( t_res.frames, i_center, 1 )
-
-                avg = N0.average( frames )
+            n_result += len( i_res )
 
-                rmsd = N0.average(N0.sqrt(N0.sum(N0.power(frames - avg, 2), 2) ))
+        s_center = N.array( s_center, int )
+        ref_fit = N0.take( self.ref.xyz, i_fit, 0 )
 
-                result.extend( rmsd )
+        ## transformations of first pass are re-used unless frames are mapped
+        cache = {}
+        keep = not isinstance( self.frames, N.memmap )
 
+        def fitted( start, frames ):
+            """center atoms fitted with their window, F x N_center x 3"""
+            if start in cache:
+                r, t = cache.pop( start )
+            else:
+                r, t = rmsFit.findSegmentTransformations(
+                    ref_fit, N.take( frames, i_fit, 1 ), s_fit )
+                if keep:
+                    cache[ start ] = ( r.astype( N.float32 ),
+                                       t.astype( N.float32 ) )
+
+            ## one rotation per atom; matmul is only fast for equal types
+            xyz = N.take( frames, i_center, 1 )
+            dtype = N.result_type( xyz.dtype, N.float32 )
+            r = N.take( r, s_center, 1 ).astype( dtype )
+            t = N.take( t, s_center, 1 ).astype( dtype )
+
+            xyz = xyz[..., N.newaxis].astype( dtype, copy=False )
+
+            return N.matmul( r, xyz )[..., 0] + t
+
+        ## one rotation per atom needs 4 times the memory of the frames
+        batch = max( 1, self.FRAME_BATCH // 4 )
+
+        ## average positions, then mean deviation from average (2 passes)
+        avg = N.zeros( ( len( i_center ), 3 ) )
+        rmsd = N.zeros( len( i_center ) )
+
+        if len( i_center ):
+            for start in range( 0, len( self.frames ), batch ):
+                frames = self.frames[ start : start + batch ]
+                avg += N.sum( fitted( start, frames ), 0 )
+            avg /= len( self.frames )
+
+            for start in range( 0, len( self.frames ), batch ):
+                frames = self.frames[ start : start + batch ]
+                d = fitted( start, frames ) - avg
+                rmsd += N.sum( N.sqrt( N.sum( d**2, 2 ) ), 0 )
                 if verbose: T.errWrite('#')
+            rmsd /= len( self.frames )
 
-            except ZeroDivisionError:
-                result.extend( N0.zeros( len(i_res), N0.Float32 ) )
-                T.errWrite('?' + str( res ))
+        ## residues without fit atoms get 0 fluctuation
+        result = N.zeros( n_result )
+        result[ i_result ] = rmsd
 
         if verbose: T.errWriteln( "done" )
 
@@ -1201,22 +1368,10 @@ class Trajectory:
             mask = N0.ones( len( self.frames[0] ), N0.Int32 )
 
         ## eliminate all values that do not belong to the selected atoms
-        masked = atomValues * mask
-
-        result = []
+        masked = N.asarray( atomValues ) * mask
 
         ## set all atoms of each residue to uniform value
-        for res in range( 0, self.resMap()[-1]+1 ):
-
-            ## get atom entries for this residue
-            resAtoms = N0.compress( N0.equal( self.resMap(), res ), masked )
-
-            ## get maximum value
-            masterValue = max( resAtoms )
-
-            result += resAtoms * 0.0 + masterValue
-
-        return N0.array( result )
+        return self.ref.expandSegments( self.ref.reduceSegments( masked ) )
 
 
     def getGammaFluct( self, fluctList=None ):
@@ -1237,7 +1392,7 @@ class Trajectory:
         ## define mask for gamma atoms in all Amino acids
         select = lambda a: a['name'] in ['CG', 'CG1', 'CG2', 'OG',
                                          'OG1', 'OG2','SG']
-        CG_mask = self.mask( select )
+        CG_mask = self.ref.mask( select )
 
         return self.residusMaximus( fluctList, CG_mask )
 
@@ -1258,13 +1413,9 @@ class Trajectory:
         if atomFluctList is None:
             atomFluctList = self.getFluct_global()
 
-        ## Give all atoms of each res. the same fluct. value
-        ## (the highest fluctuation of any backbone atom)
-        result = self.residusMaximus( atomFluctList, self.ref.maskBB() )
-
-        ## take first atoms only
-        result = N0.take( result, self.ref.resIndex() )
-##        result = N0.compress( self.ref.maskCA(), atomFluctList)
+        ## highest fluctuation of any backbone atom in each residue
+        masked = N.asarray( atomFluctList ) * self.ref.maskBB()
+        result = self.ref.reduceSegments( masked, 'max' )
 
         ## check dimension
         if len( result ) != self.ref.lenResidues():
@@ -1404,8 +1555,6 @@ class Trajectory:
 
             result['p'] = N0.take( result['p'], indices, 0 )
 
-            result['u'] = N0.take( result['u'], indices, 0 )
-
             if result['fMask'] is not None:
                 result['fMask'] = N0.take( result['fMask'], indices, 0 )
 
@@ -1425,7 +1574,8 @@ class Trajectory:
         return self.__takePca( N0.nonzero( fMask ) )
 
 
-    def getPca( self, aMask=None, fMask=None, fit=1 ):
+    def getPca( self, aMask=None, fMask=None, fit=1, n_components=None,
+                method='auto' ):
         """
         Get the results form a principal component analysis.
 
@@ -1436,10 +1586,17 @@ class Trajectory:
         :param fit: fit to average structure before doing the PC analysis
                     (default: 1)
         :type  fit: 1|0
+        :param n_components: only calculate the first n components
+                             (default: None, all)
+        :type  n_components: int
+        :param method: 'auto', 'svd', 'cov', 'randomized' or 'incremental',
+                       see :class:`biskit.md.PCA` (default: 'auto')
+        :type  method: str
 
         :return: Dictionary with results from the PC analysis::
                    dic {'p': projection of each frame in PC space,
                         'e': list of eigen values,
+                        'u': eigenvectors (rows),
                         'fit':.., 'aMask':.., 'fMask':.. parameters used}
         :rtype: dict
         """
@@ -1448,18 +1605,28 @@ class Trajectory:
 
         pc = getattr(self, 'pc', None)
 
+        same = lambda a, b: ( a is None and b is None ) or \
+               ( a is not None and b is not None and
+                 N.array_equal( a, b ) )
+
         ## return chached result if parameters haven't changed
-        if pc is not None and pc['fMask'] == fMask and pc['fit'] == fit and \
-           aMask == pc['aMask']:
+        if pc is not None and same( pc['fMask'], fMask ) and \
+           pc['fit'] == fit and same( aMask, pc['aMask'] ) and \
+           pc.get( 'n_components' ) == n_components and \
+           pc.get( 'method', 'auto' ) == method:
 
             return pc
 
-        evectors, proj, evalues = self.pca( aMask, fMask, fit )
+        evectors, proj, evalues = self.pca( aMask, fMask, fit,
+                                            n_components=n_components,
+                                            method=method )
 
         pc = {}
         pc['aMask'] = aMask
         pc['fMask'] = fMask
         pc['fit'] = fit
+        pc['n_components'] = n_components
+        pc['method'] = method
         pc['p'] = proj
         pc['e'] = evalues
         pc['u'] = evectors
@@ -1469,9 +1636,13 @@ class Trajectory:
         return pc
 
 
-    def pca( self, atomMask=None, frameMask=None, fit=1 ):
+    def pca( self, atomMask=None, frameMask=None, fit=1, n_components=None,
+             method='auto' ):
         """
-        Calculate principal components of trajectory frames.
+        Calculate principal components of trajectory frames. Frames are
+        processed in blocks of FRAME_BATCH, so that memory-mapped
+        trajectories are never loaded completely. See :class:`biskit.md.PCA`
+        for the different methods.
 
         :param atomMask: 1 x N_atoms, [111001110..] atoms to consider
                          (default: all)
@@ -1479,33 +1650,40 @@ class Trajectory:
         :param frameMask: 1 x N_frames, [001111..] frames to consider
                           (default all )
         :type  frameMask: [1|0]
-
-        :return: (N_frames x N_frames), (1 x N_frames),
-                 projection of each frame in PC space, eigenvalue of each PC
+        :param fit: fit to average structure first (default: 1)
+        :type  fit: 1|0
+        :param n_components: only calculate the first n components
+                             (default: None, all)
+        :type  n_components: int
+        :param method: 'auto', 'svd', 'cov', 'randomized' or 'incremental'
+                       (default: 'auto')
+        :type  method: str
+
+        :return: (k x 3N_atoms), (N_frames x k), (k),
+                 eigenvectors (rows), projection of each frame in PC space,
+                 eigenvalue of each PC
         :rtype: array, array, array
         """
-        if frameMask is None: frameMask = N0.ones( len( self.frames ), N0.Int32 )
-
         if atomMask is None: atomMask = N0.ones(self.getRef().lenAtoms(),
                                                 N0.Int32)
 
         if fit:
             self.fit( atomMask )
 
-        refxyz = N0.average( self.frames, 0 )
+        rows = None
+        if frameMask is not None:
+            rows = N.flatnonzero( frameMask )
 
-        data = N0.compress( frameMask, self.frames, 0 )
+        cols = N.flatnonzero( atomMask )
 
-        data = data - refxyz
+        pca = PCA( n_components, method=method, block=self.FRAME_BATCH )
 
-        data = N0.compress( atomMask, data, 1 )
+        ## center on the average of all frames
+        refxyz = pca.average( self.frames, cols=cols )
 
-        ## reduce to 2D array
-        data = N0.array( map( N0.ravel, data ) )
+        pca.fit( self.frames, rows=rows, cols=cols, mean=refxyz )
 
-        V, L, U = LA.svd( data )
-
-        return U, V * L, N0.power(L, 2)
+        return pca.components, pca.projections, pca.evalues
 
 
     def pcMovie( self, ev, steps, factor=1., ref=0, morph=1 ):
@@ -1620,6 +1798,96 @@ class Test(BT.BiskitTest):
         self.assertAlmostEqual( N0.sum( self.traj.profile('rms') ),
                                 58.101235746353879, 2 )
 
+    def test_getFluct_local(self):
+        """Trajectory.getFluct_local test (against single residue fit)"""
+        self.traj = T.load(T.testRoot() + '/lig_pcr_00/traj.dat')
+        ref = self.traj.ref
+
+        r = self.traj.getFluct_local( verbose=self.local )
+        self.assertEqual( len( r ), ref.lenAtoms() )
+
+        ## residue 10, fitted together with C of residue 9 and N of 11
+        i_res = ref.res2atomIndices( [10] ).tolist()
+        i_border = [ i for i in ref.res2atomIndices( [9] )
+                     if ref['name'][i] == 'C' ] + \
+                   [ i for i in ref.res2atomIndices( [11] )
+                     if ref['name'][i] == 'N' ]
+
+        t = self.traj.takeAtoms( i_res + i_border )
+        t.fit( ref=t.ref, mask=t.ref.maskBB() * t.ref.maskHeavy(), verbose=0 )
+        frames = t.frames[:, :len( i_res )]
+        d = N.sqrt( N.sum( ( frames - N.average( frames, 0 ) )**2, 2 ) )
+
+        self.assertTrue( N.allclose( r[ i_res ], N.average( d, 0 ),
+                                     atol=1e-4 ) )
+
+    def test_mapped(self):
+        """Trajectory.saveMapped / loadMapped test"""
+        self.traj = T.load(T.testRoot() + '/lig_pcr_00/traj.dat')
+        self.f_map = tempfile.mktemp( '.traj', 'mapped_' )
+
+        self.traj.saveMapped( self.f_map )
+        self.t = Trajectory.loadMapped( self.f_map )
+
+        self.assertTrue( isinstance( self.t.frames, N.memmap ) )
+        self.assertTrue( N.all( self.t.frames == self.traj.frames ) )
+        self.assertEqual( self.t.frameNames, self.traj.frameNames )
+        self.assertTrue( N.allclose( self.t.getFluct_global(),
+                                     self.traj.getFluct_global(), atol=1e-4 ))
+
+        t2 = self.t.takeFrames( [1, 3, 5] )
+        self.assertFalse( isinstance( t2.frames, N.memmap ) )
+
+        self.assertRaises( TrajError, self.t.fit )
+
+        self.t = Trajectory.loadMapped( self.f_map, mode='r+' )
+        self.t.FRAME_BATCH = 30
+        self.t.fit( verbose=0 )
+        self.traj.fit( verbose=0 )
+
+        self.assertTrue( N.allclose( self.t.frames, self.traj.frames,
+                                     atol=1e-3 ) )
+
+    def cleanUp(self):
+        T.tryRemove( getattr( self, 'f_map', '' ) )
+        T.tryRemove( getattr( self, 'f_map', '' ) + '.npy' )
+
+    def test_getPca(self):
+        """Trajectory.getPca test"""
+        self.traj = T.load(T.testRoot() + '/lig_pcr_00/traj.dat')
+        self.traj.fit( self.traj.ref.maskCA(), verbose=0 )
+
+        mask = self.traj.ref.maskCA()
+        fmask = N.arange( 100 ) % 3 != 0
+
+        pc = self.traj.getPca( mask, fmask, fit=0 )
+        self.assertTrue( pc is self.traj.getPca( mask, fmask, fit=0 ) )
+        self.assertEqual( N.shape( pc['p'] ), ( N.sum( fmask ),
+                                                N.sum( fmask ) ) )
+
+        pc5 = self.traj.getPca( mask, fmask, fit=0, n_components=5,
+                                method='randomized' )
+        self.assertEqual( N.shape( pc5['u'] ), ( 5, 3 * N.sum( mask ) ) )
+        self.assertTrue( N.allclose( pc5['e'][:3], pc['e'][:3], rtol=1e-3 ) )
+
+        t = self.traj.takeFrames( [0, 1, 2] )
+        self.assertEqual( N.shape( t.pc['p'] ), (3, 5) )
+
+    def test_pairwiseRmsd(self):
+        """Trajectory.pairwiseRmsd test"""
+        self.traj = T.load(T.testRoot() + '/lig_pcr_00/traj.dat')
+        self.traj = self.traj.takeFrames( list(range( 10 )) )
+
+        mask = self.traj.ref.maskCA()
+        d = self.traj.pairwiseRmsd( mask )
+
+        self.assertEqual( N.shape( d ), (10, 10) )
+        self.assertTrue( N.all( d == N.transpose( d ) ) )
+
+        m = self.traj[2].compress( mask )
+        self.assertAlmostEqual( d[2, 7], m.rms( self.traj[7].compress(mask) ),
+                                4 )
+
 
 if __name__ == '__main__':
 
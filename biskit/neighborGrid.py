@@ -0,0 +1,278 @@
+##
+## Biskit, a toolkit for the manipulation of macromolecular structures
+## Copyright (C) 2004-2018 Raik Gruenberg & Johan Leckner
+##
+## This program is free software; you can redistribute it and/or
+## modify it under the terms of the GNU General Public License as
+## published by the Free Software Foundation; either version 3 of the
+## License, or any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+## General Public License for more details.
+##
+## You find a copy of the GNU General Public License in the file
+## license.txt along with this program; if not, write to the Free
+## Software Foundation, Inc., 675 Mass Ave, Cambridge, MA 02139, USA.
+##
+##
+"""
+Cell-list index for fast distance-based neighbor searches.
+
+Coordinates are sorted into cubic cells; a search for all points closer
+than a cutoff only needs to look at points in the same and adjacent cells.
+All searches are vectorized with numpy and return sparse index pairs
+rather than dense distance matrices, so time and memory scale with the
+number of atoms (and neighbors) rather than with the product of atom
+numbers.
+
+.. seealso:: `biskit.PDBModel.neighbors`, `biskit.PDBModel.pairsWithin`
+"""
+import numpy as N
+
+from biskit.errors import BiskitError
+
+
+class NeighborGridError( BiskitError ):
+    pass
+
+
+class NeighborGrid:
+    """
+    Spatial cell list built from a N x 3 coordinate array.
+
+    Usage::
+
+      g = NeighborGrid( model.xyz, cellsize=6. )
+      i, j = g.pairs( 4.5 )            ## all atom pairs closer than 4.5 A
+      i, j = g.pairsWith( xyz2, 4.5 )  ## pairs between grid atoms and xyz2
+      i = g.neighbors( model.xyz[10], 4.5 )
+
+    The cell size should be similar to the typical search cutoff. Searches
+    with larger cutoffs remain correct but look at more cells.
+    """
+
+    def __init__( self, xyz, cellsize=6. ):
+        """
+        :param xyz: coordinates, N x 3
+        :type  xyz: array
+        :param cellsize: edge length of each cell in Angstrom (default 6)
+        :type  cellsize: float
+
+        :raise NeighborGridError: if cellsize is not positive
+        """
+        if not cellsize > 0:
+            raise NeighborGridError('cell size must be positive')
+
+        #: coordinates the grid was built from (reference, not a copy)
+        self.xyz = xyz
+        self.cellsize = float( cellsize )
+
+        xyz = N.reshape( N.asarray( xyz ), (-1, 3) )
+        self.n = len( xyz )
+
+        if self.n == 0:
+            self.origin = N.zeros( 3 )
+            self.dims = N.ones( 3, int )
+            self.order = N.zeros( 0, int )
+            self.cells = self.starts = self.counts = N.zeros( 0, int )
+            return
+
+        self.origin = N.min( xyz, 0 )
+
+        ijk = self.cellCoordinates( xyz )
+        self.dims = N.max( ijk, 0 ) + 1
+
+        cid = self.__linear( ijk )
+
+        #: atom indices sorted by cell
+        self.order = N.argsort( cid, kind='mergesort' )
+
+        #: occupied cells, position of their first atom in order, atom count
+        self.cells, self.starts, self.counts = N.unique( cid[ self.order ],
+                                                         return_index=True,
+                                                         return_counts=True )
+
+
+    def cellCoordinates( self, xyz ):
+        """
+        :param xyz: coordinates, N x 3
+        :type  xyz: array
+
+        :return: integer cell coordinates (may lie outside the grid), N x 3
+        :rtype: array of int
+        """
+        return N.floor( (xyz - self.origin) / self.cellsize ).astype( int )
+
+
+    def __linear( self, ijk ):
+        """cell coordinates -> linear cell id"""
+        return ( ijk[:,0] * self.dims[1] + ijk[:,1] ) * self.dims[2] \
+               + ijk[:,2]
+
+
+    def __offsets( self, cutoff ):
+        """cell offsets that need to be searched for the given cutoff"""
+        k = int( N.ceil( cutoff / self.cellsize ) )
+        r = N.arange( -k, k+1 )
+        return N.array( N.meshgrid( r, r, r ) ).reshape( 3, -1 ).T
+
+
+    def pairsWith( self, xyz, cutoff ):
+        """
+        Find all pairs of grid atoms and given points that are closer than
+        cutoff.
+
+        :param xyz: query coordinates, M x 3
+        :type  xyz: array
+        :param cutoff: distance cutoff in Angstrom
+        :type  cutoff: float
+
+        :return: indices i into the grid atoms and j into xyz, sorted by i
+        :rtype: (array of int, array of int)
+        """
+        xyz = N.reshape( N.asarray( xyz ), (-1, 3) )
+        ri, rj = [ N.zeros( 0, int ) ], [ N.zeros( 0, int ) ]
+
+        if self.n == 0 or len( xyz ) == 0:
+            return ri[0], rj[0]
+
+        cutoff2 = cutoff**2
+        ijk = self.cellCoordinates( xyz )
+        grid_xyz = N.reshape( N.asarray( self.xyz ), (-1, 3) )
+
+        for o in self.__offsets( cutoff ):
+
+            c = ijk + o
+            valid = N.all( (c >= 0) & (c < self.dims), axis=1 )
+            if not N.any( valid ):
+                continue
+
+            query = N.flatnonzero( valid )
+            cid = self.__linear( c[ query ] )
+
+            pos = N.searchsorted( self.cells, cid )
+            pos[ pos == len( self.cells ) ] = 0
+            found = self.cells[ pos ] == cid
+
+            query, pos = query[ found ], pos[ found ]
+            if len( query ) == 0:
+                continue
+
+            ## expand each query point against all atoms of its target cell
+            n = self.counts[ pos ]
+            total = N.sum( n )
+
+            j = N.repeat( query, n )
+            first = N.repeat( self.starts[ pos ], n )
+            shift = N.arange( total ) - N.repeat( N.cumsum( n ) - n, n )
+            i = self.order[ first + shift ]
+
+            d = grid_xyz[ i ] - xyz[ j ]
+            close = N.sum( d * d, 1 ) < cutoff2
+
+            ri.append( i[ close ] )
+            rj.append( j[ close ] )
+
+        i, j = N.concatenate( ri ), N.concatenate( rj )
+
+        sort = N.lexsort( (j, i) )
+        return i[ sort ], j[ sort ]
+
+
+    def pairs( self, cutoff ):
+        """
+        Find all pairs of grid atoms that are closer than cutoff.
+
+        :param cutoff: distance cutoff in Angstrom
+        :type  cutoff: float
+
+        :return: atom indices i and j with i < j, sorted by i then j
+        :rtype: (array of int, array of int)
+        """
+        i, j = self.pairsWith( self.xyz, cutoff )
+        upper = i < j
+        return i[ upper ], j[ upper ]
+
+
+    def neighbors( self, point, cutoff ):
+        """
+        Find all grid atoms closer than cutoff to a single point.
+
+        :param point: coordinate, 1 x 3
+        :type  point: array
+        :param cutoff: distance cutoff in Angstrom
+        :type  cutoff: float
+
+        :return: indices of grid atoms, sorted
+        :rtype: array of int
+        """
+        return self.pairsWith( N.reshape( point, (1, 3) ), cutoff )[0]
+
+
+    def countNeighbors( self, xyz, cutoff ):
+        """
+        Count grid atoms closer than cutoff to each of the given points.
+
+        :param xyz: query coordinates, M x 3
+        :type  xyz: array
+        :param cutoff: distance cutoff in Angstrom
+        :type  cutoff: float
+
+        :return: number of grid atoms around each point, 1 x M
+        :rtype: array of int
+        """
+        xyz = N.reshape( N.asarray( xyz ), (-1, 3) )
+        i, j = self.pairsWith( xyz, cutoff )
+        return N.bincount( j, minlength=len( xyz ) )
+
+
+#############
+##  TESTING
+#############
+import biskit.test as BT
+
+class Test(BT.BiskitTest):
+    """Test NeighborGrid"""
+
+    def prepare(self):
+        import biskit.mathUtils as MU
+        N.random.seed( 42 )
+        self.xyz = N.random.random( (500, 3) ) * 30.
+        self.xyz2 = N.random.random( (200, 3) ) * 40. - 5.
+        self.dist = MU.pairwiseDistances( self.xyz, self.xyz2 )
+        self.dist_self = MU.pairwiseDistances( self.xyz, self.xyz )
+
+    def test_pairsWith(self):
+        """NeighborGrid.pairsWith test"""
+        for cellsize in [ 2., 5., 12. ]:
+            self.g = NeighborGrid( self.xyz, cellsize=cellsize )
+            i, j = self.g.pairsWith( self.xyz2, 4.5 )
+
+            ref_i, ref_j = N.nonzero( self.dist < 4.5 )
+            self.assertTrue( N.all( i == ref_i ) and N.all( j == ref_j ) )
+
+    def test_pairs(self):
+        """NeighborGrid.pairs test"""
+        self.g = NeighborGrid( self.xyz, cellsize=4. )
+        i, j = self.g.pairs( 3. )
+
+        ref_i, ref_j = N.nonzero( N.triu( self.dist_self < 3., 1 ) )
+        self.assertTrue( N.all( i == ref_i ) and N.all( j == ref_j ) )
+
+        n = self.g.countNeighbors( self.xyz2, 6. )
+        self.assertTrue( N.all( n == N.sum( self.dist < 6., 0 ) ) )
+
+        nb = self.g.neighbors( self.xyz[10], 5. )
+        self.assertTrue( N.all( nb == N.flatnonzero(self.dist_self[10] < 5.)))
+
+    def test_empty(self):
+        """NeighborGrid with empty coordinates test"""
+        self.g = NeighborGrid( N.zeros( (0, 3) ) )
+        self.assertEqual( len( self.g.pairs( 4. )[0] ), 0 )
+
+
+if __name__ == '__main__':
+
+    BT.localTest()
@@ -29,6 +29,7 @@ import numpy as N
 
 import biskit
 import biskit.tools as T
+from biskit.neighborGrid import NeighborGrid
 
 ## from biskit.exe.hmmer import Hmmer
 from biskit.exe.dssp import Dssp
@@ -193,13 +194,12 @@ class PDBDope:
         else:
             mSurf = N0.ones( self.m.lenAtoms() )
 
-        ## loop over all surface atoms
+        ## count heavy atoms around all surface atoms in one grid search
         surf_pos = N0.nonzero( mSurf )
-        contacts = []
 
-        for i in surf_pos:
-            dist = N0.sum(( xyz - self.m.xyz[i])**2, 1)
-            contacts += [ N0.sum( N0.less(dist, radius**2 )) -1]
+        grid = NeighborGrid( xyz, cellsize=radius )
+        contacts = grid.countNeighbors( N0.take( self.m.xyz, surf_pos, 0 ),
+                                        radius ) - 1
 
         self.m.atoms.set( profName, contacts, mSurf, default=-1,
                           comment='atom density radius %3.1fA' % radius,
@@ -28,14 +28,16 @@ from biskit import molUtils
 from biskit import mathUtils
 from biskit import match2seq
 from biskit import rmsFit
+from biskit.neighborGrid import NeighborGrid
 from biskit.core.localpath import LocalPath
 from biskit.errors import BiskitError
 from biskit.profileCollection import ProfileCollection, ProfileError
+from biskit.core.categoricalList import CategoricalList
 from biskit.core.pdbparserFactory import PDBParserFactory
 from biskit.core.pdbparseFile import PDBParseFile
+from biskit.core.pdbWriter import PDBWriter
 from biskit import biounit as BU
 from biskit.core import oldnumeric as N0
-from biskit.core.scientificIO import PDB as IO
 from biskit import EHandler
 
 from biskit.future import Residue
@@ -184,6 +186,16 @@ class PDBModel:
                 'segment_id', 'charge', 'residue_name', 'after_ter',
                 'serial_number', 'type', 'temperature_factor']
 
+    #: reductions supported by reduceSegments (besides 'mean' and 'first')
+    REDUCTIONS = { 'max': N.maximum, 'min': N.minimum, 'sum': N.add,
+                   'any': N.logical_or, 'all': N.logical_and }
+
+    ## functions that atom2resProfile replaces by reduceSegments
+    __reductionFunctions = { max: 'max', min: 'min', sum: 'sum',
+                             N.max: 'max', N.min: 'min', N.sum: 'sum',
+                             N.mean: 'mean', N.average: 'mean',
+                             N.any: 'any', N.all: 'all' }
+
     def __init__( self, source=None, pdbCode=None, noxyz=0, skipRes=None,
                   headPatterns=[] ):
         """
@@ -228,6 +240,8 @@ class PDBModel:
         self.__maskHeavy = None
         #: cache position of chain breaks (clear when xyz changes)
         self.__chainBreaks = None
+        #: cached cell-list index of coordinates (see neighborGrid)
+        self.__neighborGrid = None
 
         #: starting positions of each residue
         self._resIndex = None
@@ -547,6 +561,7 @@ class PDBModel:
         self.__maskCA = getattr( self, '__maskCA', None )
         self.__maskBB = getattr( self, '__maskBB', None )
         self.__maskHeavy = getattr( self, '__maskHeavy', None )
+        self.__neighborGrid = getattr( self, '_PDBModel__neighborGrid', None )
 
         ## test cases of biskit < 2.3 still contain Numeric arrays
         if self.xyz is not None and type( self.xyz ) is not N.ndarray:
@@ -852,6 +867,7 @@ class PDBModel:
             self.__slimProfiles()
 
         self.__maskCA = self.__maskBB = self.__maskHeavy = None
+        self.__neighborGrid = None
         self.__validSource = 0
 
 
@@ -1080,66 +1096,14 @@ class PDBModel:
         :type  headlines: list of tuples 
         :param taillines: same as headlines but appended at the end of file
         :type  taillines: list of tuples 
+
+        .. seealso:: `biskit.core.pdbWriter.PDBWriter` for writing many sets
+                     of coordinates
         """
         try:
-            f = IO.PDBFile( fname, mode='w' )
-
-            numbers = list(map( str, list(range(10)) ))
-
-            if amber:
-                __resnames = copy.copy(self.atoms['residue_name'])
-                __anames   = copy.copy(self.atoms['name'])
-                self.xplor2amber()
-                ter = 3
-                wrap = 0
-                left = 1
-
-            if ter == 2 or ter == 3:
-                ## tolist to workaround numeric bug
-                terIndex = N0.array( self.chainIndex( breaks=(ter==3) ).tolist()[1:] )
-            if ter == 1:
-                terIndex = N0.nonzero( self.atoms['after_ter'] )
-
-            if headlines:
-                for l in headlines:
-                    f.writeLine( l[0], l[1] )
-
-            if taillines:
-                for l in taillines:
-                    f.writeLine( l[0], l[1] )
-
-            i = -1
-            for a in self.atoms.toDicts():
-                i += 1
-
-                ## fetch coordinates Vector
-                a['position'] = self.xyz[ i ]
-
-                aname = a['name']
-
-                if original and not amber:
-                    aname = a['name_original']
-
-                ## PDBFile prints atom names 1 column too far left
-                if wrap and len(aname) == 4 and aname[0] in numbers:
-                    aname = aname[1:] + aname[0]
-                if not left and len(aname) < 4:
-                    aname = ' ' + aname.strip()
-
-                a['name'] = aname
-
-                ## write line
-                f.writeLine( a['type'], a )
-
-                ## write TER line with details from previous atom
-                if (ter>0 and  i+1 in terIndex):
-                    f.writeLine('TER', a )
-
-            f.close()
-
-            if amber:
-                self.atoms['residue_name'] = __resnames
-                self.atoms['name'] = __anames
+            w = PDBWriter( self, ter=ter, amber=amber, original=original,
+                           left=left, wrap=wrap )
+            w.write( fname, headlines=headlines, taillines=taillines )
 
         except:
             EHandler.error( "Error writing "+fname )
@@ -1250,6 +1214,15 @@ class PDBModel:
         :return: array or list of indices where condition is met
         :rtype: list or array of int
         """
+        prof = self.atoms[ key ]
+
+        ## CategoricalList profiles only need to test each distinct value
+        if isinstance( prof, CategoricalList ):
+            if type( cond ) is types.FunctionType:
+                return prof.apply( cond )
+            if type( cond ) in [ list, tuple ]:
+                return prof.isin( cond )
+            return prof.isin( [ cond ] )
 
         if type( cond ) is types.FunctionType:
             return N0.array( list(map( cond, self.atoms[ key ] )) )
@@ -1566,7 +1539,7 @@ class PDBModel:
         index = N0.concatenate( (index, [len_i]) )
         delta = index[1:] - index[:-1] 
         ## Numeric: delta = N0.take( index, range(1, len(index) ) ) - index[:-1]
-        return N0.repeat( list(range(len(delta))), delta.astype( N0.Int32) )
+        return N0.repeat( N0.arange( len(delta) ), delta.astype( N0.Int32) )
 
 
     def map2index( self, imap ):
@@ -1818,6 +1791,120 @@ class PDBModel:
                                  self.lenAtoms() )[0]
 
 
+    def __segmentIndex( self, by, breaks=0 ):
+        """
+        :return: starting atom of each residue or chain
+        :rtype: array of int
+        :raise PDBError: if by is neither 'residue' nor 'chain'
+        """
+        if by == 'residue':
+            return N.asarray( self.resIndex(), int )
+        if by == 'chain':
+            return N.asarray( self.chainIndex( breaks=breaks ), int )
+        raise PDBError( 'unknown segment type %r' % by )
+
+
+    def reduceSegments( self, values, op='max', by='residue', mask=None,
+                        fill=0, axis=-1, breaks=0 ):
+        """
+        Reduce atom values to one value per residue (or chain), e.g. the
+        largest value of any atom in each residue. All residues are
+        handled in one go with ufunc.reduceat on the residue (chain)
+        starting positions. values can have more than one dimension, e.g.
+        frames x atoms::
+
+          m.reduceSegments( m['relAS'], 'mean' )  -> N_residues
+          m.reduceSegments( traj_profile, 'max' ) -> N_frames x N_residues
+
+        :param values: atom values, ... x N_atoms (along axis)
+        :type  values: array or [ any ]
+        :param op: 'max', 'min', 'sum', 'mean', 'any', 'all' or 'first'
+                   (default: 'max')
+        :type  op: str
+        :param by: 'residue' or 'chain' (default: 'residue')
+        :type  by: str
+        :param mask: consider only these atoms (default: None, all)
+        :type  mask: [ 1|0 ]
+        :param fill: value for segments without any atom in mask
+                     (default: 0)
+        :type  fill: any
+        :param axis: atom axis of values (default: -1)
+        :type  axis: int
+        :param breaks: split chains at chain breaks (by='chain' only)
+        :type  breaks: 1|0
+
+        :return: ... x N_residues (or N_chains) array
+        :rtype: array
+
+        :raise PDBError: if op or by is unknown or values do not match
+        """
+        if op not in self.REDUCTIONS and op not in ['mean', 'first']:
+            raise PDBError( 'unknown reduction %r' % op )
+
+        index = self.__segmentIndex( by, breaks=breaks )
+
+        v = N.moveaxis( N.asarray( values ), axis, -1 )
+        n = v.shape[-1]
+
+        if n != self.lenAtoms():
+            raise PDBError( 'reduceSegments: %i values for %i atoms' \
+                            % ( n, self.lenAtoms() ) )
+
+        if v.dtype == bool and op in ['sum', 'mean']:
+            v = v.astype( int )
+
+        present = None
+
+        if mask is None:
+            starts = index
+            counts = N.diff( N.append( index, n ) )
+        else:
+            mask = N.asarray( mask, bool )
+            v = v[..., mask]
+            smap = self.index2map( index, n )[ mask ]
+            present, starts, counts = N.unique( smap, return_index=True,
+                                                return_counts=True )
+
+        if len( starts ) == 0:
+            r = N.zeros( v.shape[:-1] + (0,), v.dtype )
+        elif op == 'first':
+            r = v[..., starts]
+        elif op == 'mean':
+            r = N.add.reduceat( v, starts, -1 ) / counts
+        else:
+            r = self.REDUCTIONS[ op ].reduceat( v, starts, -1 )
+
+        if present is not None:
+            result = N.full( v.shape[:-1] + ( len( index ), ), fill, r.dtype )
+            result[..., present] = r
+            r = result
+
+        return N.moveaxis( r, -1, axis )
+
+
+    def expandSegments( self, values, by='residue', axis=-1, breaks=0 ):
+        """
+        Expand residue (or chain) values to atom values, i.e. each atom
+        gets the value of its residue (inverse of reduceSegments).
+
+        :param values: residue values, ... x N_residues (along axis)
+        :type  values: array or [ any ]
+        :param by: 'residue' or 'chain' (default: 'residue')
+        :type  by: str
+        :param axis: residue axis of values (default: -1)
+        :type  axis: int
+        :param breaks: split chains at chain breaks (by='chain' only)
+        :type  breaks: 1|0
+
+        :return: ... x N_atoms array
+        :rtype: array
+        """
+        index = self.__segmentIndex( by, breaks=breaks )
+        counts = N.diff( N.append( index, self.lenAtoms() ) )
+
+        return N.repeat( N.asarray( values ), counts, axis )
+
+
     def res2atomProfile( self, p ):
         """
         Get an atom profile where each atom has the value its residue has
@@ -1833,16 +1920,10 @@ class PDBModel:
         if type( p ) is str:
             p = self.residues.get( p )
 
-        isArray = isinstance( p, N0.arraytype )
-
-        resMap = self.resMap()
-
-        r = [ p[ resMap[a] ] for a in range( len(resMap) ) ]
+        if isinstance( p, N0.arraytype ):
+            return self.expandSegments( p, axis=0 )
 
-        if isArray:
-            r = N0.array( r )
-
-        return r
+        return list( map( p.__getitem__, self.resMap().tolist() ) )
 
 
     def atom2resProfile( self, p, f=None ):
@@ -1855,7 +1936,11 @@ class PDBModel:
         :param f: function to calculate single residue from many atom values 
                   f( [atom_value1, atom_value2,...] ) -> res_value
                   (default None, simply take value of first atom in each res.)
-        :type  f: func
+                  OR name of a reduction ('max', 'mean', ..), see
+                  reduceSegments(); max, min, sum and the numpy
+                  max, min, sum, mean, average, any, all functions are
+                  translated into vectorized reductions for array profiles
+        :type  f: func OR str
 
         :return: [ any ] OR array, residue profile
         :rtype: list or array
@@ -1865,8 +1950,13 @@ class PDBModel:
 
         isArray = isinstance( p, N0.arraytype )
 
+        if isArray and f in self.__reductionFunctions:
+            f = self.__reductionFunctions[ f ]
+
         if not f:
             r = N0.take( p, self.resIndex() )
+        elif type( f ) is str:
+            r = self.reduceSegments( p, f, axis=0 )
         else:
             r = [ f( values ) for values in self.profile2resList( p ) ]
             r = N0.array( r )
@@ -2636,47 +2726,44 @@ class PDBModel:
         return N0.compress( mask, self.atoms['residue_number'] )
 
 
-    def __inferResIndex( self ):
-        """
-        Determine residue borders.
-
-        :return: starting position of each residue
-        :rtype:  list of int
+    def __changePoints( self, *profiles ):
         """
-        result = []
+        Find positions where any of the given profiles changes its value
+        compared to the previous atom. The first atom always counts as
+        change point.
 
-        if self.lenAtoms() == 0:
-            return N0.array( result, N0.Int )
+        :param profiles: atom profiles to compare
+        :type  profiles: list or array
 
-        lastResNumber = -100
-        lastResName   = ''
-        index = -1
-        lastAlt = 'x'
-        lastSegid = -1
+        :return: positions of change points
+        :rtype:  array of int
+        """
+        change = N.zeros( self.lenAtoms(), bool )
+        change[0] = True
 
-        res_nrs = self.atoms['residue_number']
-        res_nam = self.atoms['residue_name']
-        ins_cod = self.atoms['insertion_code']
-        seg_id  = self.atoms['segment_id']
+        for p in profiles:
+            p = N.asarray( p )
+            change[1:] |= p[1:] != p[:-1]
 
-        ## create residue numbering for selected atoms
-        for i in range( self.lenAtoms() ):
+        return N.flatnonzero( change ).astype( N0.Int )
 
-            if res_nrs[i] != lastResNumber or \
-               res_nam[i] != lastResName   or \
-               seg_id[i]  != lastSegid or \
-               ins_cod[i] != lastAlt:
 
-                ## start of new residue
-                lastResNumber = res_nrs[i]
-                lastResName   = res_nam[i]
-                lastAlt       = ins_cod[i]
-                lastSegid     = seg_id[i]
-                index += 1
+    def __inferResIndex( self ):
+        """
+        Determine residue borders. A new residue starts whenever residue
+        number, residue name, insertion code or segment id change between
+        two consecutive atoms.
 
-                result.append( i )
+        :return: starting position of each residue
+        :rtype:  list of int
+        """
+        if self.lenAtoms() == 0:
+            return N0.array( [], N0.Int )
 
-        return N0.array(result, N0.Int)        
+        return self.__changePoints( self.atoms['residue_number'],
+                                    self.atoms['residue_name'],
+                                    self.atoms['insertion_code'],
+                                    self.atoms['segment_id'] )
 
 
     def resIndex( self, mask=None, force=0, cache=1 ):
@@ -2742,35 +2829,29 @@ class PDBModel:
         return N0.concatenate( (r[1:], [self.lenAtoms()]) ) - 1 
 
     def __inferChainIndex( self ):
+        """
+        Determine chain borders. A new chain starts whenever chain id or
+        segment id change, the residue numbering decreases or an atom
+        follows a TER record.
 
-        result = []
-
+        :return: starting position of each chain
+        :rtype:  list of int
+        """
         if self.lenAtoms() == 0:
-            return N0.array( result, N0.Int )
-
-        lastResidue = -100
-        lastChainID = None
-        lastSegID = None
-
-        chn_ids = self.atoms['chain_id']
-        seg_ids = self.atoms['segment_id']
-        res_nrs = self.atoms['residue_number']
-        ter_atm = self.atoms['after_ter']
-
-        for i in self.atomRange():
+            return N0.array( [], N0.Int )
 
-            if chn_ids[i] != lastChainID or \
-               seg_ids[i] != lastSegID   or \
-               res_nrs[i] <  lastResidue or \
-               ter_atm[i]:
+        r = self.__changePoints( self.atoms['chain_id'],
+                                 self.atoms['segment_id'] )
 
-                result.append( i )
+        res_nrs = N.asarray( self.atoms['residue_number'] )
+        ter_atm = N.asarray( self.atoms['after_ter'] )
 
-            lastResidue = res_nrs[i]
-            lastChainID = chn_ids[i]
-            lastSegID   = seg_ids[i]
+        change = N.zeros( self.lenAtoms(), bool )
+        change[1:] = res_nrs[1:] < res_nrs[:-1]
+        change |= ter_atm.astype( bool )
+        change[ r ] = True
 
-        return N0.array( result, N0.Int )
+        return N.flatnonzero( change ).astype( N0.Int )
 
 
     def __filterSingleResChains( self, chainindex, ignore_resnumbers=0 ):
@@ -2999,6 +3080,76 @@ class PDBModel:
         return False
 
 
+    def neighborGrid( self, cutoff=6., force=0 ):
+        """
+        Get a cell-list index of the current coordinates for fast distance
+        searches. The index is cached and re-built whenever a new coordinate
+        array is assigned (setXyz, transform, take, etc.) or if the cached
+        index has a cell size that is not well suited for the given cutoff.
+        Use force=1 after modifying xyz in place.
+
+        :param cutoff: distance cutoff the index will be used for (def 6.)
+        :type  cutoff: float
+        :param force: re-build index even if a cached one is available (def 0)
+        :type  force: 1||0
+
+        :return: spatial index of the atom coordinates
+        :rtype: NeighborGrid
+        """
+        g = self.__neighborGrid
+
+        if force or g is None or g.xyz is not self.getXyz() or \
+           not ( cutoff / 2. <= g.cellsize <= cutoff * 2. ):
+
+            g = NeighborGrid( self.getXyz(), cellsize=cutoff )
+            self.__neighborGrid = g
+
+        return g
+
+
+    def neighbors( self, i, cutoff ):
+        """
+        Get all atoms closer than cutoff to the atom with index i.
+
+        :param i: atom index
+        :type  i: int
+        :param cutoff: distance cutoff in Angstrom
+        :type  cutoff: float
+
+        :return: indices of neighboring atoms (excluding i), sorted
+        :rtype: array of int
+        """
+        r = self.neighborGrid( cutoff ).neighbors( self.getXyz()[i], cutoff )
+        return r[ r != i ]
+
+
+    def pairsWithin( self, other, cutoff=None ):
+        """
+        Get all pairs of atoms closer than cutoff::
+
+          pairsWithin( cutoff ) -> i, j   ## within this model, i < j
+          pairsWithin( other, cutoff ) -> i, j  ## i in this, j in other
+
+        Only atoms in neighboring cells of a cached spatial grid are
+        compared, no dense distance matrix is created.
+
+        :param other: second model (or coordinates) OR cutoff
+        :type  other: PDBModel OR array OR float
+        :param cutoff: distance cutoff in Angstrom
+        :type  cutoff: float
+
+        :return: atom indices i and j of all close pairs, sorted by i
+        :rtype: (array of int, array of int)
+        """
+        if cutoff is None:
+            return self.neighborGrid( other ).pairs( other )
+
+        if isinstance( other, PDBModel ):
+            other = other.getXyz()
+
+        return self.neighborGrid( cutoff ).pairsWith( other, cutoff )
+
+
     def rms( self, other, mask=None, mask_fit=None, fit=1, n_it=1 ):
         """
         Rmsd between two PDBModels.
@@ -3315,20 +3466,10 @@ class PDBModel:
             mask = N0.ones( len(atomValues) )
 
         ## eliminate all values that do not belong to the selected atoms
-        masked = atomValues * mask
-
-        result = []
+        masked = N.asarray( atomValues ) * mask
 
         ## set all atoms of each residue to uniform value
-        for res in range( 0, self.lenResidues() ):
-
-            ## get atom entries for this residue
-            resAtoms = N0.compress( N0.equal( self.resMap(), res ), masked )
-
-            ## get maximum value
-            masterValue = max( resAtoms )
-
-            result += resAtoms * 0.0 + masterValue
+        result = self.expandSegments( self.reduceSegments( masked, 'max' ) )
 
         return N0.array( result, N0.Float32 )
 
@@ -3905,6 +4046,94 @@ class Test(BT.BiskitTest):
         self.assertAlmostEqual( N0.sum( m2.centerOfMass() ),  23.1032009125,2)
 
 
+    def test_inferIndex(self):
+        """PDBModel residue and chain boundary detection test"""
+        m = B.PDBModel()
+        m.xyz = N0.zeros( (8, 3), N0.Float32 )
+        m['residue_number'] = [ 1, 1, 1, 2, 2, 1, 1, 1 ]
+        m['residue_name'] = [ 'ALA','ALA','ALA','GLY','GLY','GLY','GLY','HOH']
+        m['insertion_code'] = [ '', '', 'A', '', '', '', '', '' ]
+        m['segment_id'] = [ 'A' ] * 8
+        m['chain_id'] = [ 'A' ] * 7 + [ 'W' ]
+        m['after_ter'] = [ 0, 0, 0, 0, 0, 0, 1, 0 ]
+
+        self.assertEqual( m.resIndex().tolist(), [0, 2, 3, 5, 7] )
+        self.assertEqual( m.chainIndex( singleRes=1 ).tolist(), [0, 5, 6, 7] )
+        self.assertEqual( m.resMap().tolist(), [0, 0, 1, 2, 2, 3, 3, 4] )
+
+    def test_neighbors(self):
+        """PDBModel neighbors and pairsWithin test"""
+        m = self.m.compress( self.m.maskProtein() )
+        lig = m.takeChains( [1] )
+
+        d = mathUtils.pairwiseDistances( m.xyz, lig.xyz )
+        i, j = m.pairsWithin( lig, 4.5 )
+        ref_i, ref_j = N.nonzero( d < 4.5 )
+        self.assertTrue( N.all( i == ref_i ) and N.all( j == ref_j ) )
+
+        i, j = lig.pairsWithin( 3.5 )
+        d = mathUtils.pairwiseDistances( lig.xyz, lig.xyz )
+        self.assertEqual( len( i ), N.sum( N.triu( d < 3.5, 1 ) ) )
+
+        self.assertTrue( lig.neighborGrid( 3.5 ) is lig.neighborGrid( 3.5 ) )
+        nb = lig.neighbors( 0, 3.5 )
+        self.assertEqual( nb.tolist(), N.flatnonzero( d[0] < 3.5 )[1:].tolist() )
+
+    def test_categorize(self):
+        """PDBModel with CategoricalList atom profiles test"""
+        import pickle
+        m = self.m.clone()
+        m.atoms.categorize()
+
+        self.assertTrue( isinstance( m['name'], CategoricalList ) )
+        self.assertEqual( m['residue_name'], self.m['residue_name'] )
+
+        for cond in [ 'CA', ['CA', 'CB'], lambda a: a[0] == 'H' ]:
+            self.assertTrue( N.all( m.maskFrom( 'name', cond ) ==
+                                    self.m.maskFrom( 'name', cond ) ) )
+
+        mask = m.maskProtein()
+        c = m.compress( mask ).concat( m.take( [0, 1, 2] ) )
+        ref = self.m.compress( mask ).concat( self.m.take( [0, 1, 2] ) )
+
+        self.assertTrue( isinstance( c['chain_id'], CategoricalList ) )
+        self.assertEqual( c['chain_id'], ref['chain_id'] )
+        self.assertEqual( c.sequence(), ref.sequence() )
+
+        m = pickle.loads( pickle.dumps( m ) )
+        self.assertEqual( m['name'], self.m['name'] )
+
+    def test_reduceSegments(self):
+        """PDBModel.reduceSegments / expandSegments test"""
+        m = self.m
+        v = N.arange( m.lenAtoms(), dtype=float )
+        ri = m.resIndex()
+        last = N.append( ri[1:], m.lenAtoms() ) - 1
+
+        self.assertTrue( N.all( m.reduceSegments( v, 'max' ) == last ) )
+        self.assertTrue( N.all( m.reduceSegments( v, 'first' ) == ri ) )
+        self.assertTrue( N.all( m.reduceSegments( v, 'mean' ) ==
+                                ( ri + last ) / 2. ) )
+        self.assertTrue( N.all( m.reduceSegments( m.maskCA(), 'sum' ) <= 1 ) )
+
+        ## frames x atoms, masked, per chain
+        x = N.array( [ v, -v ] )
+        mask = m.maskCA()
+        r = m.reduceSegments( x, 'min', by='chain', mask=mask, fill=-1 )
+        self.assertEqual( r.shape, ( 2, m.lenChains() ) )
+        last_ca = N.flatnonzero( mask * ( m.chainMap() == 0 ) )[-1]
+        self.assertEqual( r[1, 0], -last_ca )
+
+        self.assertTrue( N.all( m.expandSegments( m.reduceSegments( v ) )[ri]
+                                == last ) )
+
+        ## vectorized and plain python versions of atom2resProfile
+        self.assertTrue( N.allclose( m.atom2resProfile( v, N.average ),
+                                     m.atom2resProfile( v, lambda x:
+                                                        N.average( x ) ) ) )
+        self.assertEqual( m.res2atomProfile( list( range( len( ri ) ) ) ),
+                          m.resMap().tolist() )
+
     def test_chainBreaks(self):
         """PDBModel chain break handling and writing test"""
         self.m4 = B.PDBModel( T.testRoot()+'/com/1BGS_original.pdb')
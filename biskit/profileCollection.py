@@ -31,6 +31,7 @@ import biskit.tools as T
 import biskit.mathUtils as M
 from biskit import EHandler
 from biskit.hist import density
+from biskit.core.categoricalList import CategoricalList
 
 
 import copy
@@ -239,6 +240,13 @@ class ProfileCollection:
     we have now replaced Numeric by numpy, we can probably switch to the
     exclusive use of numpy arrays.)
 
+    Lists of str with many repeated values (atom or residue names, chain
+    ids, elements) can optionally be stored as :class:`CategoricalList`
+    (option asarray=3 of set(), or categorize() for existing profiles).
+    CategoricalList behaves like a list but only keeps integer codes and
+    one copy of each distinct value, so that take(), compress() and concat()
+    are vectorized and need much less memory.
+
     Acessing profiles
     =================
 
@@ -574,8 +582,9 @@ class ProfileCollection:
 
         :param prof: profile
         :type  prof: list OR array
-        :param asarray: 1.. autodetect type, 0.. force list, 2.. force array
-        :type  asarray: 2|1|0
+        :param asarray: 1.. autodetect type, 0.. force list, 2.. force array,
+                        3.. force CategoricalList
+        :type  asarray: 3|2|1|0
         
         :return: profile
         :rtype: list OR array
@@ -590,6 +599,9 @@ class ProfileCollection:
                 if isinstance( prof, N.ndarray ):
                     return self.__picklesave_array( prof )
 
+                if isinstance( prof, CategoricalList ):
+                    return prof
+
                 if type( prof ) is str:  # tolerate strings as profiles
                     return list( prof )
     
@@ -617,6 +629,13 @@ class ProfileCollection:
                 
                 return self.__picklesave_array( N.array( prof ) )
 
+            ## force categorical list
+            if asarray == 3:
+                if isinstance( prof, CategoricalList ):
+                    return prof
+
+                return CategoricalList( prof )
+
         except TypeError as why:
             ## Numeric bug: N.array(['','','']) raises TypeError
             if asarray == 1 or asarray == 0:
@@ -651,6 +670,12 @@ class ProfileCollection:
                 N.put( p, N.nonzero( mask )[0], prof )
                 return p
 
+            if isinstance( prof, CategoricalList ):
+                codes = N.zeros( len( mask ), prof.CODE_TYPE )
+                codes[:] = prof.code( default )
+                codes[ N.flatnonzero( mask ) ] = prof.codes
+                return CategoricalList.fromCodes( codes, prof.vocabulary )
+
             p = [ default ] * len( mask )
             prof.reverse()
             for i in N.nonzero( mask )[0]:
@@ -679,9 +704,10 @@ class ProfileCollection:
         :param default: value for items masked.
                         (default: None for lists, 0 for arrays]
         :type  default: any
-        :param asarray: store as list (0), as array (2) or store numbers as
-                        array but everything else as list (1) (default: 1)
-        :type  asarray: 0|1|2
+        :param asarray: store as list (0), as array (2), as CategoricalList (3)
+                        or store numbers as array but everything else as
+                        list (1) (default: 1)
+        :type  asarray: 0|1|2|3
         :param comment: goes into info[name]['comment']
         :type  comment: str
         :param moreInfo: additional key-value pairs for info[name]
@@ -868,6 +894,8 @@ class ProfileCollection:
 
                 if isinstance( prof, N.ndarray ):
                     result.set( key, N.take( prof, indices ) )
+                elif isinstance( prof, CategoricalList ):
+                    result.set( key, prof.take( indices ) )
                 else:
                     result.set( key, [ prof[i] for i in indices ], asarray=0 )
 
@@ -921,6 +949,9 @@ class ProfileCollection:
         array mirroring shape and type of <a> but with length <length>
         and filled with default value
         """
+        if isinstance(a, CategoricalList):
+            return CategoricalList.fromCodes(N.zeros(length, int), [default])
+        
         x = a if isinstance(a, N.ndarray) else N.array(a)
         s = list(x.shape)
         s[0] = length
@@ -1006,6 +1037,41 @@ class ProfileCollection:
         return r.concat( *profiles[1:] )
 
 
+    def categorize( self, *keys ):
+        """
+        Convert list profiles into :class:`CategoricalList` profiles (in
+        place). By default, all list profiles which only contain str (or
+        None) values are converted. CategoricalLists behave like lists
+        but need less memory and are extracted and concatenated faster.
+        Info records (including the 'changed' flag) are not modified.
+
+        :param keys: profile names (default: all profiles of str)
+        :type  keys: str
+        """
+        for k in keys or list( self.keys() ):
+            prof = self.profiles[ k ]
+
+            if not isinstance( prof, list ):
+                continue
+
+            if keys or all( [ isinstance( x, str ) or x is None
+                              for x in prof ] ):
+                self.profiles[ k ] = CategoricalList( prof )
+
+
+    def uncategorize( self, *keys ):
+        """
+        Convert :class:`CategoricalList` profiles back into normal lists (in
+        place).
+
+        :param keys: profile names (default: all CategoricalList profiles)
+        :type  keys: str
+        """
+        for k in keys or list( self.keys() ):
+            if isinstance( self.profiles[ k ], CategoricalList ):
+                self.profiles[ k ] = self.profiles[ k ].tolist()
+
+
     def update( self, other, stickyChanged=1, mask=None ):
         """
         Merge other ProfileCollection into this one, replacing existing
@@ -1388,6 +1454,32 @@ class Test(BT.BiskitTest):
                       [0, 2, 4, 6, 8, 0, 2, 4, 6, 8, 0, 2, 4, 6, 8]))
     
 
+    def test_categorical(self):
+        """ProfileCollection with CategoricalList profiles test"""
+        names = [ 'CA', 'CB', 'N', 'CA', 'O' ]
+
+        self.p = ProfileCollection()
+        self.p.set( 'name', names )
+        self.p.set( 'element', [ n[0] for n in names ], asarray=3 )
+        self.p.set( 'mass', N.arange( 5 ) )
+
+        self.assertTrue( isinstance( self.p['element'], CategoricalList ) )
+
+        self.p.categorize()
+        self.assertTrue( isinstance( self.p['name'], CategoricalList ) )
+        self.assertTrue( isinstance( self.p['mass'], N.ndarray ) )
+
+        self.p2 = ProfileCollection()
+        self.p2.set( 'name', [ 'X', 'Y' ] )
+        self.p2.set( 'mass', N.arange( 2 ) )
+
+        self.r = self.p.compress( [1,0,1,0,1] ).concat( self.p2 )
+        self.assertEqual( self.r['name'], [ 'CA', 'N', 'O', 'X', 'Y' ] )
+        self.assertEqual( self.r['element'], [ 'C', 'N', 'O', None, None ] )
+
+        self.p.uncategorize()
+        self.assertEqual( type( self.p['name'] ), list )
+
     def test_concat(self):
         """ProfileCollection.concat test"""
         import string
@@ -24,10 +24,12 @@ the same atom contents.
 from biskit import ColorSpectrum as CS
 from biskit import PDBDope, EHandler 
 from biskit.matrixPlot import Legend
+from biskit.torsions import Torsions, dihedral
 
 import biskit.tools as T
 
 import biskit.core.oldnumeric as N0
+import numpy as N
 
 try:
     import biggles
@@ -40,7 +42,8 @@ class Ramachandran:
     def __init__( self, models, name=None, profileName='relAS', verbose=1 ):
         """
         @param models: List of models display a Ramachandran plot for
-        @type  models: [ PDBModel ] OR PDBModel
+                       OR trajectory (all frames are displayed)
+        @type  models: [ PDBModel ] OR PDBModel OR Trajectory
         @param name: model name, will show up in plot
         @type  name: str
         @param profileName: name of profile to use for coloring
@@ -52,6 +55,9 @@ class Ramachandran:
         if not biggles:
             raise ImportError('biggles module could not be imported.')
 
+        if hasattr( models, 'frames' ):
+            models = self.trajModels( models )
+
         if type(models) != type([]):
             models = [ models ]
 
@@ -76,6 +82,35 @@ class Ramachandran:
         self.pro = N0.ravel(self.pro)
 
 
+    def trajModels( self, traj ):
+        """
+        Models for all frames of a trajectory. The torsion angles of all
+        frames are calculated in one go (or taken from existing 'phi' and
+        'psi' trajectory profiles) and attached as residue profiles.
+
+        @param traj: Trajectory
+        @type  traj: Trajectory
+
+        @return: one model per frame
+        @rtype: [ PDBModel ]
+        """
+        if not ( 'phi' in traj.profiles and 'psi' in traj.profiles ):
+            Torsions( traj.ref ).addTrajProfiles( traj, ['phi', 'psi'] )
+
+        phi = traj.profile( 'phi' )
+        psi = traj.profile( 'psi' )
+
+        r = []
+        for i in range( traj.lenFrames() ):
+            m = traj.ref.clone()
+            m.xyz = traj.frames[i]
+            m.residues.set( 'phi', phi[i], unit='degree' )
+            m.residues.set( 'psi', psi[i], unit='degree' )
+            r.append( m )
+
+        return r
+
+
     def calc( self, models ):
         """
         Calculate angles, profiles and other things needed.
@@ -156,35 +191,24 @@ class Ramachandran:
           psi - rotation about CA-C
               - first position in a chain = None          
 
+        Existing 'phi' and 'psi' residue profiles are used if available,
+        otherwise all angles are calculated in one go (see L{Torsions}).
+        Note: for historic reasons, self.phi holds the N-CA-C-N(next)
+        torsion (IUPAC psi) and self.psi the C(previous)-N-CA-C torsion
+        (IUPAC phi), which is what show() plots on the x-axis.
+
         @param model: PDBModel
         @type  model: PDBModel 
         """
-        for c in range( model.lenChains(breaks=1) ):
-            cModel = model.takeChains( [c], breaks=1 )
-
-            xyz = cModel.xyz
-
-            xyz_CA =  N0.compress( cModel.maskCA(), xyz, 0 )
-            xyz_N  =  N0.compress( cModel.mask( ['N'] ), xyz, 0 )
-            xyz_C  =  N0.compress( cModel.mask( ['C'] ), xyz, 0 )
-
-            ## phi: c1 - N
-            ##      c2 - CA
-            ##      c3 - C
-            ##      c4 - N of next residue
-            for i in range( len(xyz_N)-1 ):
-                self.phi += [self.dihedral( xyz_N[i], xyz_CA[i],
-                                            xyz_C[i], xyz_N[i+1] )]
-            self.phi += [None]
-
-            ## psi: c1 - C of previous residue  
-            ##      c2 - N
-            ##      c3 - CA
-            ##      c4 - C
-            self.psi += [None]
-            for i in range( 1, len(xyz_N) ):
-                self.psi += [self.dihedral( xyz_C[i-1], xyz_N[i],
-                                            xyz_CA[i], xyz_C[i] )]
+        if 'phi' in model.residues and 'psi' in model.residues:
+            r = { 'phi': model['phi'], 'psi': model['psi'] }
+        else:
+            r = Torsions( model ).calc( model.xyz, ['phi', 'psi'] )
+
+        tolist = lambda a: [ None if N.isnan( x ) else x for x in a.tolist() ]
+
+        self.phi += tolist( N.asarray( r['psi'], float ) )
+        self.psi += tolist( N.asarray( r['phi'], float ) )
 
 
     def dihedral( self, coor1, coor2, coor3, coor4 ):
@@ -202,30 +226,7 @@ class Ramachandran:
         @param coor4: coordinates
         @type  coor4: [float]        
         """
-        vec21 = coor2 - coor1
-        vec32 = coor3 - coor2
-        L = N0.cross( vec21, vec32 )
-        L_norm = N0.sqrt(sum(L**2))
-
-        vec43 = coor4 - coor3
-        vec23 = coor2 - coor3
-        R = N0.cross( vec43, vec23 )
-        R_norm = N0.sqrt(sum(R**2))
-
-        S     = N0.cross( L, R )
-        angle = sum( L*R ) / ( L_norm * R_norm )
-
-        ## sometimes the value turns out to be ever so little greater than 
-        ## one, to prevent N0.arccos errors for this, set angle = 1.0
-        if angle >  1.0: angle = 1.0
-            
-        if angle < -1.0: angle = -1.0
-
-        angle = N0.arccos(angle) *180/N0.pi
-        if sum(S*vec32) < 0.0:
-            angle = -angle
-
-        return angle
+        return dihedral( coor1, coor2, coor3, coor4 )
 
     
     def ramachandran( self ):
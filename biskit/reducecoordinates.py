@@ -25,6 +25,9 @@
 Create structures with reduced number of atoms.
 """
 
+import numpy as N
+import scipy.sparse as sparse
+
 from biskit import PDBModel, DictList
 from biskit.core import oldnumeric as N0
 from biskit import tools as T
@@ -59,7 +62,14 @@ class ReduceCoordinates:
       >>> frames = reducer.reduceXyz( traj.frames )
       >>> traj_red = Trajectory( ref=red_ref )
       >>> traj_red.frames = frames
+
+    The reduction is a single product with the mass-weighted projection
+    matrix L{ proj } (N_centers x N_atoms) which is created by L{ makeMap }.
+    Memory-mapped trajectories are reduced in chunks of L{ CHUNK } frames.
     """
+    #: number of frames reduced at once from memory-mapped trajectories
+    CHUNK = 2000
+
     ## modify order of TYR/PHE ring atoms to move centers away from ring axis
     aaAtoms = MU.aaAtoms
     aaAtoms['TYR'] = ['N','CA','C','O','CB','CG','CD1','CE1','CD2',
@@ -67,7 +77,7 @@ class ReduceCoordinates:
     aaAtoms['PHE'] = ['N','CA','C','O','CB','CG','CD1','CE1','CD2',
                       'CE2','CZ', 'OXT']
 
-    def __init__( self, model,  maxPerCenter=4 ):
+    def __init__( self, model,  maxPerCenter=4, dense=False ):
         """
         Prepare reduction of coordinates from a given model.
         
@@ -76,6 +86,9 @@ class ReduceCoordinates:
         @param maxPerCenter: max number of atoms per side chain center atom
                              (default: 4)
         @type  maxPerCenter: int
+        @param dense: use dense instead of sparse projection matrix
+                      (default: False)
+        @type  dense: bool
         """
         self.m = model
         self.__addMassProfile( self.m )
@@ -114,7 +127,7 @@ class ReduceCoordinates:
         maskH = self.m_sorted.remove( self.m_sorted.maskH() )
         self.a_indices = N0.compress( maskH, self.a_indices )
 
-        self.makeMap( maxPerCenter )
+        self.makeMap( maxPerCenter, dense=dense )
 
 
     def __addMassProfile( self, model ):
@@ -203,15 +216,20 @@ class ReduceCoordinates:
         a['serial_number'] = self.currentAtom
         return a
 
-    def makeMap( self, maxPerCenter=4 ):
+    def makeMap( self, maxPerCenter=4, dense=False ):
         """
         Calculate mapping between complete and reduced atom list.
         Creates a (list of lists of int, list of atom dictionaries)
         containing groups of atom indices into original model, new center atoms
+        and the projection matrices L{ proj } (mass-weighted) and L{ avg }
+        (plain average) of shape N_centers x N_atoms.
         
         @param maxPerCenter: max number of atoms per side chain center atom
                              (default: 4)
         @type  maxPerCenter: int
+        @param dense: create dense numpy arrays instead of sparse (CSR)
+                      matrices (default: False)
+        @type  dense: bool
         """
 
         resIndex = self.m_sorted.resIndex()
@@ -267,45 +285,97 @@ class ReduceCoordinates:
         self.groups = groups
         self.atoms = atoms
 
+        self.proj, self.avg = self.__projections( dense )
+
 
-    def reduceXyz( self, xyz, axis=0 ):
+    def __projections( self, dense=False ):
+        """
+        Create projection matrices from the atom groups.
+
+        @param dense: return numpy arrays instead of CSR matrices
+        @type  dense: bool
+
+        @return: mass-weighted and plain averaging matrix,
+                 each N_centers x N_atoms
+        @rtype: (scipy.sparse.csr_matrix, scipy.sparse.csr_matrix)
+        """
+        n = N.array( [ len( g ) for g in self.groups ] )
+        cols = N.concatenate( self.groups ).astype( int )
+        rows = N.repeat( N.arange( len( self.groups ) ), n )
+
+        masses = N.asarray( self.m.atoms.get('mass'), float )[ cols ]
+        total = N.bincount( rows, masses, minlength=len( n ) )
+
+        shape = ( len( self.groups ), len( self.m ) )
+        r = []
+        for w in ( masses / total[ rows ], 1. / n[ rows ] ):
+            if dense:
+                p = N.zeros( shape )
+                p[ rows, cols ] = w
+            else:
+                p = sparse.csr_matrix( ( w, ( rows, cols ) ), shape=shape )
+            r.append( p )
+
+        return tuple( r )
+
+
+    def __project( self, p, x ):
+        """
+        Apply projection matrix to the atom axis of an array.
+
+        @param p: projection matrix (N_centers x N_atoms)
+        @type  p: array OR scipy.sparse matrix
+        @param x: values (N_atoms x ...) 
+        @type  x: array
+
+        @return: values (N_centers x ...)
+        @rtype: array
+        """
+        x = N.asarray( x )
+        r = p.dot( x.reshape( len( x ), -1 ) )
+        return N.asarray( r ).reshape( (p.shape[0],) + x.shape[1:] )
+
+
+    def reduceXyz( self, xyz, axis=None, chunk=None ):
         """
         Reduce the number of atoms in the given coordinate set. The set must
         have the same length and order as the reference model. It may have
         an additional (time) dimension as first axis.
+
+        Frames are reduced in blocks of chunk frames so that large or
+        memory-mapped trajectories are never loaded completely.
         
         @param xyz: coordinates (N_atoms x 3) or (N_frames x N_atoms x 3)
         @type  xyz: array
-        @param axis: axis with atoms (default: 0)
+        @param axis: axis with atoms (default: None, 0 for a single set of
+                     coordinates, 1 for frames)
         @type  axis: int
+        @param chunk: number of frames reduced at once (default: None, all
+                      frames or L{ CHUNK } frames for memory-mapped arrays)
+        @type  chunk: int
         
         @return: coordinate array (N_less_atoms x 3) or
                  (N_frames x N_less_atoms x 3)
         @rtype: array
         """
-        masses = self.m.atoms.get('mass')
-        r_xyz = None
-
-        for atom_indices in self.groups:
-
-            x = N0.take( xyz, atom_indices, axis )
-            m = N0.take( masses, atom_indices )
+        if axis is None:
+            axis = N.ndim( xyz ) - 2
 
-            center = N0.sum( x * N0.transpose([m,]), axis=axis) / N0.sum( m )
+        if axis == 0:
+            return self.__project( self.proj, xyz )
 
-            if axis == 0:
-                center = center[N0.NewAxis, :]
+        if chunk is None:
+            chunk = self.CHUNK if isinstance( xyz, N.memmap ) else len( xyz )
+        chunk = max( 1, chunk )
 
-            if axis == 1:
-                center = center[:, N0.NewAxis, :]
+        r = N.empty( ( len( xyz ), self.proj.shape[0], 3 ) )
 
-            if r_xyz is None:
-                r_xyz = center
+        for start in range( 0, len( xyz ), chunk ):
+            x = N.asarray( xyz[ start : start+chunk ] )
+            x = self.__project( self.proj, x.transpose( 1, 0, 2 ) )
+            r[ start : start+chunk ] = x.transpose( 1, 0, 2 )
 
-            else:
-                r_xyz = N0.concatenate( (r_xyz, center), axis )
-
-        return r_xyz
+        return r
 
 
     def reduceToModel( self, xyz=None, reduce_profiles=1  ):
@@ -361,7 +431,7 @@ class ReduceCoordinates:
             info = from_model.profileInfo( profname )
 
             try:
-                pr = [ N0.average( N0.take( p0, group ) ) for group in self.groups ]
+                pr = self.__project( self.avg, N.asarray( p0, float ) )
 
                 to_model.atoms.set( profname, pr )
             except:
@@ -397,6 +467,35 @@ class Test(BT.BiskitTest):
 
         self.assertEqual( self.mred.lenAtoms(), 445 )
 
+    def test_reduceXyz(self):
+        """ReduceCoordinates projection vs. per-group reduction test"""
+        self.m = PDBModel( T.testRoot()+'/com/1BGS.pdb' )
+        self.m = self.m.compress( N0.logical_not( self.m.maskH2O() ) )
+
+        self.red = ReduceCoordinates( self.m, 4 )
+        self.dense = ReduceCoordinates( self.m, 4, dense=True )
+
+        xyz = self.m.getXyz()
+        mass = self.m['mass']
+        ref = N.array( [ N.average( xyz[g], axis=0, weights=mass[g] )
+                         for g in self.red.groups ] )
+
+        self.assertTrue( N.allclose( self.red.reduceXyz( xyz ), ref ) )
+        self.assertTrue( N.allclose( self.dense.reduceXyz( xyz ), ref ) )
+
+        frames = N.array( [ xyz, xyz + 1, xyz * 2 ] )
+        r = self.red.reduceXyz( frames, chunk=2 )
+        self.assertEqual( r.shape, ( 3, len( ref ), 3 ) )
+        self.assertTrue( N.allclose( r[1], ref + 1 ) )
+        self.assertTrue( N.allclose( r[2], ref * 2 ) )
+        self.assertTrue( N.allclose( self.dense.reduceXyz( frames, axis=1 ),
+                                     r ) )
+
+        bfactor = self.red.reduceToModel()['temperature_factor']
+        self.assertTrue( N.allclose( bfactor, [
+            N.average( self.m['temperature_factor'][g] )
+            for g in self.red.groups ] ) )
+
 if __name__ == '__main__':
 
     BT.localTest()
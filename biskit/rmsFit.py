@@ -21,6 +21,9 @@
 superimpose 2 structures iteratively
 """
 
+import numpy as N
+import time, tempfile
+
 from . import mathUtils as MU
 from biskit.core import oldnumeric as N0
 from numpy.linalg import svd
@@ -138,6 +141,573 @@ def match(x, y, n_iterations=1, z=2, eps_rmsd=0.5, eps_stdv=0.05):
     return (r, t), iter_trace
 
 
+def findTransformations( x, y, mask=None ):
+    """
+    Match many sets of coordinates onto the same reference in one go
+    (batched version of L{findTransformation}). All correlation matrices
+    are calculated with one broadcast matrix product and decomposed by one
+    stacked SVD.
+    Rotations that would result in a reflection are corrected.
+
+    :param x: reference coordinates, N x 3
+    :type  x: array('f')
+    :param y: coordinate frames, F x N x 3
+    :type  y: array('f')
+    :param mask: atoms to consider for each frame, F x N or N (default: all)
+    :type  mask: array of 1|0
+
+    :return: rotation matrices (F x 3 x 3) and translation vectors (F x 3)
+    :rtype:  array, array
+    """
+    x = N.asarray( x, N.float64 )
+    y = N.asarray( y, N.float64 )
+
+    if mask is None:
+        w = N.ones( y.shape[:2] )
+    else:
+        w = N.broadcast_to( N.asarray( mask, N.float64 ), y.shape[:2] )
+
+    n = N.sum( w, 1 )[:, N.newaxis]
+
+    ## weighted centers of each frame and of the reference
+    x_av = N.dot( w, x ) / n
+    y_av = N.einsum( 'fi,fij->fj', w, y ) / n
+
+    ## correlation matrices of centered coordinates, F x 3 x 3
+    c = N.matmul( N.transpose( x ), y * w[:, :, N.newaxis] ) \
+        - n[:, :, N.newaxis] * x_av[:, :, N.newaxis] * y_av[:, N.newaxis, :]
+
+    r = _rotations( c )
+    t = x_av - N.einsum( 'fij,fj->fi', r, y_av )
+
+    return r, t
+
+
+def _rotations( c ):
+    """
+    Optimal rotations from a stack of correlation matrices (one stacked
+    SVD). Rotations that would result in a reflection are corrected.
+
+    :param c: correlation matrices, ... x 3 x 3
+    :type  c: array
+
+    :return: rotation matrices, ... x 3 x 3
+    :rtype: array
+    """
+    v, l, u = N.linalg.svd( c )
+
+    ## correct improper rotations (reflections)
+    d = N.where( N.linalg.det( N.matmul( v, u ) ) < 0, -1., 1. )
+    v[..., -1] *= d[..., N.newaxis]
+
+    return N.matmul( v, u )
+
+
+def findSegmentTransformations( x, y, starts ):
+    """
+    Match consecutive segments of atoms (e.g. residues) separately onto the
+    same segments of a reference structure -- for all frames and segments
+    in one go. Correlation matrices are summed up segment-wise with
+    add.reduceat; rotations are calculated with L{qcpRotations}.
+
+    :param x: reference coordinates, N x 3
+    :type  x: array('f')
+    :param y: coordinate frames, F x N x 3
+    :type  y: array('f')
+    :param starts: index of the first atom of each segment, ascending, no
+                   empty segments
+    :type  starts: array of int
+
+    :return: rotation matrices (F x S x 3 x 3) and translation vectors
+             (F x S x 3), S = number of segments
+    :rtype:  array, array
+    """
+    x = N.asarray( x, N.float64 )
+    y = N.asarray( y, N.float64 )
+    starts = N.asarray( starts, int )
+
+    n = N.diff( N.append( starts, len( x ) ) ).astype( N.float64 )
+
+    x_av = N.add.reduceat( x, starts, 0 ) / n[:, N.newaxis]
+    y_av = N.add.reduceat( y, starts, 1 ) / n[:, N.newaxis]
+
+    ## correlation matrices of centered coordinates, F x S x 3 x 3
+    c = N.empty( y_av.shape + (3,) )
+    for i in range( 3 ):
+        c[:, :, i] = N.add.reduceat( x[:, i, N.newaxis] * y, starts, 1 )
+
+    c -= n[:, N.newaxis, N.newaxis] * x_av[:, :, N.newaxis] \
+         * y_av[:, :, N.newaxis, :]
+
+    ## squared norms of centered coordinates
+    g = N.add.reduceat( N.sum( x**2, 1 ), starts ) - n * N.sum( x_av**2, 1 ) \
+        + N.add.reduceat( N.sum( y**2, 2 ), starts, 1 ) \
+        - n * N.sum( y_av**2, 2 )
+
+    r = qcpRotations( c, g )
+    t = x_av - N.einsum( 'fsij,fsj->fsi', r, y_av )
+
+    return r, t
+
+
+def applyTransformations( y, r, t ):
+    """
+    Apply one rotation and translation to each frame of a coordinate array.
+
+    :param y: coordinate frames, F x N x 3
+    :type  y: array('f')
+    :param r: rotation matrices, F x 3 x 3
+    :type  r: array
+    :param t: translation vectors, F x 3
+    :type  t: array
+
+    :return: transformed coordinates, F x N x 3
+    :rtype: array
+    """
+    y = N.asarray( y )
+
+    ## matmul is only fast if both arrays have the same type
+    dtype = N.result_type( y.dtype, N.float32 )
+    r = N.asarray( r, dtype )
+    t = N.asarray( t, dtype )
+
+    return N.matmul( y, N.transpose( r, (0, 2, 1) ) ) + t[:, N.newaxis, :]
+
+
+def matchAll( x, y, n_iterations=1, z=2, eps_rmsd=0.5, eps_stdv=0.05 ):
+    """
+    Batched version of L{match}: match all frames of y onto x, while
+    iteratively removing outliers from each frame. Frames that have
+    converged are dropped from further iterations.
+
+    :param x: reference coordinates, N x 3
+    :type  x: array('f')
+    :param y: coordinate frames, F x N x 3
+    :type  y: array('f')
+    :param n_iterations: number of calculations::
+                           1 .. no iteration 
+                           0 .. until convergence
+    :type  n_iterations: 1|0
+    :param z: number of standard deviations for outlier definition (default: 2)
+    :type  z: float
+    :param eps_rmsd: tolerance in rmsd (default: 0.5)
+    :type  eps_rmsd: float
+    :param eps_stdv: tolerance in standard deviations (default: 0.05)
+    :type  eps_stdv: float
+
+    :return: (r, t), (fraction_considered, rmsd, n_iterations) -- rotations
+             (F x 3 x 3), translations (F x 3) and for each frame the
+             fraction of atoms considered, rmsd and number of iterations
+             performed in the last iteration
+    :rtype: (array, array), (array, array, array)
+    """
+    x = N.asarray( x, N.float64 )
+    y = N.asarray( y, N.float64 )
+
+    n_frames, n_atoms = y.shape[:2]
+
+    r = N.zeros( ( n_frames, 3, 3 ) )
+    t = N.zeros( ( n_frames, 3 ) )
+    rmsd = N.zeros( n_frames )
+    perc = N.zeros( n_frames )
+    iterations = N.zeros( n_frames, int )
+
+    rmsd_old = N.zeros( n_frames )
+    stdv_old = N.zeros( n_frames )
+
+    mask = N.ones( ( n_frames, n_atoms ), bool )
+    active = N.arange( n_frames )
+
+    n = 0
+
+    while len( active ):
+
+        m, ya = mask[ active ], y[ active ]
+
+        ## find transformation for best match
+        ra, ta = findTransformations( x, ya, m )
+
+        ## calculate row distances
+        d = N.sqrt( N.sum( ( x - applyTransformations( ya, ra, ta ) )**2,
+                           2 ) ) * m
+
+        ## calculate rmsd and stdv of considered rows
+        k = N.sum( m, 1 )
+        rms = N.sqrt( N.sum( d**2, 1 ) / k )
+        avg = N.sum( d, 1 ) / k
+
+        var = N.sum( ( ( d - avg[:, N.newaxis] ) * m )**2, 1 )
+        var = N.where( k > 1, var / N.maximum( k - 1., 1. ), 0. )
+        stdv = N.sqrt( var )
+
+        ## check conditions for convergence
+        with N.errstate( divide='ignore', invalid='ignore' ):
+            d_stdv = N.abs( 1 - stdv_old[ active ] / stdv )
+
+        converged = ( N.abs( rms - rmsd_old[ active ] ) < eps_rmsd ) \
+                    & ( d_stdv < eps_stdv )
+
+        rmsd_old[ active ] = rms
+        stdv_old[ active ] = stdv
+
+        ## store result
+        r[ active ], t[ active ] = ra, ta
+        rmsd[ active ] = rms
+        perc[ active ] = k * 1. / n_atoms
+        iterations[ active ] += 1
+
+        ## throw out non-matching rows
+        mask[ active ] = m & ( d < ( rms + z * stdv )[:, N.newaxis] )
+
+        n += 1
+
+        if n_iterations and n >= n_iterations:
+            break
+
+        active = active[ N.logical_not( converged ) ]
+
+    return (r, t), (perc, rmsd, iterations)
+
+
+def _qcpEigenvalue( m, e0 ):
+    """
+    Largest eigenvalue of the QCP key matrix of each correlation matrix,
+    found by Newton iteration on its characteristic polynomial, vectorized
+    over all matrices (Theobald, Acta Cryst A 61, 2005).
+
+    :param m: correlation matrices, ... x 3 x 3
+    :type  m: array
+    :param e0: upper bound of the eigenvalue (half of the summed squared
+               norms of both coordinate sets), ...
+    :type  e0: array
+
+    :return: largest eigenvalue, ...
+    :rtype: array
+    """
+    Sxx, Sxy, Sxz = m[...,0,0], m[...,0,1], m[...,0,2]
+    Syx, Syy, Syz = m[...,1,0], m[...,1,1], m[...,1,2]
+    Szx, Szy, Szz = m[...,2,0], m[...,2,1], m[...,2,2]
+
+    Sxx2, Syy2, Szz2 = Sxx**2, Syy**2, Szz**2
+    Sxy2, Syz2, Sxz2 = Sxy**2, Syz**2, Sxz**2
+    Syx2, Szy2, Szx2 = Syx**2, Szy**2, Szx**2
+
+    SyzSzymSyySzz2 = 2. * ( Syz * Szy - Syy * Szz )
+    Sxx2Syy2Szz2Syz2Szy2 = Syy2 + Szz2 - Sxx2 + Syz2 + Szy2
+
+    ## coefficients of the characteristic polynomial of the key matrix
+    c2 = -2. * ( Sxx2 + Syy2 + Szz2 + Sxy2 + Syx2 + Sxz2 + Szx2 + Syz2
+                 + Szy2 )
+    c1 = 8. * ( Sxx * Syz * Szy + Syy * Szx * Sxz + Szz * Sxy * Syx
+                - Sxx * Syy * Szz - Syz * Szx * Sxy - Szy * Syx * Sxz )
+
+    SxzpSzx, SyzpSzy, SxypSyx = Sxz + Szx, Syz + Szy, Sxy + Syx
+    SyzmSzy, SxzmSzx, SxymSyx = Syz - Szy, Sxz - Szx, Sxy - Syx
+    SxxpSyy, SxxmSyy = Sxx + Syy, Sxx - Syy
+    Sxy2Sxz2Syx2Szx2 = Sxy2 + Sxz2 - Syx2 - Szx2
+
+    c0 = Sxy2Sxz2Syx2Szx2**2 \
+       + ( Sxx2Syy2Szz2Syz2Szy2 + SyzSzymSyySzz2 ) \
+       * ( Sxx2Syy2Szz2Syz2Szy2 - SyzSzymSyySzz2 ) \
+       + ( -SxzpSzx * SyzmSzy + SxymSyx * ( SxxmSyy - Szz ) ) \
+       * ( -SxzmSzx * SyzpSzy + SxymSyx * ( SxxmSyy + Szz ) ) \
+       + ( -SxzpSzx * SyzpSzy - SxypSyx * ( SxxpSyy - Szz ) ) \
+       * ( -SxzmSzx * SyzmSzy - SxypSyx * ( SxxpSyy + Szz ) ) \
+       + ( SxypSyx * SyzpSzy + SxzpSzx * ( SxxmSyy + Szz ) ) \
+       * ( -SxymSyx * SyzmSzy + SxzpSzx * ( SxxpSyy + Szz ) ) \
+       + ( SxypSyx * SyzmSzy + SxzmSzx * ( SxxmSyy - Szz ) ) \
+       * ( -SxymSyx * SyzpSzy + SxzmSzx * ( SxxpSyy - Szz ) )
+
+    ## Newton iteration for the largest root, starting from its upper bound
+    e = N.array( e0, N.float64 )
+
+    for i in range( 50 ):
+        e2 = e * e
+        b = ( e2 + c2 ) * e
+        a = b + c1
+        with N.errstate( divide='ignore', invalid='ignore' ):
+            delta = N.nan_to_num( ( a * e + c0 ) / ( 2. * e2 * e + b + a ) )
+        e -= delta
+
+        if N.all( N.abs( delta ) <= 1e-11 * N.abs( e ) ):
+            break
+
+    return e
+
+
+def qcpRmsd( m, g, n ):
+    """
+    Rmsd after optimal superposition, calculated directly from the
+    correlation matrices of (centered) coordinate pairs with the quaternion
+    characteristic polynomial (QCP) method (Theobald, Acta Cryst A 61, 2005).
+    No rotation matrix is built. The largest eigenvalue of each 4 x 4
+    key matrix is found by Newton iteration, vectorized over all pairs.
+
+    :param m: correlation matrices sum( x_i^T y_i ) of centered coordinates,
+              ... x 3 x 3
+    :type  m: array
+    :param g: sum of the squared norms of both coordinate sets, ...
+    :type  g: array
+    :param n: number of atoms
+    :type  n: int
+
+    :return: rmsd for each pair of coordinate sets, ...
+    :rtype: array
+    """
+    m = N.asarray( m, N.float64 )
+    e0 = 0.5 * N.asarray( g, N.float64 )
+
+    e = _qcpEigenvalue( m, e0 )
+
+    return N.sqrt( N.maximum( 2. * ( e0 - e ) / n, 0. ) )
+
+
+def qcpRotations( m, g, eps=1e-6 ):
+    """
+    Optimal rotations from the correlation matrices of (centered)
+    coordinate pairs with the QCP method (Liu, Agrafiotis & Theobald,
+    J Comput Chem 31, 2010): the rotation quaternion is the eigenvector
+    of the largest eigenvalue of the key matrix and is taken from the
+    adjoint of (key matrix - eigenvalue). Vectorized over all pairs and,
+    for stacks of small matrices, much faster than one SVD per pair.
+    The result is always a proper rotation.
+
+    :param m: correlation matrices sum( x_i^T y_i ) of centered coordinates,
+              ... x 3 x 3
+    :type  m: array
+    :param g: sum of the squared norms of both coordinate sets, ...
+    :type  g: array
+    :param eps: adjoint columns shorter than this are considered
+                degenerate (default: 1e-6)
+    :type  eps: float
+
+    :return: rotation matrices r with x ~ y . r^T, ... x 3 x 3
+    :rtype: array
+    """
+    m = N.asarray( m, N.float64 )
+    e = _qcpEigenvalue( m, 0.5 * N.asarray( g, N.float64 ) )
+
+    Sxx, Sxy, Sxz = m[...,0,0], m[...,0,1], m[...,0,2]
+    Syx, Syy, Syz = m[...,1,0], m[...,1,1], m[...,1,2]
+    Szx, Szy, Szz = m[...,2,0], m[...,2,1], m[...,2,2]
+
+    ## key matrix minus largest eigenvalue (symmetric)
+    a11 = Sxx + Syy + Szz - e
+    a12 = Syz - Szy
+    a13 = Szx - Sxz
+    a14 = Sxy - Syx
+    a22 = Sxx - Syy - Szz - e
+    a23 = Sxy + Syx
+    a24 = Szx + Sxz
+    a33 = Syy - Sxx - Szz - e
+    a34 = Syz + Szy
+    a44 = Szz - Sxx - Syy - e
+    a21, a31, a41, a32, a42, a43 = a12, a13, a14, a23, a24, a34
+
+    a3344_4334 = a33 * a44 - a43 * a34
+    a3244_4234 = a32 * a44 - a42 * a34
+    a3243_4233 = a32 * a43 - a42 * a33
+    a3143_4133 = a31 * a43 - a41 * a33
+    a3144_4134 = a31 * a44 - a41 * a34
+    a3142_4132 = a31 * a42 - a41 * a32
+    a1324_1423 = a13 * a24 - a14 * a23
+    a1224_1422 = a12 * a24 - a14 * a22
+    a1223_1322 = a12 * a23 - a13 * a22
+    a1124_1421 = a11 * a24 - a14 * a21
+    a1123_1321 = a11 * a23 - a13 * a21
+    a1122_1221 = a11 * a22 - a12 * a21
+
+    ## candidate eigenvectors: columns of the adjoint matrix
+    candidates = [
+        ( a22*a3344_4334 - a23*a3244_4234 + a24*a3243_4233,
+         -a21*a3344_4334 + a23*a3144_4134 - a24*a3143_4133,
+          a21*a3244_4234 - a22*a3144_4134 + a24*a3142_4132,
+         -a21*a3243_4233 + a22*a3143_4133 - a23*a3142_4132 ),
+        ( a12*a3344_4334 - a13*a3244_4234 + a14*a3243_4233,
+         -a11*a3344_4334 + a13*a3144_4134 - a14*a3143_4133,
+          a11*a3244_4234 - a12*a3144_4134 + a14*a3142_4132,
+         -a11*a3243_4233 + a12*a3143_4133 - a13*a3142_4132 ),
+        ( a42*a1324_1423 - a43*a1224_1422 + a44*a1223_1322,
+         -a41*a1324_1423 + a43*a1124_1421 - a44*a1123_1321,
+          a41*a1224_1422 - a42*a1124_1421 + a44*a1122_1221,
+         -a41*a1223_1322 + a42*a1123_1321 - a43*a1122_1221 ),
+        ( a32*a1324_1423 - a33*a1224_1422 + a34*a1223_1322,
+         -a31*a1324_1423 + a33*a1124_1421 - a34*a1123_1321,
+          a31*a1224_1422 - a32*a1124_1421 + a34*a1122_1221,
+         -a31*a1223_1322 + a32*a1123_1321 - a33*a1122_1221 ) ]
+
+    ## take the first column that is not degenerate, identity otherwise
+    q = N.zeros( e.shape + (4,) )
+    q[..., 0] = 1.
+    done = N.zeros( e.shape, bool )
+
+    for c in candidates:
+        c = N.stack( c, -1 )
+        qsqr = N.sum( c**2, -1 )
+        use = ~done & ( qsqr >= eps )
+        q[ use ] = c[ use ] / N.sqrt( qsqr[ use ] )[:, N.newaxis]
+        done |= use
+
+    q1, q2, q3, q4 = q[...,0], q[...,1], q[...,2], q[...,3]
+
+    a2, x2, y2, z2 = q1 * q1, q2 * q2, q3 * q3, q4 * q4
+    xy, az, zx = q2 * q3, q1 * q4, q4 * q2
+    ay, yz, ax = q1 * q3, q3 * q4, q1 * q2
+
+    r = N.empty( e.shape + (3, 3) )
+    r[...,0,0] = a2 + x2 - y2 - z2
+    r[...,0,1] = 2 * ( xy + az )
+    r[...,0,2] = 2 * ( zx - ay )
+    r[...,1,0] = 2 * ( xy - az )
+    r[...,1,1] = a2 - x2 + y2 - z2
+    r[...,1,2] = 2 * ( yz + ax )
+    r[...,2,0] = 2 * ( zx + ay )
+    r[...,2,1] = 2 * ( yz - ax )
+    r[...,2,2] = a2 - x2 - y2 + z2
+
+    return r
+
+
+def _rmsdRows( yt, g, start, stop, noFit=0 ):
+    """
+    Rmsd of frames start..stop-1 to all following frames.
+
+    :param yt: all frames as N x (F*3) matrix, see L{_frameColumns}
+    :type  yt: array
+
+    :return: condensed rmsd values of the rows start..stop-1
+    :rtype: array
+    """
+    n_atoms, n_frames = yt.shape[0], yt.shape[1] // 3
+
+    a = N.transpose( yt[ :, 3 * start : 3 * stop ] )
+    b = yt[ :, 3 * start : ]
+
+    ## correlation matrices of all pairs with one matrix product
+    m = N.dot( a, b ).reshape( stop - start, 3, n_frames - start, 3 )
+    m = N.transpose( m, (0, 2, 1, 3) )
+
+    gg = g[ start : stop, N.newaxis ] + g[ N.newaxis, start : ]
+
+    if noFit:
+        d = N.sqrt( N.maximum(
+            ( gg - 2. * N.trace( m, axis1=2, axis2=3 ) ) / n_atoms, 0. ) )
+    else:
+        d = qcpRmsd( m, gg, n_atoms )
+
+    ## keep only pairs j > i
+    upper = N.arange( n_frames - start )[N.newaxis, :] \
+            > N.arange( stop - start )[:, N.newaxis]
+
+    return d[ upper ]
+
+
+def _frameColumns( y ):
+    """
+    :param y: coordinate frames, F x N x 3
+    :type  y: array
+
+    :return: frames side by side, N x (F*3), column 3*i+k is coordinate k
+             of frame i
+    :rtype: array
+    """
+    return N.ascontiguousarray( N.transpose( y, (1, 0, 2) ) ).reshape(
+        y.shape[1], -1 )
+
+
+## frames shared with worker processes of pairwiseRmsd
+_shared = {}
+
+def _initWorker( yt, g, noFit ):
+    _shared.update( yt=yt, g=g, noFit=noFit )
+
+def _rmsdRowsWorker( rows ):
+    return rows, _rmsdRows( _shared['yt'], _shared['g'], rows[0], rows[1],
+                            _shared['noFit'] )
+
+
+def condensedIndex( n, i, j ):
+    """
+    Position of pair i, j (i < j) in a condensed matrix of n items, which
+    lists the upper triangle of a n x n matrix row by row (as used by
+    scipy.spatial.distance).
+
+    :param n: number of items
+    :type  n: int
+    :param i: first index (or array of indices)
+    :type  i: int OR array
+    :param j: second index, > i (or array of indices)
+    :type  j: int OR array
+
+    :return: index into condensed matrix
+    :rtype: int OR array
+    """
+    return n * i - i * ( i + 1 ) // 2 + j - i - 1
+
+
+def pairwiseRmsd( frames, noFit=0, out=None, ncpu=1, block=None ):
+    """
+    Rmsd between all pairs of coordinate frames. Only the upper triangle
+    is calculated and returned as condensed matrix (see L{condensedIndex}).
+    Rows of frames are processed in blocks; the correlation matrices of all
+    pairs in a block are calculated with a single matrix product and
+    reduced to rmsd values by L{qcpRmsd}.
+
+    :param frames: coordinate frames, F x N x 3
+    :type  frames: array
+    :param noFit: do not superimpose the frames (default: 0)
+    :type  noFit: 1|0
+    :param out: result array of length F*(F-1)/2 OR name of a file to
+                create a memory-mapped float32 result (default: None,
+                new float32 array)
+    :type  out: array OR str
+    :param ncpu: number of worker processes (default: 1, no pool)
+    :type  ncpu: int
+    :param block: number of frames (rows) per block
+                  (default: None, ~250000 pairs per block)
+    :type  block: int
+
+    :return: condensed rmsd matrix, F*(F-1)/2
+    :rtype: array( float32 ) OR numpy.memmap
+    """
+    y = N.asarray( frames, N.float64 )
+    n_frames = len( y )
+    n_pairs = n_frames * ( n_frames - 1 ) // 2
+
+    if not noFit:
+        y = y - N.mean( y, 1 )[:, N.newaxis, :]
+
+    g = N.sum( N.sum( y * y, 2 ), 1 )
+    yt = _frameColumns( y )
+    del y
+
+    if out is None:
+        out = N.zeros( n_pairs, N.float32 )
+    elif isinstance( out, str ):
+        out = N.memmap( out, N.float32, mode='w+', shape=( n_pairs, ) )
+
+    block = block or max( 1, 2**18 // max( n_frames, 1 ) )
+    rows = [ ( i, min( i + block, n_frames ) )
+             for i in range( 0, n_frames - 1, block ) ]
+
+    def save( rows, d ):
+        start = condensedIndex( n_frames, rows[0], rows[0] + 1 )
+        out[ start : start + len( d ) ] = d
+
+    if ncpu > 1 and len( rows ) > 1:
+        import multiprocessing
+
+        with multiprocessing.Pool( ncpu, _initWorker,
+                                   ( yt, g, noFit ) ) as pool:
+            for r, d in pool.imap_unordered( _rmsdRowsWorker, rows ):
+                save( r, d )
+    else:
+        for r in rows:
+            save( r, _rmsdRows( yt, g, r[0], r[1], noFit ) )
+
+    return out
+
+
 def rowDistances( x, y ):
     """
     Calculate the distances between the items of two arrays (of same shape)
@@ -187,11 +757,108 @@ class Test(BT.BiskitTest):
 
         self.assertAlmostEqual(r, e, 6)
 
+    def test_matchAll( self ):
+        """rmsFit batched superposition test"""
+        from . import tools as T
+
+        self.traj = T.load( T.testRoot('lig_pcr_00/traj.dat') )
+        x = self.traj.ref.xyz
+        y = self.traj.frames
+
+        (r, t), (perc, rmsd, n) = matchAll( x, y, n_iterations=0 )
+
+        for i in [0, 5, len(y)-1]:
+            (r1, t1), trace = match( x, y[i], n_iterations=0 )
+
+            self.assertTrue( N.allclose( r[i], r1, atol=1e-6 ) )
+            self.assertTrue( N.allclose( t[i], t1, atol=1e-4 ) )
+            self.assertAlmostEqual( rmsd[i], trace[-1][1], 3 )
+            self.assertAlmostEqual( perc[i], trace[-1][0], 2 )
+            self.assertEqual( n[i], len( trace ) )
+
+        ## mirror image can only be matched with a reflection
+        r, t = findTransformations( x, [ x * [1, 1, -1] ] )
+        self.assertAlmostEqual( N.linalg.det( r[0] ), 1., 6 )
+
+        ## separate superposition of segments
+        starts = [ 0, 10, 200 ]
+        r, t = findSegmentTransformations( x, y[:5], starts )
+        self.assertEqual( r.shape, ( 5, 3, 3, 3 ) )
+
+        for i, (a, b) in enumerate( zip( starts, starts[1:] + [len(x)] ) ):
+            r1, t1 = findTransformations( x[a:b], y[:5, a:b] )
+            self.assertTrue( N.allclose( r[:, i], r1, atol=1e-6 ) )
+            self.assertTrue( N.allclose( t[:, i], t1, atol=1e-4 ) )
+
+    def test_pairwiseRmsd( self ):
+        """rmsFit.pairwiseRmsd test"""
+        from . import tools as T
+
+        self.traj = T.load( T.testRoot('lig_pcr_00/traj.dat') )
+        f = N.array( self.traj.frames[:20], N.float64 )
+
+        ## the test trajectory is already fitted -- rotate and move frames
+        rand = N.random.RandomState( 42 )
+        for x in f:
+            q = N.linalg.qr( rand.normal( size=(3, 3) ) )[0]
+            q[:, 0] *= N.sign( N.linalg.det( q ) )
+            x[:] = N.dot( x, q ) + rand.normal( scale=10., size=3 )
+
+        d = pairwiseRmsd( f, block=3 )
+        self.assertEqual( len( d ), 20 * 19 / 2 )
+
+        for i, j in [ (0, 1), (3, 12), (18, 19) ]:
+            r, t = findTransformations( f[i], f[j][N.newaxis] )
+            y = N.dot( f[j], N.transpose( r[0] ) ) + t[0]
+            rms = N.sqrt( N.average( N.sum( ( y - f[i] )**2, 1 ) ) )
+            self.assertAlmostEqual( d[ condensedIndex( 20, i, j ) ], rms, 4 )
+
+        d2 = pairwiseRmsd( f, noFit=1 )
+        r = N.sqrt( N.sum( ( f[3] - f[12] )**2, 1 ) )
+        self.assertAlmostEqual( d2[ condensedIndex( 20, 3, 12 ) ],
+                                N.sqrt( N.average( r**2 ) ), 4 )
+        self.assertTrue( N.all( d2 > d ) )
+
     EXPECT = N0.array( [[ 0.9999011,   0.01311352,  0.00508244,],
                        [-0.01310219,  0.99991162, -0.00225578,],
                        [-0.00511157,  0.00218896,  0.99998454 ]] )
 
 
+class LongTest(BT.BiskitTest):
+    """Benchmark pairwise rmsd against per-pair superposition"""
+
+    TAGS = [ BT.LONG ]
+
+    def prepare(self):
+        self.f_out = tempfile.mktemp( '.dat', 'rmsd_' )
+
+    def cleanUp(self):
+        from . import tools as T
+        T.tryRemove( self.f_out )
+
+    def test_benchmark( self ):
+        """rmsFit.pairwiseRmsd benchmark"""
+        from . import tools as T
+
+        frames = T.load( T.testRoot('lig_pcr_00/traj.dat') ).frames
+
+        t = time.time()
+        self.d = pairwiseRmsd( frames, out=self.f_out )
+        self.t_new = time.time() - t
+
+        t = time.time()
+        self.ref = [ match( frames[i], frames[j] )[1][0][1]
+                     for i in range( len(frames) )
+                     for j in range( i+1, len(frames) ) ]
+        self.t_old = time.time() - t
+
+        if self.local:
+            print('%i pairs: blocked %5.2f s, per pair %5.2f s' %\
+                  (len(self.ref), self.t_new, self.t_old))
+
+        self.assertTrue( N.all( N.abs( self.d - self.ref ) < 1e-3 ) )
+
+
 if __name__ == '__main__':
 
     BT.localTest()
@@ -0,0 +1,333 @@
+##
+## Biskit, a toolkit for the manipulation of macromolecular structures
+## Copyright (C) 2004-2018 Raik Gruenberg & Johan Leckner
+##
+## This program is free software; you can redistribute it and/or
+## modify it under the terms of the GNU General Public License as
+## published by the Free Software Foundation; either version 3 of the
+## License, or any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+## General Public License for more details.
+##
+## You find a copy of the GNU General Public License in the file
+## license.txt along with this program; if not, write to the Free
+## Software Foundation, Inc., 675 Mass Ave, Cambridge, MA 02139, USA.
+##
+##
+
+"""
+Vectorized backbone and side chain torsion angles of models and
+trajectories.
+"""
+
+import numpy as N
+
+import biskit.molUtils as MU
+from biskit.errors import BiskitError
+
+
+class TorsionError( BiskitError ):
+    pass
+
+
+def dihedral( a, b, c, d ):
+    """
+    Torsion angle(s) defined by four (sets of) atom positions, following
+    the IUPAC convention (clockwise rotation of the bond b-c is positive).
+    All arguments can be arrays of any matching shape ... x 3.
+
+    :param a: coordinates of first atom(s)
+    :type  a: array
+    :param b: coordinates of second atom(s)
+    :type  b: array
+    :param c: coordinates of third atom(s)
+    :type  c: array
+    :param d: coordinates of fourth atom(s)
+    :type  d: array
+
+    :return: angle(s) in degrees, -180..180
+    :rtype: float OR array
+    """
+    a, b, c, d = [ N.asarray( x, N.float64 ) for x in (a, b, c, d) ]
+
+    b1 = b - a
+    b2 = c - b
+    b3 = d - c
+
+    n1 = N.cross( b1, b2 )
+    n2 = N.cross( b2, b3 )
+
+    x = N.sum( n1 * n2, -1 )
+    y = N.sqrt( N.sum( b2**2, -1 ) ) * N.sum( b1 * n2, -1 )
+
+    return N.degrees( N.arctan2( y, x ) )
+
+
+class Torsions:
+    """
+    Calculate phi, psi, omega and side chain chi angles for all residues
+    of a model -- or of all frames of a trajectory. The atom quadruples of
+    all angles are looked up only once from a reference model; all angles
+    of a structure (or of a block of frames) are then calculated in one
+    vectorized pass::
+
+      t = Torsions( model )
+      t.calc( model.xyz )     -> { 'phi': array( N_res ), 'psi': ..}
+      t.calc( traj.frames )   -> { 'phi': array( N_frames x N_res ), ..}
+
+      t.addProfiles( model )  -> residue profiles 'phi', 'psi', ...
+      t.addTrajProfiles( traj ) -> trajectory profiles 'phi', 'psi', ...
+                                   ( N_frames x N_res each )
+
+    Angles that are not defined (first phi and last psi and omega of each
+    chain, missing atoms, chi angles of residues without that side chain
+    torsion) are N.nan. Non-standard residues are mapped to their standard
+    parent (see molUtils.nonStandardAA).
+    """
+
+    #: backbone torsions as atom names, -1 / +1 refer to the previous /
+    #: next residue of the same chain
+    BACKBONE = { 'phi':   [ ('C', -1), ('N', 0), ('CA', 0), ('C', 0) ],
+                 'psi':   [ ('N', 0), ('CA', 0), ('C', 0), ('N', 1) ],
+                 'omega': [ ('CA', 0), ('C', 0), ('N', 1), ('CA', 1) ] }
+
+    #: side chain torsions of standard amino acids
+    CHI = {
+        'ARG': [ ('N','CA','CB','CG'), ('CA','CB','CG','CD'),
+                 ('CB','CG','CD','NE'), ('CG','CD','NE','CZ') ],
+        'ASN': [ ('N','CA','CB','CG'), ('CA','CB','CG','OD1') ],
+        'ASP': [ ('N','CA','CB','CG'), ('CA','CB','CG','OD1') ],
+        'CYS': [ ('N','CA','CB','SG') ],
+        'GLN': [ ('N','CA','CB','CG'), ('CA','CB','CG','CD'),
+                 ('CB','CG','CD','OE1') ],
+        'GLU': [ ('N','CA','CB','CG'), ('CA','CB','CG','CD'),
+                 ('CB','CG','CD','OE1') ],
+        'HIS': [ ('N','CA','CB','CG'), ('CA','CB','CG','ND1') ],
+        'ILE': [ ('N','CA','CB','CG1'), ('CA','CB','CG1','CD1') ],
+        'LEU': [ ('N','CA','CB','CG'), ('CA','CB','CG','CD1') ],
+        'LYS': [ ('N','CA','CB','CG'), ('CA','CB','CG','CD'),
+                 ('CB','CG','CD','CE'), ('CG','CD','CE','NZ') ],
+        'MET': [ ('N','CA','CB','CG'), ('CA','CB','CG','SD'),
+                 ('CB','CG','SD','CE') ],
+        'PHE': [ ('N','CA','CB','CG'), ('CA','CB','CG','CD1') ],
+        'PRO': [ ('N','CA','CB','CG'), ('CA','CB','CG','CD') ],
+        'SER': [ ('N','CA','CB','OG') ],
+        'THR': [ ('N','CA','CB','OG1') ],
+        'TRP': [ ('N','CA','CB','CG'), ('CA','CB','CG','CD1') ],
+        'TYR': [ ('N','CA','CB','CG'), ('CA','CB','CG','CD1') ],
+        'VAL': [ ('N','CA','CB','CG1') ] }
+
+    #: all angle names in default order
+    NAMES = [ 'phi', 'psi', 'omega', 'chi1', 'chi2', 'chi3', 'chi4' ]
+
+    def __init__( self, model, breaks=1, block=1000 ):
+        """
+        :param model: reference structure (e.g. Trajectory.ref)
+        :type  model: PDBModel
+        :param breaks: do not connect residues across chain breaks for
+                       backbone torsions (default: 1)
+        :type  breaks: 1|0
+        :param block: number of frames processed at once (default: 1000)
+        :type  block: int
+        """
+        self.lenAtoms = model.lenAtoms()
+        self.lenResidues = model.lenResidues()
+        self.block = block
+
+        #: atom indices of each angle, N_res x 4, -1 for missing atoms
+        self.indices = self.__quadruples( model, breaks )
+
+
+    def __atomIndex( self, model, name ):
+        """index of first atom with given name in each residue (or -1)"""
+        hits = N.flatnonzero( model.maskFrom( 'name', name ) )
+        resMap = N.asarray( model.resMap() )
+
+        r = N.full( self.lenResidues, -1, int )
+        r[ resMap[ hits[::-1] ] ] = hits[::-1]
+        return r
+
+
+    def __quadruples( self, model, breaks ):
+        """look up atom indices of all angles of all residues"""
+        atoms = {}
+        def index( name ):
+            if name not in atoms:
+                atoms[ name ] = self.__atomIndex( model, name )
+            return atoms[ name ]
+
+        ## chain of each residue
+        ri = model.resIndex()
+        rchain = N.take( model.chainMap( breaks=breaks ), ri )
+
+        r = {}
+
+        for angle, atomdef in self.BACKBONE.items():
+            q = N.full( ( self.lenResidues, 4 ), -1, int )
+
+            for j, (name, shift) in enumerate( atomdef ):
+                i = N.arange( self.lenResidues ) + shift
+                valid = ( i >= 0 ) & ( i < self.lenResidues )
+                valid[ valid ] &= rchain[ i[valid] ] == rchain[ valid ]
+                q[ valid, j ] = index( name )[ i[valid] ]
+
+            q[ N.any( q < 0, 1 ) ] = -1
+            r[ angle ] = q
+
+        ## residue type of each residue, non-standard residues -> parent
+        resnames = N.asarray( model.atom2resProfile( 'residue_name' ) )
+        resnames = N.array( [ MU.nonStandardAA.get( n, n ) for n in resnames ],
+                            dtype=object )
+
+        for n in range( 4 ):
+            q = N.full( ( self.lenResidues, 4 ), -1, int )
+
+            for res, chis in self.CHI.items():
+                if len( chis ) <= n:
+                    continue
+                sel = N.flatnonzero( resnames == res )
+                for j, name in enumerate( chis[n] ):
+                    q[ sel, j ] = index( name )[ sel ]
+
+            q[ N.any( q < 0, 1 ) ] = -1
+            r[ 'chi%i' % (n+1) ] = q
+
+        return r
+
+
+    def calc( self, xyz, names=None ):
+        """
+        Calculate torsion angles from coordinates of one structure or of
+        many frames (in blocks of frames).
+
+        :param xyz: coordinates, N_atoms x 3 OR N_frames x N_atoms x 3
+        :type  xyz: array (or memmap)
+        :param names: angles to calculate (default: None, all of NAMES)
+        :type  names: [ str ]
+
+        :return: angles in degrees for each residue (and frame), N.nan if
+                 not defined, N_res OR N_frames x N_res
+        :rtype: { str : array }
+
+        :raise TorsionError: if coordinates do not match the model
+        """
+        names = names or self.NAMES
+
+        if N.shape( xyz )[-2:] != ( self.lenAtoms, 3 ):
+            raise TorsionError( 'coordinates do not match the model' )
+
+        single = N.ndim( xyz ) == 2
+        if single:
+            xyz = N.asarray( xyz )[ N.newaxis ]
+
+        ## all quadruples of all angles, angle after angle
+        q = N.concatenate( [ self.indices[ n ] for n in names ] )
+        missing = N.any( q < 0, 1 )
+        q = N.where( q < 0, 0, q )
+
+        a = N.empty( ( len( xyz ), len( q ) ) )
+
+        for start in range( 0, len( xyz ), self.block ):
+            frames = N.asarray( xyz[ start : start + self.block ] )
+            a[ start : start + len( frames ) ] = \
+               dihedral( *[ frames[:, q[:, j]] for j in range( 4 ) ] )
+
+        a[:, missing] = N.nan
+
+        if single:
+            a = a[0]
+
+        return dict( zip( names, N.split( a, len( names ), axis=-1 ) ) )
+
+
+    def addProfiles( self, model, names=None ):
+        """
+        Add torsion angles of a model as residue profiles.
+
+        :param model: structure with the same atom content as the
+                      reference model
+        :type  model: PDBModel
+        :param names: angles to calculate (default: None, all of NAMES)
+        :type  names: [ str ]
+        """
+        for name, values in self.calc( model.xyz, names ).items():
+            model.residues.set( name, values, unit='degree',
+                                comment='%s torsion angle' % name )
+
+
+    def addTrajProfiles( self, traj, names=None ):
+        """
+        Add torsion angles of all frames as trajectory profiles, each
+        holding an N_frames x N_residues array.
+
+        :param traj: trajectory with the same atom content as the
+                     reference model
+        :type  traj: Trajectory
+        :param names: angles to calculate (default: None, all of NAMES)
+        :type  names: [ str ]
+        """
+        for name, values in self.calc( traj.frames, names ).items():
+            traj.setProfile( name, values, unit='degree',
+                             comment='%s torsion angle of each residue' % name )
+
+
+#############
+##  TESTING
+#############
+import biskit.test as BT
+
+class Test(BT.BiskitTest):
+    """Torsions test"""
+
+    def prepare(self):
+        import biskit.tools as T
+        self.traj = T.load( T.testRoot('/lig_pcr_00/traj.dat') )
+
+    def test_dihedral(self):
+        """torsions.dihedral test"""
+        a = [ [1, 0, 0], [1, 0, 0] ]
+        b = [ 0, 0, 0 ]
+        c = [ 0, 1, 0 ]
+        d = [ [0, 1, 1], [1, 1, 0] ]
+        self.assertTrue( N.allclose( dihedral( a, b, c, d ), [ -90, 0 ] ) )
+
+    def test_Torsions(self):
+        """Torsions for model and trajectory test"""
+        m = self.traj.ref
+        self.t = Torsions( m )
+
+        r = self.t.calc( m.xyz )
+        self.assertEqual( r['phi'].shape, ( m.lenResidues(), ) )
+
+        ## compare with single angle of residue 5
+        i = m.resIndex()
+        names = N.array( m['name'] )
+        def atom( res, name ):
+            return m.xyz[ i[res] + N.flatnonzero( names[ i[res]: ] == name )[0] ]
+
+        phi5 = dihedral( atom(4, 'C'), atom(5, 'N'), atom(5, 'CA'),
+                         atom(5, 'C') )
+        self.assertAlmostEqual( r['phi'][5], phi5, 5 )
+
+        self.assertTrue( N.isnan( r['phi'][0] ) and N.isnan( r['psi'][-1] ) )
+
+        ## chi angles only where defined
+        resnames = N.array( m.atom2resProfile( 'residue_name' ) )
+        self.assertTrue( N.all( N.isnan( r['chi1'][ resnames == 'GLY' ] ) ) )
+        self.assertFalse( N.any( N.isnan( r['chi4'][ resnames == 'LYS' ] ) ) )
+
+        self.t.addTrajProfiles( self.traj, [ 'phi', 'psi' ] )
+        p = self.traj.profile( 'psi' )
+        self.assertEqual( p.shape, ( self.traj.lenFrames(), m.lenResidues() ) )
+
+        f = self.traj[11]
+        self.t.addProfiles( f )
+        self.assertTrue( N.allclose( f['psi'], p[11], equal_nan=True ) )
+
+
+if __name__ == '__main__':
+
+    BT.localTest()